@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import argparse
+import time
+
+from utils import Output, is_valid_user, add_arguments
+from classes import DbService, Model
+from classes.ann import ContentIndex, recall
+from classes.cache import HashCache
+from classes.content import top_k_similarities
+
+parser = argparse.ArgumentParser(description='Measures the recall of the approximate content similarities against '
+                                             'the exact cosine similarities',
+                                 usage='python benchmark_ann.py user password [OPTIONS]')
+
+add_arguments(parser)
+
+parser.add_argument('-n', '--sample',
+                    dest='sample_len',
+                    type=int,
+                    help='Maximum number of courses. All courses are used by default',
+                    metavar='')
+
+parser.add_argument('-k', '--top-k',
+                    dest='top_k',
+                    type=int,
+                    default=20,
+                    help='Maximum number of similar courses per course',
+                    metavar='')
+
+parser.add_argument('-m', '--min-similarity',
+                    dest='min_similarity',
+                    type=float,
+                    default=0.5,
+                    help='Minimum similarity of a course',
+                    metavar='')
+
+parser.add_argument('--tables',
+                    dest='n_tables',
+                    type=int,
+                    default=ContentIndex.DEFAULT_TABLES,
+                    help='Number of hash tables of the index',
+                    metavar='')
+
+parser.add_argument('--bits',
+                    dest='n_bits',
+                    type=int,
+                    help='Number of bits of the index codes. Chosen from the number of courses by default',
+                    metavar='')
+
+parser.add_argument('-j', '--jobs',
+                    dest='jobs',
+                    type=int,
+                    default=1,
+                    help='Number of processes used by the exact similarities',
+                    metavar='')
+
+args = parser.parse_args()
+
+output = Output()
+
+# Normalized courses contents, keyed by the content hash. Filled by the ETL pipeline
+NORMALIZED_TEXT_CACHE_FILE = 'data/normalized_text_cache.csv'
+
+
+def main():
+    output.title('CONTENT INDEX BENCHMARK', color='magenta')
+    output.start_spinner('Validating user credentials')
+    if is_valid_user(args.username, args.password):
+        output.spinner_success()
+    else:
+        output.spinner_fail('Invalid username or password')
+        exit(1)
+
+    model = Model(args.username, args.password, args.db_name, args.db_host)
+
+    try:
+        output.start_spinner('Building the content index')
+        start = time.perf_counter()
+        index = model.create_content_index(sample_len=args.sample_len, n_jobs=args.jobs,
+                                           cache=HashCache(['normalized'], NORMALIZED_TEXT_CACHE_FILE),
+                                           n_tables=args.n_tables, n_bits=args.n_bits)
+        build_seconds = time.perf_counter() - start
+        output.spinner_success('{} courses, {} tables of {} bits'.format(len(index.course_ids), index.n_tables,
+                                                                         index.n_bits))
+
+        output.start_spinner('Computing the exact similarities')
+        start = time.perf_counter()
+        exact = list(top_k_similarities(index.vectors, top_k=args.top_k, min_similarity=args.min_similarity,
+                                        n_jobs=args.jobs))
+        exact_seconds = time.perf_counter() - start
+        output.spinner_success()
+
+        output.start_spinner('Computing the approximate similarities')
+        start = time.perf_counter()
+        approximate = list(index.top_k_similarities(top_k=args.top_k, min_similarity=args.min_similarity))
+        approximate_seconds = time.perf_counter() - start
+        output.spinner_success()
+    except Exception as err:
+        output.spinner_fail(str(err))
+        exit(1)
+
+    results = recall(exact, approximate)
+
+    output.table([['Method', 'Seconds', 'Similarities'],
+                  ['exact ({} jobs)'.format(args.jobs), '{:.2f}'.format(exact_seconds),
+                   '{:,}'.format(results['exact_neighbours'])],
+                  ['index build', '{:.2f}'.format(build_seconds), '-'],
+                  ['approximate', '{:.2f}'.format(approximate_seconds),
+                   '{:,}'.format(results['approximate_neighbours'])]])
+
+    output.info('Recall@{}: {:.3f} (mean by course {:.3f})'.format(args.top_k, results['recall'],
+                                                                   results['mean_row_recall']))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        output.info('Database usage: {}'.format(DbService.stats_summary()))
+        DbService.dispose_engines()
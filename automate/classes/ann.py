@@ -0,0 +1,340 @@
+import datetime
+import json
+import os
+import shutil
+from typing import Dict, Iterator, Sequence, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+from .content import DEFAULT_TOP_K, fit_tfidf, select_top_k, transform_tfidf
+
+FORMAT_VERSION = 2
+METADATA_FILE = 'metadata.json'
+
+
+class IndexUnavailableError(Exception):
+    """Raised when there is no usable content index: it was never saved, is incomplete or has an older format"""
+
+
+class ContentIndex:
+    """Approximate nearest neighbour index of the courses TF-IDF vectors, based on random projection LSH.
+
+    Every hash table projects the vectors on `n_bits` random hyperplanes and keeps the side of each hyperplane as a
+    bit, so vectors with a small angle between them tend to share their code. The candidates of a vector are the
+    vectors with its code in any table, and only the candidates are compared with the exact cosine similarity. More
+    tables raise the recall, more bits make the buckets smaller and the queries faster.
+
+    The index keeps the vocabulary and weights of the vectors, so it can also find the courses most similar to a new
+    text without rebuilding the model, and the content hash of every course, so that it can be used as the vector
+    store of the incremental updates.
+    """
+
+    DEFAULT_TABLES = 16
+    # Average number of vectors per bucket used to choose the number of bits when it is not supplied
+    BUCKET_SIZE = 32
+    # Candidates taken from a single bucket. Bounds the work of the queries that fall into a crowded bucket
+    MAX_BUCKET_SIZE = 2000
+    # Vectors queried at once by the offline build. The candidate pairs of a block are held in memory
+    QUERY_BLOCK_SIZE = 200
+
+    ARRAYS = ('course_ids', 'content_hashes', 'vocabulary', 'idf', 'hyperplanes', 'indptr', 'indices', 'data')
+
+    def __init__(self, course_ids: np.ndarray, content_hashes: np.ndarray, vectors: csr_matrix, vocabulary: np.ndarray,
+                 idf: np.ndarray, hyperplanes: np.ndarray, n_tables: int, n_bits: int):
+        """ContentIndex constructor. Use `build` or `load` to create an index
+
+        :param course_ids: Course id of every vector
+        :param content_hashes: Hash of the content of every course
+        :param vectors: L2 normalized TF-IDF vectors
+        :param vocabulary: Vocabulary terms of the vectors
+        :param idf: Inverse document frequency of every term
+        :param hyperplanes: n x (n_tables * n_bits) random hyperplanes, where n is the size of the vocabulary
+        :param n_tables: Number of hash tables
+        :param n_bits: Number of bits of the codes
+        """
+        self.course_ids = course_ids
+        self.content_hashes = content_hashes
+        self.vectors = vectors
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.hyperplanes = hyperplanes
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+
+        codes = self.hash(vectors)
+
+        # Sorted codes of every table, so that a bucket is a range found with a binary search
+        self.order = np.argsort(codes, axis=0, kind='stable')
+        self.sorted_codes = np.take_along_axis(codes, self.order, axis=0)
+
+    @classmethod
+    def build(cls, texts: Sequence[str], course_ids: Sequence[str], content_hashes: Sequence[str] = None,
+              n_tables: int = DEFAULT_TABLES, n_bits: int = None, seed: int = 0) -> 'ContentIndex':
+        """Builds the index of the courses contents
+
+        :param texts: Normalized courses contents
+        :param course_ids: Course id of every content
+        :param content_hashes: Hash of every content, before normalizing it. If `None`, the hashes are left empty
+        :param n_tables: Number of hash tables
+        :param n_bits: Number of bits of the codes, at most 62. If `None`, it is chosen so that the buckets hold
+            `BUCKET_SIZE` vectors on average, which keeps the number of candidates per query steady as the catalogue
+            grows
+        :param seed: Seed of the random hyperplanes
+        :return: The index
+        """
+        if n_bits is None:
+            n_bits = max(4, int(round(np.log2(max(len(course_ids), 1) / cls.BUCKET_SIZE))))
+
+        if not 0 < n_bits <= 62:
+            raise ValueError('The codes must have between 1 and 62 bits')
+
+        vectors, vocabulary, idf = fit_tfidf(texts)
+
+        hyperplanes = np.random.RandomState(seed).standard_normal((vectors.shape[1], n_tables * n_bits))
+
+        if content_hashes is None:
+            content_hashes = [''] * len(course_ids)
+
+        return cls(np.asarray(course_ids, dtype=str), np.asarray(content_hashes, dtype=str), vectors, vocabulary, idf,
+                   hyperplanes.astype(np.float32), n_tables, n_bits)
+
+    def vectorize(self, texts: Sequence[str]) -> csr_matrix:
+        """Builds the vectors of new texts with the vocabulary and weights of the index
+
+        :param texts: Normalized texts
+        :return: A sparse matrix with a row per text
+        """
+        return transform_tfidf(texts, self.vocabulary, self.idf)
+
+    def replace(self, removed_ids: Sequence[str], course_ids: Sequence[str], content_hashes: Sequence[str],
+                vectors: csr_matrix) -> 'ContentIndex':
+        """Returns a new index without some courses and with new vectors for others
+
+        The vocabulary, weights and hyperplanes are kept, so the vectors of the courses that have not changed are
+        still comparable with the new ones.
+
+        :param removed_ids: Ids of the courses to remove, including the ones whose vectors are replaced
+        :param course_ids: Ids of the added courses
+        :param content_hashes: Content hash of every added course
+        :param vectors: Vectors of the added courses, built with `vectorize`
+        :return: The new index
+        """
+        kept = ~np.isin(self.course_ids, np.asarray(removed_ids, dtype=str))
+
+        return ContentIndex(np.concatenate([self.course_ids[kept], np.asarray(course_ids, dtype=str)]),
+                            np.concatenate([self.content_hashes[kept], np.asarray(content_hashes, dtype=str)]),
+                            vstack([self.vectors[kept], vectors], format='csr').astype(np.float32),
+                            self.vocabulary, self.idf, self.hyperplanes, self.n_tables, self.n_bits)
+
+    def positions(self, course_ids: Sequence[str]) -> np.ndarray:
+        """Returns the rows of some courses in the index. Courses that are not in the index are ignored
+
+        :param course_ids: Course ids
+        :return: The rows of the courses
+        """
+        return np.flatnonzero(np.isin(self.course_ids, np.asarray(course_ids, dtype=str)))
+
+    def hash(self, vectors: csr_matrix) -> np.ndarray:
+        """Computes the code of the vectors in every table
+
+        Empty vectors, such as texts without any known term, get the code -1, which never matches another code.
+
+        :param vectors: Vectors with the vocabulary of the index
+        :return: An array with a row per vector and a column per table
+        """
+        bits = np.asarray(vectors.dot(self.hyperplanes)) > 0
+        bits = bits.reshape(vectors.shape[0], self.n_tables, self.n_bits)
+
+        codes = (bits * (np.int64(1) << np.arange(self.n_bits, dtype=np.int64))).sum(axis=2)
+        codes[np.diff(vectors.indptr) == 0] = -1
+
+        return codes
+
+    def candidates(self, codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Finds the vectors that share a code with the queries in any table
+
+        :param codes: Codes of the queries, as returned by `hash`
+        :return: A tuple with the query and the candidate of every (query, candidate) pair, without duplicates
+        """
+        queries, candidates = [], []
+
+        for table in range(self.n_tables):
+            sorted_codes = self.sorted_codes[:, table]
+
+            start = np.searchsorted(sorted_codes, codes[:, table], side='left')
+            end = np.searchsorted(sorted_codes, codes[:, table], side='right')
+            end = np.where(codes[:, table] < 0, start, np.minimum(end, start + self.MAX_BUCKET_SIZE))
+            lengths = end - start
+
+            # Positions start..end of every query, concatenated
+            offsets = np.repeat(start - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+            queries.append(np.repeat(np.arange(len(codes)), lengths))
+            candidates.append(self.order[offsets, table])
+
+        pairs = np.unique(np.concatenate(queries) * len(self.course_ids) + np.concatenate(candidates))
+
+        return pairs // len(self.course_ids), pairs % len(self.course_ids)
+
+    def query(self, vectors: csr_matrix, top_k: int = DEFAULT_TOP_K, min_similarity: float = 0.0,
+              exclude: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Finds the most similar indexed vectors to the query vectors
+
+        :param vectors: Query vectors, with the vocabulary of the index
+        :param top_k: Maximum number of neighbours per query
+        :param min_similarity: Minimum similarity of a neighbour
+        :param exclude: Index of the vector excluded from the neighbours of each query, such as the query itself
+        :return: A tuple with the queries, their neighbours and the similarities, sorted by query and decreasing
+            similarity
+        """
+        queries, candidates = self.candidates(self.hash(vectors))
+
+        if exclude is not None:
+            not_excluded = candidates != exclude[queries]
+            queries, candidates = queries[not_excluded], candidates[not_excluded]
+
+        scores = np.asarray(vectors[queries].multiply(self.vectors[candidates]).sum(axis=1)).ravel()
+
+        return select_top_k(queries, candidates, scores, top_k, min_similarity)
+
+    def top_k_similarities(self, top_k: int = DEFAULT_TOP_K, min_similarity: float = 0.0,
+                           block_size: int = None) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Finds the approximate most similar vectors to every indexed vector, block of rows by block of rows
+
+        :param top_k: Maximum number of neighbours per vector
+        :param min_similarity: Minimum similarity of a neighbour
+        :param block_size: Number of vectors queried at once. If `None`, `QUERY_BLOCK_SIZE` vectors are queried
+        :return: An iterator of (rows, neighbours, similarities) tuples, one per block, in row order, as the exact
+            `content.top_k_similarities`
+        """
+        m = len(self.course_ids)
+
+        if block_size is None:
+            block_size = self.QUERY_BLOCK_SIZE
+
+        for start in range(0, m, block_size):
+            end = min(start + block_size, m)
+
+            rows, neighbours, similarities = self.query(self.vectors[start:end], top_k=top_k,
+                                                        min_similarity=min_similarity,
+                                                        exclude=np.arange(start, end))
+
+            yield rows + start, neighbours, similarities
+
+    def similar_to_texts(self, texts: Sequence[str], top_k: int = DEFAULT_TOP_K,
+                         min_similarity: float = 0.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Finds the courses most similar to new texts
+
+        :param texts: Normalized texts, as the courses contents of the index
+        :param top_k: Maximum number of courses per text
+        :param min_similarity: Minimum similarity of a course
+        :return: A tuple with the text index, the course id and the similarity of every result, sorted by text and
+            decreasing similarity
+        """
+        texts_idx, neighbours, similarities = self.query(transform_tfidf(texts, self.vocabulary, self.idf),
+                                                         top_k=top_k, min_similarity=min_similarity)
+
+        return texts_idx, self.course_ids[neighbours], similarities
+
+    def save(self, directory: str):
+        """Saves the index as NumPy arrays plus a `metadata.json` header. The directory is replaced atomically
+
+        :param directory: Index directory
+        """
+        tmp_directory = '{}.tmp'.format(directory.rstrip(os.sep))
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+
+        arrays = {'course_ids': self.course_ids,
+                  'content_hashes': self.content_hashes,
+                  'vocabulary': self.vocabulary,
+                  'idf': self.idf,
+                  'hyperplanes': self.hyperplanes,
+                  'indptr': self.vectors.indptr,
+                  'indices': self.vectors.indices,
+                  'data': self.vectors.data}
+
+        for name in self.ARRAYS:
+            np.save(os.path.join(tmp_directory, '{}.npy'.format(name)), arrays[name])
+
+        metadata = {'format_version': FORMAT_VERSION,
+                    'build_time': datetime.datetime.utcnow().isoformat() + 'Z',
+                    'courses': int(self.vectors.shape[0]),
+                    'terms': int(self.vectors.shape[1]),
+                    'n_tables': self.n_tables,
+                    'n_bits': self.n_bits}
+
+        with open(os.path.join(tmp_directory, METADATA_FILE), 'w') as file:
+            json.dump(metadata, file, indent=2)
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.rename(tmp_directory, directory)
+
+    @classmethod
+    def load(cls, directory: str) -> 'ContentIndex':
+        """Loads an index saved by `save`
+
+        :param directory: Index directory
+        :return: The index
+        :raises: IndexUnavailableError if the index does not exist, is incomplete or its format is not supported
+        """
+        try:
+            with open(os.path.join(directory, METADATA_FILE), 'r') as file:
+                metadata = json.load(file)
+        except (OSError, ValueError) as err:
+            raise IndexUnavailableError('No content index in {}: {}'.format(directory, err))
+
+        if metadata.get('format_version') != FORMAT_VERSION:
+            raise IndexUnavailableError('Unsupported index format version {}'.format(metadata.get('format_version')))
+
+        try:
+            arrays = {name: np.load(os.path.join(directory, '{}.npy'.format(name))) for name in cls.ARRAYS}
+        except OSError as err:
+            raise IndexUnavailableError('Incomplete content index in {}: {}'.format(directory, err))
+
+        vectors = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                             shape=(metadata['courses'], metadata['terms']))
+
+        return cls(arrays['course_ids'], arrays['content_hashes'], vectors, arrays['vocabulary'], arrays['idf'],
+                   arrays['hyperplanes'], metadata['n_tables'], metadata['n_bits'])
+
+
+def recall(exact: Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+           approximate: Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]) -> Dict[str, float]:
+    """Measures the recall of approximate neighbours against the exact ones
+
+    :param exact: Exact (rows, neighbours, similarities) blocks, as returned by `content.top_k_similarities`
+    :param approximate: Approximate blocks, as returned by `ContentIndex.top_k_similarities`
+    :return: The fraction of exact neighbours found, overall and averaged by row, and the number of neighbours of
+        each kind
+    """
+    def pairs(blocks):
+        rows, neighbours = [], []
+        for block_rows, block_neighbours, _ in blocks:
+            rows.append(block_rows)
+            neighbours.append(block_neighbours)
+
+        if len(rows) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+        return np.concatenate(rows).astype(np.int64), np.concatenate(neighbours).astype(np.int64)
+
+    exact_rows, exact_neighbours = pairs(exact)
+    approximate_rows, approximate_neighbours = pairs(approximate)
+
+    size = max(exact_rows.max(initial=0), exact_neighbours.max(initial=0),
+               approximate_rows.max(initial=0), approximate_neighbours.max(initial=0)) + 1
+    found = np.isin(exact_rows * size + exact_neighbours, approximate_rows * size + approximate_neighbours)
+
+    if len(found) == 0:
+        return {'recall': 1.0, 'mean_row_recall': 1.0, 'exact_neighbours': 0,
+                'approximate_neighbours': int(len(approximate_rows))}
+
+    row_found = np.bincount(exact_rows, weights=found) / np.bincount(exact_rows).clip(min=1)
+    rows_with_neighbours = np.unique(exact_rows)
+
+    return {'recall': float(found.mean()),
+            'mean_row_recall': float(row_found[rows_with_neighbours].mean()),
+            'exact_neighbours': int(len(exact_rows)),
+            'approximate_neighbours': int(len(approximate_rows))}
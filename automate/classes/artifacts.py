@@ -0,0 +1,165 @@
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from typing import Dict, List
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+FORMAT_VERSION = 1
+ARRAYS = ('indptr', 'indices', 'data', 'user_ids', 'course_ids')
+METADATA_FILE = 'metadata.json'
+CURRENT_FILE = 'CURRENT'
+
+
+def file_checksum(file_name: str, block_size: int = 1 << 20) -> str:
+    """Computes the SHA-256 checksum of a file
+
+    :param file_name: File path
+    :param block_size: Number of bytes read at once
+    :return: Hexadecimal digest
+    """
+    digest = hashlib.sha256()
+
+    with open(file_name, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def save_user_courses_bundle(root: str, matrix: csr_matrix, user_ids: np.ndarray, course_ids: np.ndarray,
+                             keep: int = 2) -> str:
+    """Saves the leads user-item matrix as a new version of the user courses artifact bundle
+
+    A bundle is a directory named after its version that contains the CSR components and the id tables as `.npy`
+    files, plus a `metadata.json` header. The bundle is written to a temporary directory, renamed into place and then
+    published by replacing the `CURRENT` file, so readers never see a half written version.
+
+    :param root: Directory that contains the bundle versions
+    :param matrix: Users x courses CSR matrix. Rows must follow `user_ids` and columns `course_ids`
+    :param user_ids: Sorted user ids
+    :param course_ids: Sorted course ids
+    :param keep: Number of versions kept in `root`, including the new one
+    :return: The new version name
+    """
+    if matrix.shape != (len(user_ids), len(course_ids)):
+        raise ValueError('Matrix shape {} does not match the id tables ({}, {})'.format(matrix.shape,
+                                                                                        len(user_ids),
+                                                                                        len(course_ids)))
+    build_time = datetime.datetime.utcnow()
+    version = build_time.strftime('%Y%m%dT%H%M%S%fZ')
+
+    os.makedirs(root, exist_ok=True)
+    tmp_directory = os.path.join(root, '.{}.tmp'.format(version))
+    os.makedirs(tmp_directory)
+
+    arrays = {'indptr': matrix.indptr,
+              'indices': matrix.indices,
+              'data': matrix.data.astype('int8'),
+              'user_ids': np.asarray(user_ids, dtype=str),
+              'course_ids': np.asarray(course_ids, dtype=str)}
+
+    checksums = {}
+    for name in ARRAYS:
+        file_name = os.path.join(tmp_directory, '{}.npy'.format(name))
+        np.save(file_name, arrays[name])
+        checksums[name] = file_checksum(file_name)
+
+    metadata = {'format_version': FORMAT_VERSION,
+                'version': version,
+                'build_time': build_time.isoformat() + 'Z',
+                'rows': int(matrix.shape[0]),
+                'columns': int(matrix.shape[1]),
+                'nnz': int(matrix.nnz),
+                'checksums': checksums,
+                'checksum': hashlib.sha256(''.join(checksums[name] for name in ARRAYS).encode()).hexdigest()}
+
+    with open(os.path.join(tmp_directory, METADATA_FILE), 'w') as file:
+        json.dump(metadata, file, indent=2)
+
+    os.rename(tmp_directory, os.path.join(root, version))
+
+    current_tmp = os.path.join(root, '.{}.tmp'.format(CURRENT_FILE))
+    with open(current_tmp, 'w') as file:
+        file.write(version)
+    os.replace(current_tmp, os.path.join(root, CURRENT_FILE))
+
+    for old_version in bundle_versions(root)[:-keep]:
+        shutil.rmtree(os.path.join(root, old_version), ignore_errors=True)
+
+    return version
+
+
+def bundle_versions(root: str) -> List[str]:
+    """Returns the complete bundle versions stored in `root`, from oldest to newest
+
+    :param root: Directory that contains the bundle versions
+    :return: A list of version names
+    """
+    if not os.path.isdir(root):
+        return []
+
+    return sorted(name for name in os.listdir(root)
+                  if not name.startswith('.') and os.path.isfile(os.path.join(root, name, METADATA_FILE)))
+
+
+def load_user_courses_pickle(pickle_file: str) -> Dict:
+    """Loads a legacy user requested courses map, a dictionary of 1 x N `csr_matrix` rows keyed by user id
+
+    Only load files created by this project, unpickling executes arbitrary code.
+
+    :param pickle_file: Pickle file path
+    :return: The user requested courses map
+    """
+    with open(pickle_file, 'rb') as file:
+        return pickle.load(file)
+
+
+def read_course_ids(file_name: str) -> np.ndarray:
+    """Reads the course ids of the columns of a legacy user requested courses map
+
+    :param file_name: Either the leads user-item matrix CSV saved along with the map, whose header has the user id
+        column followed by the course ids of the columns, or a text file with a course id per line, in column order
+    :return: The course ids, in column order
+    """
+    with open(file_name, 'r') as file:
+        if file_name.endswith('.csv'):
+            return np.array(file.readline().rstrip('\r\n').split(',')[1:], dtype=str)
+
+        return np.array([line.strip() for line in file if line.strip()], dtype=str)
+
+
+def convert_user_courses_pickle(pickle_file: str, root: str, course_ids: np.ndarray) -> str:
+    """Converts a legacy user requested courses map into a new bundle version
+
+    The legacy map does not store the course ids of the columns, so the ids the map was built with have to be
+    supplied, in column order. They cannot be rebuilt from the current leads: the catalogue changes, and a list with
+    the same length would silently map the columns to the wrong courses.
+
+    :param pickle_file: Pickle file path
+    :param root: Directory that contains the bundle versions
+    :param course_ids: Course ids of the matrix columns, in column order
+    :return: The new version name
+    :raises: ValueError if the course ids do not match the columns of the map
+    """
+    user_courses_map = load_user_courses_pickle(pickle_file)
+    user_ids = np.sort(np.array(list(user_courses_map.keys()), dtype=str))
+    course_ids = np.asarray(course_ids, dtype=str)
+
+    matrix = vstack([user_courses_map[user_id] for user_id in user_ids], format='csr', dtype='int8')
+
+    if matrix.shape[1] != len(course_ids):
+        raise ValueError('The map has {} columns but {} course ids were supplied'.format(matrix.shape[1],
+                                                                                         len(course_ids)))
+
+    if len(np.unique(course_ids)) != len(course_ids):
+        raise ValueError('The supplied course ids are not unique')
+
+    # Bundles keep the columns sorted by course id
+    order = np.argsort(course_ids, kind='stable')
+
+    return save_user_courses_bundle(root, matrix[:, order].tocsr(), user_ids, course_ids[order])
@@ -0,0 +1,65 @@
+import os
+from typing import List
+
+import pandas as pd
+
+
+class HashCache:
+    """Persistent cache of values computed from texts, keyed by a content hash of the text.
+
+    The cache is stored as a CSV file with a `hash` column and a column for each cached value, so that texts that
+    have not changed between runs are not processed again.
+    """
+
+    def __init__(self, columns: List[str], file_name: str = None):
+        """HashCache constructor. Loads the cache file if it exists
+
+        :param columns: Names of the cached values
+        :param file_name: Cache file path. If `None`, the cache only lives in memory
+        """
+        self.file_name = file_name
+        self.columns = columns
+        self.df = pd.DataFrame(columns=['hash'] + columns).set_index('hash')
+
+        if file_name and os.path.exists(file_name):
+            self.df = pd.read_csv(file_name, dtype=str, keep_default_na=False).set_index('hash')[columns]
+
+    def __len__(self) -> int:
+        return self.df.shape[0]
+
+    def missing(self, hashes: pd.Series) -> pd.Series:
+        """Returns the unique hashes that are not in the cache
+
+        :param hashes: Content hashes
+        :return: The hashes not in the cache
+        """
+        hashes = pd.Series(hashes.unique())
+
+        return hashes[~hashes.isin(self.df.index)]
+
+    def get(self, hashes: pd.Series, column: str) -> pd.Series:
+        """Returns the cached values of a column
+
+        :param hashes: Content hashes
+        :param column: Cached value name
+        :return: The cached values, aligned with `hashes`
+        """
+        return hashes.map(self.df[column])
+
+    def update(self, df: pd.DataFrame):
+        """Adds values to the cache, replacing the values of hashes already in the cache
+
+        :param df: DataFrame indexed by hash with a column for each cached value
+        """
+        df = df[self.columns]
+        self.df = pd.concat([self.df[~self.df.index.isin(df.index)], df])
+        self.df.index.name = 'hash'
+
+    def save(self):
+        """Saves the cache to its file"""
+        if not self.file_name:
+            return
+
+        tmp_file_name = '{}.tmp'.format(self.file_name)
+        self.df.to_csv(tmp_file_name)
+        os.replace(tmp_file_name, self.file_name)
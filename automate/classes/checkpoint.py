@@ -0,0 +1,108 @@
+import datetime
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+
+class CheckpointStore:
+    """Parquet checkpoints of the pipeline stages.
+
+    A checkpoint is a directory named after its stage that contains a Parquet file per DataFrame written by the stage
+    and a `manifest.json` file with the fingerprint of the stage inputs. Parquet keeps the dtypes, categorical columns
+    included, so a pipeline can resume from any stage with the same data it would have built.
+    """
+
+    MANIFEST_FILE = 'manifest.json'
+
+    def __init__(self, directory: str):
+        """CheckpointStore constructor
+
+        :param directory: Directory that contains the checkpoints
+        """
+        self.directory = directory
+
+    @staticmethod
+    def fingerprint(*inputs) -> str:
+        """Computes a fingerprint of the inputs of a stage
+
+        DataFrames are hashed by content, any other input by its JSON representation. A stage fingerprint usually
+        includes the fingerprint of the previous stage, so it changes if anything upstream changes.
+
+        :param inputs: DataFrames, fingerprints or parameters
+        :return: Hexadecimal digest
+        """
+        digest = hashlib.sha256()
+
+        for value in inputs:
+            if isinstance(value, pd.DataFrame):
+                digest.update(json.dumps(list(map(str, value.columns))).encode())
+                digest.update(pd.util.hash_pandas_object(value, index=False).values.tobytes())
+            else:
+                digest.update(json.dumps(value, sort_keys=True, default=str).encode())
+
+        return digest.hexdigest()
+
+    def save(self, stage: str, frames: Dict[str, pd.DataFrame], fingerprint: str, metadata: Dict = None):
+        """Saves the checkpoint of a stage, replacing the previous one
+
+        :param stage: Stage name
+        :param frames: DataFrames written by the stage, keyed by name
+        :param fingerprint: Fingerprint of the stage inputs
+        :param metadata: Additional JSON serializable data
+        """
+        stage_directory = os.path.join(self.directory, stage)
+        tmp_directory = os.path.join(self.directory, '.{}.tmp'.format(stage))
+
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+
+        for name, df in frames.items():
+            df.to_parquet(os.path.join(tmp_directory, '{}.parquet'.format(name)), engine='pyarrow')
+
+        manifest = {'stage': stage,
+                    'fingerprint': fingerprint,
+                    'frames': sorted(frames),
+                    'rows': {name: int(df.shape[0]) for name, df in frames.items()},
+                    'created_on': datetime.datetime.utcnow().isoformat() + 'Z',
+                    'metadata': metadata if metadata else {}}
+
+        with open(os.path.join(tmp_directory, self.MANIFEST_FILE), 'w') as file:
+            json.dump(manifest, file, indent=2)
+
+        shutil.rmtree(stage_directory, ignore_errors=True)
+        os.rename(tmp_directory, stage_directory)
+
+    def manifest(self, stage: str) -> Optional[Dict]:
+        """Returns the manifest of a stage checkpoint
+
+        :param stage: Stage name
+        :return: The manifest or `None` if there is no checkpoint of the stage
+        """
+        try:
+            with open(os.path.join(self.directory, stage, self.MANIFEST_FILE), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def load(self, stage: str, names: List[str] = None) -> Dict[str, pd.DataFrame]:
+        """Loads the DataFrames of a stage checkpoint
+
+        :param stage: Stage name
+        :param names: Names of the DataFrames to load. If `None`, all the DataFrames will be loaded
+        :return: DataFrames keyed by name
+        :raises: FileNotFoundError if there is no checkpoint of the stage
+        """
+        manifest = self.manifest(stage)
+
+        if manifest is None:
+            raise FileNotFoundError('There is no checkpoint of the {} stage'.format(stage))
+
+        if names is None:
+            names = manifest['frames']
+
+        return {name: pd.read_parquet(os.path.join(self.directory, stage, '{}.parquet'.format(name)), engine='pyarrow')
+                for name in names if name in manifest['frames']}
@@ -0,0 +1,199 @@
+from multiprocessing import get_context
+from typing import Iterator, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+# Maximum number of neighbours kept per course
+DEFAULT_TOP_K = 20
+# Maximum number of cells of a block of the similarity matrix. The rows of a block are multiplied at once, so this
+# bounds the memory used by each worker
+BLOCK_CELLS = 20000000
+
+# Vectors of the worker processes, set once per process by `_init_worker`
+_worker_vectors = None
+_worker_vectors_t = None
+
+
+def fit_tfidf(texts: Sequence[str]) -> Tuple[csr_matrix, np.ndarray, np.ndarray]:
+    """Builds the TF-IDF vectors of the texts, along with the vocabulary and weights needed to vectorize new texts
+
+    The vectors are L2 normalized, so the dot product of two vectors is the cosine similarity of their texts.
+
+    :param texts: Normalized texts. Null values are taken as empty texts
+    :return: A tuple with an m x n sparse matrix, where m is the number of texts and n the size of the vocabulary,
+        the vocabulary terms and their inverse document frequencies
+    """
+    texts = ['' if pd.isnull(text) else text for text in texts]
+
+    vectorizer = TfidfVectorizer(sublinear_tf=True, dtype=np.float32)
+    vectors = vectorizer.fit_transform(texts).tocsr()
+
+    vocabulary = np.empty(len(vectorizer.vocabulary_), dtype=object)
+    for term, column in vectorizer.vocabulary_.items():
+        vocabulary[column] = term
+
+    return vectors, vocabulary.astype(str), vectorizer.idf_.astype(np.float32)
+
+
+def tfidf_vectors(texts: Sequence[str]) -> csr_matrix:
+    """Builds the TF-IDF vectors of the texts. See `fit_tfidf`
+
+    :param texts: Normalized texts. Null values are taken as empty texts
+    :return: An m x n sparse matrix, where m is the number of texts and n the size of the vocabulary
+    """
+    return fit_tfidf(texts)[0]
+
+
+def transform_tfidf(texts: Sequence[str], vocabulary: np.ndarray, idf: np.ndarray) -> csr_matrix:
+    """Builds the TF-IDF vectors of new texts with the vocabulary and weights returned by `fit_tfidf`
+
+    Terms that are not in the vocabulary are ignored.
+
+    :param texts: Normalized texts. Null values are taken as empty texts
+    :param vocabulary: Vocabulary terms
+    :param idf: Inverse document frequency of every term
+    :return: A sparse matrix with a row per text, comparable with the vectors of `fit_tfidf`
+    """
+    texts = ['' if pd.isnull(text) else text for text in texts]
+
+    counts = CountVectorizer(vocabulary={term: column for column, term in enumerate(vocabulary)},
+                             dtype=np.float32).transform(texts).tocsr()
+    counts.data = 1 + np.log(counts.data)
+
+    return normalize(counts.multiply(idf.reshape(1, -1)).tocsr().astype(np.float32))
+
+
+def select_top_k(rows: np.ndarray, cols: np.ndarray, scores: np.ndarray, top_k: int,
+                 min_similarity: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Keeps the `top_k` highest similarities of every row above `min_similarity`
+
+    :param rows: Row of every similarity
+    :param cols: Column of every similarity
+    :param scores: Similarities
+    :param top_k: Maximum number of similarities per row
+    :param min_similarity: Minimum similarity
+    :return: A tuple with the rows, columns and similarities kept, sorted by row and decreasing similarity
+    """
+    keep = scores >= min_similarity
+    rows, cols, scores = rows[keep], cols[keep], scores[keep]
+
+    order = np.lexsort((cols, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+
+    # Position of every similarity within its row
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = rank < top_k
+
+    return rows[keep], cols[keep], scores[keep]
+
+
+def block_top_k(vectors: csr_matrix, vectors_t: csr_matrix, start: int, end: int, top_k: int,
+                min_similarity: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Computes the most similar vectors to the vectors of a block of rows
+
+    Only the similarities of the block, a sparse (end - start) x m matrix, are held in memory. The similarity of a
+    vector with itself is dropped.
+
+    :param vectors: m x n vectors
+    :param vectors_t: Transposed vectors
+    :param start: First row of the block
+    :param end: Row after the last row of the block
+    :param top_k: Maximum number of neighbours per row
+    :param min_similarity: Minimum similarity of a neighbour
+    :return: A tuple with the rows, their neighbours and the similarities, sorted by row and decreasing similarity
+    """
+    block = vectors[start:end].dot(vectors_t).tocoo()
+
+    rows = block.row.astype(np.int64) + start
+    cols = block.col.astype(np.int64)
+    not_self = rows != cols
+
+    return select_top_k(rows[not_self], cols[not_self], block.data[not_self], top_k, min_similarity)
+
+
+def rows_top_k(vectors: csr_matrix, rows: np.ndarray, top_k: int,
+               min_similarity: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Computes the most similar vectors to some rows, which do not need to be contiguous
+
+    :param vectors: m x n vectors
+    :param rows: Rows whose neighbours are computed
+    :param top_k: Maximum number of neighbours per row
+    :param min_similarity: Minimum similarity of a neighbour
+    :return: A tuple with the rows, their neighbours and the similarities, sorted by row and decreasing similarity
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    vectors_t = vectors.T.tocsr()
+    block_size = max(1, BLOCK_CELLS // max(vectors.shape[0], 1))
+
+    results = [(np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float32))]
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start:start + block_size]
+        block = vectors[block_rows].dot(vectors_t).tocoo()
+
+        block_rows = block_rows[block.row]
+        cols = block.col.astype(np.int64)
+        not_self = block_rows != cols
+
+        results.append(select_top_k(block_rows[not_self], cols[not_self], block.data[not_self], top_k,
+                                    min_similarity))
+
+    rows, cols, scores = (np.concatenate(arrays) for arrays in zip(*results))
+    order = np.lexsort((cols, -scores, rows))
+
+    return rows[order], cols[order], scores[order]
+
+
+def _init_worker(vectors: csr_matrix):
+    global _worker_vectors, _worker_vectors_t
+
+    _worker_vectors = vectors
+    _worker_vectors_t = vectors.T.tocsr()
+
+
+def _worker_block_top_k(args: Tuple[int, int, int, float]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    start, end, top_k, min_similarity = args
+
+    return block_top_k(_worker_vectors, _worker_vectors_t, start, end, top_k, min_similarity)
+
+
+def top_k_similarities(vectors: csr_matrix, top_k: int = DEFAULT_TOP_K, min_similarity: float = 0.0,
+                       block_size: int = None,
+                       n_jobs: int = 1) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Computes the most similar vectors to every vector, block of rows by block of rows
+
+    The similarity matrix is never built. Every block of rows is multiplied by the transposed vectors and pruned to
+    its `top_k` neighbours above `min_similarity` right away, so the memory used is O(m * top_k) plus one block per
+    worker.
+
+    :param vectors: m x n L2 normalized vectors, as built by `tfidf_vectors`
+    :param top_k: Maximum number of neighbours per vector
+    :param min_similarity: Minimum similarity of a neighbour
+    :param block_size: Number of rows multiplied at once. If `None`, it is chosen so that a block has at most
+        `BLOCK_CELLS` cells
+    :param n_jobs: Number of worker processes. The vectors are sent once to each worker
+    :return: An iterator of (rows, neighbours, similarities) tuples, one per block, in row order
+    """
+    m = vectors.shape[0]
+
+    if block_size is None:
+        block_size = max(1, BLOCK_CELLS // max(m, 1))
+
+    blocks = [(start, min(start + block_size, m), top_k, min_similarity) for start in range(0, m, block_size)]
+
+    if n_jobs <= 1 or len(blocks) <= 1:
+        vectors_t = vectors.T.tocsr()
+
+        for start, end, top_k, min_similarity in blocks:
+            yield block_top_k(vectors, vectors_t, start, end, top_k, min_similarity)
+
+        return
+
+    # The similarities may be computed in a pipeline thread, and forking a multi-threaded process can deadlock the
+    # workers, so they are spawned
+    with get_context('spawn').Pool(processes=n_jobs, initializer=_init_worker, initargs=(vectors,)) as pool:
+        for result in pool.imap(_worker_block_top_k, blocks):
+            yield result
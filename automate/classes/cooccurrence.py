@@ -0,0 +1,85 @@
+from typing import Iterator, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from .content import BLOCK_CELLS, select_top_k
+
+# Co-occurrence measures of a pair of courses. Number of users in both courses
+COUNT = 'count'
+# Users in both courses divided by users in any of them
+JACCARD = 'jaccard'
+# Users in both courses divided by the geometric mean of the users of each course
+COSINE = 'cosine'
+MEASURES = (COUNT, JACCARD, COSINE)
+
+# Maximum number of recommendations kept per course
+DEFAULT_RECOMMENDATIONS = 10
+
+
+def score_counts(counts: np.ndarray, rows: np.ndarray, cols: np.ndarray, item_counts: np.ndarray,
+                 measure: str) -> np.ndarray:
+    """Turns co-occurrence counts into scores
+
+    :param counts: Number of users in both courses of every pair
+    :param rows: First course of every pair
+    :param cols: Second course of every pair
+    :param item_counts: Number of users of every course
+    :param measure: `COUNT`, `JACCARD` or `COSINE`
+    :return: The score of every pair
+    :raises: ValueError if the measure is unknown
+    """
+    counts = counts.astype(np.float64)
+
+    if measure == COUNT:
+        return counts
+
+    if measure == JACCARD:
+        return counts / (item_counts[rows] + item_counts[cols] - counts)
+
+    if measure == COSINE:
+        return counts / np.sqrt(item_counts[rows].astype(np.float64) * item_counts[cols])
+
+    raise ValueError('Unknown co-occurrence measure {}. Use one of: {}'.format(measure, ', '.join(MEASURES)))
+
+
+def cooccurrence_top_k(user_items: csr_matrix, top_k: int = DEFAULT_RECOMMENDATIONS, measure: str = JACCARD,
+                       min_count: int = 1,
+                       block_size: int = None) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Computes the courses that co-occur the most with every course, block of courses by block of courses
+
+    The co-occurrence matrix is Xᵀ·X, where X is the binary users x courses matrix. Every block of courses (columns
+    of X) is multiplied by X and pruned to its `top_k` best scored courses right away, so the courses x courses matrix
+    is never built.
+
+    :param user_items: Binary users x courses matrix
+    :param top_k: Maximum number of co-occurring courses per course
+    :param measure: `COUNT`, `JACCARD` or `COSINE`
+    :param min_count: Minimum number of users in both courses
+    :param block_size: Number of courses multiplied at once. If `None`, it is chosen so that a block has at most
+        `BLOCK_CELLS` cells
+    :return: An iterator of (courses, co-occurring courses, scores) tuples, one per block, in course order. The
+        co-occurring courses of a course are sorted by decreasing score
+    :raises: ValueError if the measure is unknown
+    """
+    if measure not in MEASURES:
+        raise ValueError('Unknown co-occurrence measure {}. Use one of: {}'.format(measure, ', '.join(MEASURES)))
+
+    # The counts are summed in int32, an int8 matrix would overflow
+    user_items = csr_matrix(user_items, dtype=np.int32)
+    item_users = user_items.T.tocsr()
+    item_counts = np.asarray(item_users.sum(axis=1)).ravel()
+    n = user_items.shape[1]
+
+    if block_size is None:
+        block_size = max(1, BLOCK_CELLS // max(n, 1))
+
+    for start in range(0, n, block_size):
+        block = item_users[start:start + block_size].dot(user_items).tocoo()
+
+        rows = block.row.astype(np.int64) + start
+        cols = block.col.astype(np.int64)
+        keep = (rows != cols) & (block.data >= min_count)
+        rows, cols, counts = rows[keep], cols[keep], block.data[keep]
+
+        yield select_top_k(rows, cols, score_counts(counts, rows, cols, item_counts, measure), top_k, -np.inf)
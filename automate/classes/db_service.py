@@ -1,10 +1,37 @@
-from sqlalchemy import create_engine, exc
+import contextlib
+import logging
+import threading
+import time
+from typing import Callable, Dict
+
+from sqlalchemy import create_engine, event, exc
 import pandas as pd
 
+from .schema_functions import apply_dtypes, concat_chunks
+
+logger = logging.getLogger(__name__)
+
 
 class DbService:
     DEFAULT_DB_NAME = 'heroku_8149febc614deb5'
     DEFAULT_DB_HOST = 'eu-cdbr-west-02.cleardb.net'
+    DEFAULT_CHUNK_SIZE = 50000
+
+    # Connection pool of the shared engines
+    POOL_SIZE = 5
+    # Seconds after which a pooled connection is replaced, before the server closes it for being idle
+    POOL_RECYCLE = 280
+    # Retries of an operation that fails with a transient error, and seconds to wait before the first retry. The wait
+    # doubles on every retry
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 0.5
+
+    # Engines shared by all the instances, keyed by database URL and options
+    __engines__ = {}
+    __engines_lock__ = threading.Lock()
+    # Usage counters of all the engines, updated from any thread under `__stats_lock__`
+    __stats__ = {'connections': 0, 'checkouts': 0, 'statements': 0, 'rows': 0, 'seconds': 0.0, 'retries': 0}
+    __stats_lock__ = threading.Lock()
 
     def __init__(self, db_user: str, db_password: str, db_name: str = None, db_host: str = None):
         self.db_user = db_user
@@ -12,24 +39,185 @@ class DbService:
         self.db_name = db_name if db_name else self.DEFAULT_DB_NAME
         self.db_host = db_host if db_host else self.DEFAULT_DB_HOST
 
-    def create_df_from_query(self, query: str) -> pd.DataFrame:
+    def create_df_from_query(self, query: str, params: dict = None) -> pd.DataFrame:
         """Runs the `query` in the database and build a `pandas.DataFrame` from the response
 
         :param query: A select query
+        :param params: Query parameters
+        :return: A `pandas.DataFrame`
+        """
+        try:
+            return self.with_retry(pd.read_sql_query, query, con=self.connection(), params=params)
+        except exc.OperationalError:
+            raise SystemError('Cannot connect to the database')
+
+    def stream_df_from_query(self, query: str, dtypes: Dict[str, str], params: dict = None,
+                             chunk_size: int = None) -> pd.DataFrame:
+        """Runs the `query` in the database and builds a `pandas.DataFrame` with compact dtypes, chunk by chunk
+
+        The rows are fetched through a server-side cursor, so only `chunk_size` rows are held with the driver
+        types at any time. Every chunk is cast to `dtypes` before fetching the next one.
+
+        :param query: A select query
+        :param dtypes: The dtype of each column, as read by `read_schema`
+        :param params: Query parameters
+        :param chunk_size: Number of rows fetched at once
         :return: A `pandas.DataFrame`
         """
+        if chunk_size is None:
+            chunk_size = self.DEFAULT_CHUNK_SIZE
+
+        def read_chunks():
+            with self.connection().connect() as connection:
+                connection = connection.execution_options(stream_results=True)
+
+                return [apply_dtypes(chunk, dtypes)
+                        for chunk in pd.read_sql_query(query, con=connection, params=params, chunksize=chunk_size)]
+
         try:
-            return pd.read_sql_query(query, con=self.connection())
+            chunks = self.with_retry(read_chunks)
         except exc.OperationalError:
             raise SystemError('Cannot connect to the database')
 
-    def connection(self):
-        """ Creates a new connection to database
+        return concat_chunks(chunks, dtypes)
 
+    def connection(self, local_infile: bool = False):
+        """ Returns the engine of the database. The engine and its connection pool are shared by all the instances
+        that connect to the same database, so connections are reused instead of opened for every query
+
+        :param local_infile: Whether or not to allow `LOAD DATA LOCAL INFILE` statements
         :return: database engine
         """
+        url = 'mysql+pymysql://{}:{}@{}/{}'.format(self.db_user, self.db_password, self.db_host, self.db_name)
+        key = (url, local_infile)
+
+        with DbService.__engines_lock__:
+            if key not in DbService.__engines__:
+                engine = create_engine(url,
+                                       pool_size=self.POOL_SIZE,
+                                       pool_recycle=self.POOL_RECYCLE,
+                                       pool_pre_ping=True,
+                                       connect_args={'local_infile': True} if local_infile else {})
+                DbService.__track__(engine)
+
+                DbService.__engines__[key] = engine
+
+            return DbService.__engines__[key]
+
+    @contextlib.contextmanager
+    def transaction(self, local_infile: bool = False):
+        """Provides a connection whose statements run in a single transaction. The transaction is committed when the
+        block ends, or rolled back if the block raises an exception
+
+        :param local_infile: Whether or not to allow `LOAD DATA LOCAL INFILE` statements
+        :return: A connection
+        """
+        with self.connection(local_infile=local_infile).begin() as connection:
+            yield connection
+
+    def with_retry(self, func: Callable, *args, **kwargs):
+        """Calls `func`, retrying it with exponential backoff if it fails with a transient database error
+
+        Only idempotent operations must be retried, such as reads and whole transactions.
+
+        :param func: Function to call
+        :return: The `func` result
+        :raises: sqlalchemy.exc.OperationalError if the last retry fails
+        """
+        for retry in range(self.MAX_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except exc.OperationalError as err:
+                if retry == self.MAX_RETRIES or not (err.connection_invalidated or DbService.__transient__(err)):
+                    raise
+
+                wait = self.RETRY_BACKOFF * 2 ** retry
+                logger.warning('Database operation failed (%s), retrying in %.1f s', err.orig, wait)
+                with DbService.__stats_lock__:
+                    DbService.__stats__['retries'] += 1
+
+                time.sleep(wait)
+
+    @staticmethod
+    def __transient__(err: exc.OperationalError) -> bool:
+        """Checks if an error is worth a retry: lost connections, timeouts and deadlocks
+
+        :param err: The database error
+        :return: Returns `True` if the operation can succeed if retried, returns `False` otherwise
+        """
+        # MySQL error codes: can't connect, server gone away, lost connection, lock wait timeout, deadlock
+        transient_codes = {2003, 2006, 2013, 1205, 1213}
+        orig_args = getattr(err.orig, 'args', ())
+
+        return len(orig_args) > 0 and orig_args[0] in transient_codes
+
+    @staticmethod
+    def __track__(engine):
+        """Counts the connections, checkouts, statements and rows of an engine
+
+        :param engine: database engine
+        """
+        lock = DbService.__stats_lock__
+        stats = DbService.__stats__
+
+        @event.listens_for(engine, 'connect')
+        def connect(dbapi_connection, connection_record):
+            with lock:
+                stats['connections'] += 1
+
+        @event.listens_for(engine, 'checkout')
+        def checkout(dbapi_connection, connection_record, connection_proxy):
+            with lock:
+                stats['checkouts'] += 1
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info['query_start'].pop()
+
+            with lock:
+                stats['statements'] += 1
+                stats['seconds'] += elapsed
+                # Server-side cursors do not know the number of rows
+                stats['rows'] += max(cursor.rowcount, 0)
+
+    @staticmethod
+    def stats() -> Dict:
+        """Returns the database usage of the process: connections opened, pool checkouts, statements executed, rows
+        read or written, seconds spent executing statements and retries, plus the status of each pool
+
+        :return: A dictionary with the stats
+        """
+        with DbService.__stats_lock__:
+            stats = dict(DbService.__stats__)
+        stats['pools'] = [engine.pool.status() for engine in DbService.__engines__.values()]
+
+        return stats
+
+    @staticmethod
+    def stats_summary() -> str:
+        """Returns a one line summary of the database usage of the process
+
+        :return: The summary
+        """
+        stats = DbService.stats()
+        rows_per_second = stats['rows'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+
+        return '{} connections, {} checkouts, {} statements, {} rows in {:.1f} s ({:.0f} rows/s), {} retries'.format(
+            stats['connections'], stats['checkouts'], stats['statements'], stats['rows'], stats['seconds'],
+            rows_per_second, stats['retries'])
+
+    @staticmethod
+    def dispose_engines():
+        """Closes the pooled connections of all the shared engines and logs their stats"""
+        logger.info('Database: %s', DbService.stats_summary())
+
+        with DbService.__engines_lock__:
+            for engine in DbService.__engines__.values():
+                logger.info('Pool: %s', engine.pool.status())
+                engine.dispose()
 
-        return create_engine('mysql+pymysql://{}:{}@{}/{}'.format(self.db_user,
-                                                                  self.db_password,
-                                                                  self.db_host,
-                                                                  self.db_name))
+            DbService.__engines__.clear()
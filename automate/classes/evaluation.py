@@ -0,0 +1,386 @@
+import time
+from abc import ABC, abstractmethod
+from multiprocessing import Pool
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.linalg import svds
+from sklearn.preprocessing import normalize
+
+from .content import select_top_k, top_k_similarities
+from .cooccurrence import JACCARD, cooccurrence_top_k
+
+# Share of the most recent leads held out as the test set
+TEST_FRACTION = 0.2
+# Number of recommendations evaluated per user
+DEFAULT_K = 10
+# Users scored at once. The scores of a chunk are a dense users x courses matrix
+CHUNK_SIZE = 500
+# Similar courses or users kept by the neighbourhood recommenders
+DEFAULT_NEIGHBOURS = 50
+# Latent factors of the factorization recommender
+DEFAULT_FACTORS = 50
+
+# Data of the worker processes, set once per process by `_init_worker`
+_worker_recommender = None
+_worker_evaluation = None
+
+
+def concat_blocks(blocks) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Concatenates the (rows, columns, similarities) blocks of a top-k similarity computation
+
+    :param blocks: Blocks, such as the ones produced by `top_k_similarities`
+    :return: A tuple with the rows, columns and similarities. Empty arrays if there are no blocks
+    """
+    if not blocks:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+    return tuple(np.concatenate(arrays) for arrays in zip(*blocks))
+
+
+class Recommender(ABC):
+    """Scores every course for a set of users from their leads in the training period.
+
+    Subclasses implement `scores`, and extend `fit` to learn from the training users x courses matrix.
+    """
+    name = None
+
+    def __init__(self):
+        self.train = None
+
+    def fit(self, train: csr_matrix) -> 'Recommender':
+        """Learns the model from the training leads
+
+        :param train: Binary users x courses matrix of the training leads
+        :return: The recommender
+        """
+        self.train = train
+
+        return self
+
+    @abstractmethod
+    def scores(self, users: np.ndarray) -> np.ndarray:
+        """Scores every course for some users. The higher the score, the better the recommendation
+
+        :param users: Rows of the users in the training matrix
+        :return: A dense users x courses matrix
+        """
+
+
+class ItemSimilarityRecommender(Recommender):
+    """Recommends the courses most similar to the courses of the user: the score of a course is the sum of its
+    similarities with the courses the user generated leads in.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.similarities = None
+
+    @abstractmethod
+    def item_similarities(self, train: csr_matrix) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Computes the similar courses of every course
+
+        :param train: Binary users x courses matrix of the training leads
+        :return: A tuple with the courses, their similar courses and the similarities
+        """
+
+    def fit(self, train: csr_matrix) -> 'ItemSimilarityRecommender':
+        super().fit(train)
+
+        rows, cols, similarities = self.item_similarities(train)
+        n = train.shape[1]
+        self.similarities = coo_matrix((similarities.astype(np.float32), (rows, cols)), shape=(n, n)).tocsr()
+
+        return self
+
+    def scores(self, users: np.ndarray) -> np.ndarray:
+        return self.train[users].astype(np.float32).dot(self.similarities).toarray()
+
+
+class CooccurrenceRecommender(ItemSimilarityRecommender):
+    """Recommends the courses that co-occur the most with the courses of the user, as `recommended_courses_by_leads`"""
+    name = 'co-occurrence'
+
+    def __init__(self, measure: str = JACCARD, neighbours: int = DEFAULT_NEIGHBOURS):
+        """CooccurrenceRecommender constructor
+
+        :param measure: Co-occurrence score. See `cooccurrence_top_k`
+        :param neighbours: Co-occurring courses kept per course
+        """
+        super().__init__()
+        self.measure = measure
+        self.neighbours = neighbours
+
+    def item_similarities(self, train: csr_matrix) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        blocks = list(cooccurrence_top_k(train, top_k=self.neighbours, measure=self.measure))
+
+        return concat_blocks(blocks)
+
+
+class ContentRecommender(ItemSimilarityRecommender):
+    """Recommends the courses whose contents are the most similar to the courses of the user"""
+    name = 'content'
+
+    def __init__(self, vectors: csr_matrix, neighbours: int = DEFAULT_NEIGHBOURS, min_similarity: float = 0.0):
+        """ContentRecommender constructor
+
+        :param vectors: Content vectors of the courses, a row per column of the training matrix
+        :param neighbours: Similar courses kept per course
+        :param min_similarity: Minimum similarity of a similar course
+        """
+        super().__init__()
+        self.vectors = vectors
+        self.neighbours = neighbours
+        self.min_similarity = min_similarity
+
+    def item_similarities(self, train: csr_matrix) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        blocks = list(top_k_similarities(self.vectors, top_k=self.neighbours, min_similarity=self.min_similarity))
+
+        return concat_blocks(blocks)
+
+
+class UserNeighbourRecommender(Recommender):
+    """Recommends the courses of the users whose leads are the most similar to the leads of the user, weighted by
+    the cosine similarity of their leads
+    """
+    name = 'user-neighbour'
+
+    def __init__(self, neighbours: int = DEFAULT_NEIGHBOURS):
+        """UserNeighbourRecommender constructor
+
+        :param neighbours: Similar users kept per user
+        """
+        super().__init__()
+        self.neighbours = neighbours
+        self.train_t = None
+
+    def fit(self, train: csr_matrix) -> 'UserNeighbourRecommender':
+        super().fit(train)
+        self.train_t = normalize(train.astype(np.float32)).T.tocsr()
+
+        return self
+
+    def scores(self, users: np.ndarray) -> np.ndarray:
+        similarities = normalize(self.train[users].astype(np.float32)).dot(self.train_t).tocoo()
+
+        rows = similarities.row.astype(np.int64)
+        cols = similarities.col.astype(np.int64)
+        not_self = users[rows] != cols
+
+        rows, cols, weights = select_top_k(rows[not_self], cols[not_self], similarities.data[not_self],
+                                           self.neighbours, 0.0)
+        neighbours = coo_matrix((weights, (rows, cols)), shape=(len(users), self.train.shape[0])).tocsr()
+
+        return neighbours.dot(self.train.astype(np.float32)).toarray()
+
+
+class SvdRecommender(Recommender):
+    """Recommends the courses with the highest reconstructed score of a truncated SVD of the leads matrix. The users
+    are folded in: their scores are the projection of their leads onto the latent course factors. A leads matrix with
+    a single user or course cannot be factorized, so the courses with the most leads are recommended instead
+    """
+    name = 'svd'
+
+    def __init__(self, factors: int = DEFAULT_FACTORS):
+        """SvdRecommender constructor
+
+        :param factors: Number of latent factors
+        """
+        super().__init__()
+        self.factors = factors
+        self.item_factors = None
+        self.popularity = None
+
+    def fit(self, train: csr_matrix) -> 'SvdRecommender':
+        super().fit(train)
+
+        # svds needs fewer factors than the smallest dimension of the matrix
+        if min(train.shape) < 2:
+            self.item_factors = None
+            self.popularity = np.asarray(train.sum(axis=0), dtype=np.float32).ravel()
+
+            return self
+
+        factors = max(1, min(self.factors, min(train.shape) - 1))
+        _, _, vt = svds(train.astype(np.float64), k=factors)
+        self.item_factors = vt.T.astype(np.float32)
+
+        return self
+
+    def scores(self, users: np.ndarray) -> np.ndarray:
+        if self.item_factors is None:
+            return np.tile(self.popularity, (len(users), 1))
+
+        return self.train[users].astype(np.float32).dot(self.item_factors).dot(self.item_factors.T)
+
+
+class RankRecommender(Recommender):
+    """Recommends the same courses to every user: the ones with the most leads in the training period"""
+    name = 'rank'
+
+    def __init__(self):
+        super().__init__()
+        self.popularity = None
+
+    def fit(self, train: csr_matrix) -> 'RankRecommender':
+        super().fit(train)
+        self.popularity = np.asarray(train.sum(axis=0), dtype=np.float32).ravel()
+
+        return self
+
+    def scores(self, users: np.ndarray) -> np.ndarray:
+        return np.tile(self.popularity, (len(users), 1))
+
+
+def time_split(leads_df: pd.DataFrame, test_fraction: float = TEST_FRACTION) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Splits the leads by time: the most recent `test_fraction` of them are the test set
+
+    :param leads_df: Leads DataFrame, with the `user_id`, `course_id` and `created_on` columns
+    :param test_fraction: Share of the leads in the test set
+    :return: A tuple with the training and the test leads
+    """
+    created_on = pd.to_datetime(leads_df['created_on'])
+    cutoff = created_on.quantile(1 - test_fraction)
+
+    return leads_df[created_on < cutoff], leads_df[created_on >= cutoff]
+
+
+class Evaluation:
+    """Evaluates recommenders offline on a time-based split of the leads.
+
+    The recommenders learn from the leads before the split and recommend `k` courses to every user who generated
+    leads on both sides of it, leaving out the courses the user already requested. A recommendation is a hit if the
+    user generated a lead in the course after the split. The users are scored by chunks, in parallel.
+    """
+
+    def __init__(self, train_df: pd.DataFrame, test_df: pd.DataFrame):
+        """Evaluation constructor
+
+        :param train_df: Training leads, with the `user_id` and `course_id` columns
+        :param test_df: Test leads, with the `user_id` and `course_id` columns
+        :raises: ValueError if there are no training leads
+        """
+        train_df = train_df[['user_id', 'course_id']].dropna().drop_duplicates()
+        test_df = test_df[['user_id', 'course_id']].dropna().drop_duplicates()
+
+        user_codes, self.user_ids = pd.factorize(train_df['user_id'], sort=True)
+        course_codes, self.course_ids = pd.factorize(train_df['course_id'], sort=True)
+        shape = (len(self.user_ids), len(self.course_ids))
+
+        if not len(train_df):
+            raise ValueError('There are no training leads before the split, the recommenders cannot be evaluated')
+
+        self.train = coo_matrix((np.ones(len(train_df), dtype=np.int8), (user_codes, course_codes)),
+                                shape=shape).tocsr()
+
+        # Only the users with training leads can be scored. The test courses the user already requested are not
+        # counted, the courses without training leads are counted as misses
+        test_users = self.user_ids.get_indexer(test_df['user_id'])
+        test_courses = self.course_ids.get_indexer(test_df['course_id'])
+        test_users, test_courses = test_users[test_users >= 0], test_courses[test_users >= 0]
+
+        known = test_courses >= 0
+        seen = np.zeros(len(test_users), dtype=bool)
+        # Indexing with empty arrays returns a sparse matrix
+        if known.any():
+            seen[known] = np.asarray(self.train[test_users[known], test_courses[known]]).ravel() > 0
+        test_users, test_courses = test_users[~seen], test_courses[~seen]
+
+        self.test_counts = np.bincount(test_users, minlength=shape[0])
+        known = test_courses >= 0
+        self.test = coo_matrix((np.ones(known.sum(), dtype=np.int8), (test_users[known], test_courses[known])),
+                               shape=shape).tocsr()
+        self.users = np.flatnonzero(self.test_counts)
+
+    def evaluate_users(self, recommender: Recommender, users: np.ndarray,
+                       k: int = DEFAULT_K) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, float]:
+        """Recommends `k` courses to some users and measures them
+
+        :param recommender: Fitted recommender
+        :param users: Rows of the users in the training matrix
+        :param k: Number of recommendations per user
+        :return: A tuple with the precision, recall and average precision of every user, the recommended courses and
+            the seconds taken to score the users
+        """
+        start = time.perf_counter()
+
+        scores = np.asarray(recommender.scores(users), dtype=np.float64)
+        seen = self.train[users].tocoo()
+        scores[seen.row, seen.col] = -np.inf
+
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        top = np.take_along_axis(top, np.argsort(-top_scores, axis=1, kind='stable'), axis=1)
+        recommended = np.take_along_axis(scores, top, axis=1) > -np.inf
+
+        seconds = time.perf_counter() - start
+
+        hits = (np.take_along_axis(self.test[users].toarray(), top, axis=1) > 0) & recommended
+        test_counts = self.test_counts[users]
+
+        precision = hits.sum(axis=1) / k
+        recall = hits.sum(axis=1) / test_counts
+        # Precision at the position of every hit
+        hit_precision = np.cumsum(hits, axis=1) / np.arange(1, k + 1) * hits
+        average_precision = hit_precision.sum(axis=1) / np.minimum(test_counts, k)
+
+        return precision, recall, average_precision, np.unique(top[recommended]), seconds
+
+    def evaluate(self, recommender: Recommender, k: int = DEFAULT_K, chunk_size: int = CHUNK_SIZE,
+                 n_jobs: int = 1) -> Dict:
+        """Evaluates a fitted recommender on every test user
+
+        :param recommender: Fitted recommender
+        :param k: Number of recommendations per user
+        :param chunk_size: Number of users scored at once
+        :param n_jobs: Number of worker processes. The recommender and the data are sent once to each worker
+        :return: The mean precision@k, recall@k and MAP@k, the share of the catalogue recommended to any user, and the
+            mean and 95th percentile (across chunks) of the scoring time per user
+        :raises: ValueError if `k` is not positive
+        """
+        if k < 1:
+            raise ValueError('The number of recommendations per user must be at least 1')
+
+        chunks = [self.users[start:start + chunk_size] for start in range(0, len(self.users), chunk_size)]
+
+        if n_jobs <= 1 or len(chunks) <= 1:
+            results = [self.evaluate_users(recommender, users, k) for users in chunks]
+        else:
+            with Pool(processes=n_jobs, initializer=_init_worker, initargs=(recommender, self)) as pool:
+                results = pool.map(_worker_evaluate_users, [(users, k) for users in chunks])
+
+        if not results:
+            results = [(np.array([]), np.array([]), np.array([]), np.array([], dtype=np.int64), 0.0)]
+
+        precision, recall, average_precision, recommended, seconds = zip(*results)
+        latencies = np.array([chunk_seconds / max(len(users), 1) for chunk_seconds, users in zip(seconds, chunks)])
+
+        def mean(values):
+            values = np.concatenate(values)
+            return float(values.mean()) if len(values) else 0.0
+
+        return {'recommender': recommender.name,
+                'users': int(len(self.users)),
+                'precision': mean(precision),
+                'recall': mean(recall),
+                'map': mean(average_precision),
+                'coverage': len(np.unique(np.concatenate(recommended))) / max(len(self.course_ids), 1),
+                'ms_per_user': float(np.sum(seconds) / max(len(self.users), 1) * 1000),
+                'p95_ms_per_user': float(np.percentile(latencies, 95) * 1000) if len(latencies) else 0.0}
+
+
+def _init_worker(recommender: Recommender, evaluation: Evaluation):
+    global _worker_recommender, _worker_evaluation
+
+    _worker_recommender = recommender
+    _worker_evaluation = evaluation
+
+
+def _worker_evaluate_users(args: Tuple[np.ndarray, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray,
+                                                                  float]:
+    users, k = args
+
+    return _worker_evaluation.evaluate_users(_worker_recommender, users, k)
@@ -1,46 +1,145 @@
+import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import bindparam, exc
+from sqlalchemy.sql import text
+
 from .db_service import DbService
+from .schema_functions import decategorize, read_schema
 import pandas as pd
 
 
 class Extract(DbService):
-    def extract_leads(self) -> pd.DataFrame:
-        """Create a leads dataframe from query
+    LEADS_SCHEMA_FILE = 'leads_schema.csv'
+    REVIEWS_SCHEMA_FILE = 'reviews_schema.csv'
+    COURSE_COLUMNS = ['course_title', 'course_description', 'course_category', 'center']
 
+    def extract_leads(self, since: datetime.datetime = None, chunk_size: int = None,
+                      with_courses: bool = True) -> pd.DataFrame:
+        """Create a leads dataframe from query, with the compact dtypes of the leads schema
+
+        :param since: If supplied, only the leads created on or after this date are extracted
+        :param chunk_size: Number of rows fetched at once
+        :param with_courses: Whether or not to extract the course data of every lead. If `False`, the course data can
+            be extracted once per course with `extract_courses`
         :return: a dataframe with leads
         """
-        query = '''SELECT user_id,
-            course_id,
-            course_title,
-            course_description,
-            course_category,
-            center,
-            created_on
-        FROM leads
-        ORDER BY created_on DESC
+        columns = ['user_id', 'course_id'] + (self.COURSE_COLUMNS if with_courses else []) + ['created_on']
+
+        return self.__extract_source__('leads', columns, self.LEADS_SCHEMA_FILE, since, chunk_size)
+
+    def extract_reviews(self, since: datetime.datetime = None, chunk_size: int = None,
+                        with_courses: bool = True) -> pd.DataFrame:
+        """Create a reviews dataframe from query, with the compact dtypes of the reviews schema
+
+        :param since: If supplied, only the reviews created on or after this date are extracted
+        :param chunk_size: Number of rows fetched at once
+        :param with_courses: Whether or not to extract the course data of every review. If `False`, the course data
+            can be extracted once per course with `extract_courses`
+        :return: a dataframe with reviews
+        """
+        columns = ['user_id', 'course_id'] + (self.COURSE_COLUMNS if with_courses else []) + ['rating', 'created_on']
+
+        return self.__extract_source__('reviews', columns, self.REVIEWS_SCHEMA_FILE, since, chunk_size)
+
+    def extract_courses(self, since: datetime.datetime = None) -> pd.DataFrame:
+        """Create a dataframe with the data of each course, taken from its newest lead, or from its newest review if
+        the course has no leads
+
+        :param since: If supplied, only the courses with leads or reviews created on or after this date are extracted
+        :return: a dataframe with a row per course
+        """
+        query = '''SELECT s.course_id,
+            {}
+        FROM {source} s
+        INNER JOIN (
+            SELECT course_id, MAX(created_on) AS created_on
+            FROM {source}
+            {}
+            GROUP BY course_id
+        ) newest ON newest.course_id = s.course_id AND newest.created_on = s.created_on
         '''
 
-        df = self.create_df_from_query(query)
+        dtypes = {column: dtype for column, dtype in read_schema(self.LEADS_SCHEMA_FILE).items()
+                  if column in ['course_id'] + self.COURSE_COLUMNS}
 
-        return df
+        courses = []
+        for source in ['leads', 'reviews']:
+            source_query = query.format(',\n            '.join('s.{}'.format(column) for column in self.COURSE_COLUMNS),
+                                        'WHERE created_on >= :since' if since else '',
+                                        source=source)
 
-    def extract_reviews(self) -> pd.DataFrame:
-        """Create a reviews dataframe from query
+            courses.append(self.stream_df_from_query(text(source_query), dtypes,
+                                                     params={'since': since} if since else None))
 
-        :return: a dataframe with reviews
+        # Rows with the same creation date can be repeated. Leads come first, so they are preferred
+        df = pd.concat([decategorize(df) for df in courses], ignore_index=True)
+
+        return df.drop_duplicates('course_id').reset_index(drop=True)
+
+    def __extract_source__(self, source: str, columns: List[str], schema_file: str, since: datetime.datetime = None,
+                           chunk_size: int = None) -> pd.DataFrame:
+        """Extracts some columns of a source table, newest rows first
+
+        :param source: Source table name, leads or reviews
+        :param columns: Column names
+        :param schema_file: Schema file of the source table
+        :param since: If supplied, only the rows created on or after this date are extracted
+        :param chunk_size: Number of rows fetched at once
+        :return: a dataframe with the source rows
         """
-        query = '''SELECT user_id,
-            course_id,
-            course_title,
-            course_category,
-            course_description,
-            center,
-            rating,
-            created_on
-        FROM reviews
+        query = '''SELECT {}
+        FROM {}
+        {}
         ORDER BY created_on DESC
-        '''
+        '''.format(',\n            '.join(columns), source, 'WHERE created_on >= :since' if since else '')
+
+        dtypes = {column: dtype for column, dtype in read_schema(schema_file).items() if column in columns}
+
+        return self.stream_df_from_query(text(query), dtypes, params={'since': since} if since else None,
+                                         chunk_size=chunk_size)
+
+    def extract_watermark(self, source: str) -> Optional[datetime.datetime]:
+        """Returns the creation date of the newest row of a source table loaded by a previous run
+
+        :param source: Source table name, leads or reviews
+        :return: The watermark or `None` if there is no watermark for the source
+        """
+        query = text('SELECT created_on FROM etl_watermarks WHERE source = :source')
+
+        try:
+            df = self.create_df_from_query(query, params={'source': source})
+        except exc.ProgrammingError:
+            # The watermarks table does not exist yet
+            return None
+
+        if df.shape[0] == 0:
+            return None
+
+        return df['created_on'].iloc[0].to_pydatetime()
+
+    def extract_clean_courses(self) -> pd.DataFrame:
+        """Create a dataframe with the courses loaded by a previous run
+
+        :return: a dataframe with courses
+        """
+        return self.create_df_from_query('SELECT * FROM courses')
+
+    def extract_clean_events(self, course_ids: List[str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Create the leads and reviews dataframes of some courses from the loaded clean data
+
+        :param course_ids: Course ids
+        :return: A tuple with the leads DataFrame and reviews DataFrame
+        """
+        leads_query = text('''SELECT user_id, course_id, created_on
+            FROM clean_leads
+            WHERE course_id IN :course_ids''').bindparams(bindparam('course_ids', expanding=True))
 
-        df = self.create_df_from_query(query)
+        reviews_query = text('''SELECT user_id, course_id, rating, created_on
+            FROM clean_reviews
+            WHERE course_id IN :course_ids''').bindparams(bindparam('course_ids', expanding=True))
 
-        return df
+        leads_df = self.create_df_from_query(leads_query, params={'course_ids': list(course_ids)})
+        reviews_df = self.create_df_from_query(reviews_query, params={'course_ids': list(course_ids)})
 
+        return leads_df, reviews_df
@@ -1,19 +1,35 @@
+import datetime
+import os
+import tempfile
+from typing import Dict, List
+
+from sqlalchemy import bindparam
+from sqlalchemy.sql import text
+
 from .db_service import DbService
 import pandas as pd
 
 
 class Load(DbService):
+    # Rows sent in each multi-row insert
+    BULK_INSERT_ROWS = 5000
+
+    def __init__(self, db_user: str, db_password: str, db_name: str = None, db_host: str = None,
+                 local_infile: bool = False):
+        """Load constructor
+
+        :param local_infile: Whether or not to bulk load tables with `LOAD DATA LOCAL INFILE` instead of multi-row
+            inserts. The server must have the `local_infile` option enabled
+        """
+        super().__init__(db_user, db_password, db_name, db_host)
+        self.local_infile = local_infile
+
     def save_courses(self, courses_df: pd.DataFrame):
         """Saves courses DataFrame to database
 
         :param courses_df: Courses DataFrame
         """
-        connection = self.connection()
-
-        sql_drop = 'DROP TABLE IF EXISTS `courses`'
-        connection.execute(sql_drop)
-
-        sql_create = """CREATE TABLE `courses` (
+        sql_create = """CREATE TABLE `{}` (
           `id` varchar(9) NOT NULL,
           `title` text,
           `description` text,
@@ -23,48 +39,43 @@ class Load(DbService):
           `weighted_rating` double DEFAULT NULL,
           `number_of_leads` int(11) DEFAULT NULL,
           `category_id` int(11) NOT NULL,
-          PRIMARY KEY (`id`),
-          KEY `courses_category_id_index` (`category_id`)
+          PRIMARY KEY (`id`)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8
         """
-        connection.execute(sql_create)
 
-        courses_df.to_sql('courses', con=connection, if_exists='append', index=False)
+        # Long texts, fewer rows per insert to stay under the server max packet size
+        self.bulk_load('courses', sql_create, courses_df,
+                       # Cover the category filters, the category aggregates and the sort orders of the web queries,
+                       # with and without a category
+                       indexes=['KEY `courses_category_id_index` '
+                                '(`category_id`, `number_of_leads`, `weighted_rating`, `num_reviews`)',
+                                'KEY `courses_category_id_rating_index` '
+                                '(`category_id`, `weighted_rating`, `num_reviews`, `number_of_leads`)',
+                                'KEY `courses_leads_index` (`number_of_leads`, `weighted_rating`, `num_reviews`)',
+                                'KEY `courses_rating_index` (`weighted_rating`, `num_reviews`, `number_of_leads`)'],
+                       rows_per_insert=self.BULK_INSERT_ROWS // 10)
 
     def save_leads(self, leads_df: pd.DataFrame):
         """Saves leads DataFrame to database
 
         :param leads_df: Leads DataFrame
         """
-        connection = self.connection()
-        leads_df = leads_df[['user_id', 'course_id', 'created_on']]
-
-        sql_drop = 'DROP TABLE IF EXISTS `clean_leads`'
-        connection.execute(sql_drop)
-
-        sql_create = """CREATE TABLE `clean_leads` (
+        sql_create = """CREATE TABLE `{}` (
             `user_id`    CHAR(36) NOT NULL,
             `course_id`  VARCHAR(12) NOT NULL,
             `created_on` DATETIME NOT NULL,
             PRIMARY KEY (`user_id`, `course_id`)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8
         """
-        connection.execute(sql_create)
 
-        leads_df.to_sql('clean_leads', con=connection, if_exists='append', index=False)
+        self.bulk_load('clean_leads', sql_create, leads_df[['user_id', 'course_id', 'created_on']])
 
     def save_reviews(self, reviews_df: pd.DataFrame):
         """Saves reviews DataFrame to database
 
         :param reviews_df: Reviews DataFrame
         """
-        connection = self.connection()
-        reviews_df = reviews_df[['user_id', 'course_id', 'rating', 'created_on']]
-
-        sql_drop = 'DROP TABLE IF EXISTS `clean_reviews`'
-        connection.execute(sql_drop)
-
-        sql_create = """CREATE TABLE `clean_reviews` (
+        sql_create = """CREATE TABLE `{}` (
             `user_id`    CHAR(36) NOT NULL,
             `course_id`  VARCHAR(12) NOT NULL,
             `rating`     INT NOT NULL,
@@ -72,27 +83,222 @@ class Load(DbService):
             PRIMARY KEY (`user_id`, `course_id`)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8
         """
-        connection.execute(sql_create)
 
-        reviews_df.to_sql('clean_reviews', con=connection, if_exists='append', index=False)
+        self.bulk_load('clean_reviews', sql_create, reviews_df[['user_id', 'course_id', 'rating', 'created_on']])
 
     def save_categories(self, categories_df: pd.DataFrame):
         """Saves categories DataFrame to database
 
         :param categories_df: Categories DataFrame
         """
-        connection = self.connection()
-
-        sql_drop = 'DROP TABLE IF EXISTS `categories`'
-        connection.execute(sql_drop)
-
-        sql_create = """CREATE TABLE `categories` (
+        sql_create = """CREATE TABLE `{}` (
           `id` int(11) NOT NULL,
           `name` varchar(200) NOT NULL,
           PRIMARY KEY (`id`)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8
         """
 
-        connection.execute(sql_create)
+        self.bulk_load('categories', sql_create, categories_df)
+
+    def save_ranked_courses(self, ranked_courses_df: pd.DataFrame):
+        """Saves ranked courses DataFrame to database
+
+        :param ranked_courses_df: Ranked courses DataFrame
+        """
+        sql_create = """CREATE TABLE `{}` (
+          `ranking` varchar(10) NOT NULL,
+          `category_id` int(11) NOT NULL,
+          `position` smallint NOT NULL,
+          `course_id` varchar(9) NOT NULL,
+          PRIMARY KEY (`ranking`, `category_id`, `position`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8
+        """
+
+        self.bulk_load('ranked_courses', sql_create, ranked_courses_df)
+
+    def bulk_load(self, table: str, sql_create: str, df: pd.DataFrame, indexes: List[str] = None,
+                  rows_per_insert: int = None):
+        """Replaces a table with the rows of a DataFrame, without the table ever being empty or half loaded
+
+        The rows are loaded into a staging table that only has its primary key, the secondary indexes are built once
+        the rows are loaded and then the staging table is swapped in with a single `RENAME TABLE` statement, which
+        is atomic. Readers see either the old table or the new one.
+
+        :param table: Table name
+        :param sql_create: `CREATE TABLE` statement, with a `{}` placeholder for the table name
+        :param df: DataFrame with a column per table column
+        :param indexes: Secondary index definitions, as in a `CREATE TABLE` statement
+        :param rows_per_insert: Rows sent in each multi-row insert
+        """
+        self.with_retry(self.__bulk_load__, table, sql_create, df, indexes, rows_per_insert)
+
+    def __bulk_load__(self, table: str, sql_create: str, df: pd.DataFrame, indexes: List[str] = None,
+                      rows_per_insert: int = None):
+        """Runs a bulk load. See `bulk_load`. The whole load can be retried, the staging table is created again"""
+        staging_table = '{}_staging'.format(table)
+        old_table = '{}_old'.format(table)
+        engine = self.connection(local_infile=self.local_infile)
+
+        engine.execute('DROP TABLE IF EXISTS `{}`, `{}`'.format(staging_table, old_table))
+        engine.execute(sql_create.format(staging_table))
+
+        if self.local_infile:
+            self.__load_infile__(engine, staging_table, df)
+        else:
+            df.to_sql(staging_table, con=engine, if_exists='append', index=False, method='multi',
+                      chunksize=rows_per_insert if rows_per_insert else self.BULK_INSERT_ROWS)
+
+        if indexes:
+            engine.execute('ALTER TABLE `{}` {}'.format(staging_table,
+                                                        ', '.join('ADD {}'.format(index) for index in indexes)))
+
+        if engine.has_table(table):
+            engine.execute('RENAME TABLE `{0}` TO `{1}`, `{2}` TO `{0}`'.format(table, old_table, staging_table))
+            engine.execute('DROP TABLE `{}`'.format(old_table))
+        else:
+            engine.execute('RENAME TABLE `{}` TO `{}`'.format(staging_table, table))
+
+    @staticmethod
+    def __load_infile__(engine, table: str, df: pd.DataFrame):
+        """Loads the rows of a DataFrame into a table with `LOAD DATA LOCAL INFILE`
+
+        :param engine: Engine created with the `local_infile` option
+        :param table: Table name
+        :param df: DataFrame with a column per table column
+        """
+        text_columns = df.select_dtypes(include=['object', 'category']).columns
+
+        # Backslash is the escape character of the file and nulls are written as \N
+        df = df.assign(**{column: df[column].map(lambda value: value.replace('\\', '\\\\')
+                                                 if isinstance(value, str) else value)
+                          for column in text_columns})
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False) as file:
+            df.to_csv(file, index=False, header=False, na_rep='\\N', line_terminator='\n',
+                      date_format='%Y-%m-%d %H:%M:%S')
+
+        sql_load = """LOAD DATA LOCAL INFILE :file_name INTO TABLE `{}` CHARACTER SET utf8
+            FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY '\\\\'
+            LINES TERMINATED BY '\\n' ({})""".format(table, ', '.join('`{}`'.format(column) for column in df.columns))
+
+        try:
+            engine.execute(text(sql_load), file_name=file.name)
+        finally:
+            os.remove(file.name)
+
+    def append_leads(self, leads_df: pd.DataFrame):
+        """Adds leads to the clean leads table. Leads of a user in a course that is already in the table are ignored
+
+        :param leads_df: Leads DataFrame
+        """
+        sql_insert = """INSERT IGNORE INTO `clean_leads` (`user_id`, `course_id`, `created_on`)
+            VALUES (:user_id, :course_id, :created_on)"""
+
+        self.execute_many(sql_insert, leads_df[['user_id', 'course_id', 'created_on']])
+
+    def append_reviews(self, reviews_df: pd.DataFrame):
+        """Adds reviews to the clean reviews table. Reviews of a user in a course that is already in the table are
+            ignored
+
+        :param reviews_df: Reviews DataFrame
+        """
+        sql_insert = """INSERT IGNORE INTO `clean_reviews` (`user_id`, `course_id`, `rating`, `created_on`)
+            VALUES (:user_id, :course_id, :rating, :created_on)"""
+
+        self.execute_many(sql_insert, reviews_df[['user_id', 'course_id', 'rating', 'created_on']])
+
+    def upsert_courses(self, courses_df: pd.DataFrame):
+        """Inserts new courses and updates the existing ones
+
+        :param courses_df: Courses DataFrame
+        """
+        columns = ['id', 'title', 'description', 'center', 'avg_rating', 'num_reviews', 'weighted_rating',
+                   'number_of_leads', 'category_id']
+
+        sql_upsert = """INSERT INTO `courses` ({}) VALUES ({}) ON DUPLICATE KEY UPDATE {}""".format(
+            ', '.join('`{}`'.format(column) for column in columns),
+            ', '.join(':{}'.format(column) for column in columns),
+            ', '.join('`{0}` = VALUES(`{0}`)'.format(column) for column in columns[1:]))
+
+        self.execute_many(sql_upsert, courses_df[columns])
+
+    def upsert_categories(self, categories_df: pd.DataFrame):
+        """Inserts new categories and updates the name of the existing ones
+
+        :param categories_df: Categories DataFrame
+        """
+        sql_upsert = """INSERT INTO `categories` (`id`, `name`) VALUES (:id, :name)
+            ON DUPLICATE KEY UPDATE `name` = VALUES(`name`)"""
+
+        self.execute_many(sql_upsert, categories_df[['id', 'name']])
+
+    def replace_ranked_courses(self, ranked_courses_df: pd.DataFrame, category_ids: List[int]):
+        """Replaces the ranked courses lists of some categories in a single transaction
+
+        :param ranked_courses_df: Ranked courses DataFrame. It must contain the lists of `category_ids` only
+        :param category_ids: Category ids of the replaced lists. Use 0 for the lists of all categories
+        """
+        sql_delete = text('DELETE FROM `ranked_courses` WHERE `category_id` IN :category_ids').bindparams(
+            bindparam('category_ids', expanding=True))
+
+        sql_insert = text("""INSERT INTO `ranked_courses` (`ranking`, `category_id`, `position`, `course_id`)
+            VALUES (:ranking, :category_id, :position, :course_id)""")
+
+        def replace():
+            with self.transaction() as connection:
+                connection.execute(sql_delete, category_ids=[int(category_id) for category_id in category_ids])
+
+                if ranked_courses_df.shape[0] > 0:
+                    connection.execute(sql_insert, Load.__records__(ranked_courses_df))
+
+        self.with_retry(replace)
+
+    def save_watermarks(self, watermarks: Dict[str, datetime.datetime]):
+        """Saves the creation date of the newest row loaded from each source table
+
+        :param watermarks: Watermarks keyed by source table name
+        """
+        sql_create = """CREATE TABLE IF NOT EXISTS `etl_watermarks` (
+          `source` varchar(20) NOT NULL,
+          `created_on` datetime NOT NULL,
+          PRIMARY KEY (`source`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8
+        """
+        sql_upsert = text("""INSERT INTO `etl_watermarks` (`source`, `created_on`) VALUES (:source, :created_on)
+            ON DUPLICATE KEY UPDATE `created_on` = VALUES(`created_on`)""")
+
+        def save():
+            with self.transaction() as connection:
+                connection.execute(sql_create)
 
-        categories_df.to_sql('categories', con=connection, if_exists='append', index=False)
+                for source, created_on in watermarks.items():
+                    if created_on is not None:
+                        connection.execute(sql_upsert, source=source, created_on=created_on)
+
+        self.with_retry(save)
+
+    def execute_many(self, sql: str, df: pd.DataFrame):
+        """Executes a statement once per DataFrame row, in a single round trip and a single transaction
+
+        :param sql: Statement with a named parameter for each DataFrame column
+        :param df: A pandas DataFrame
+        """
+        if df.shape[0] == 0:
+            return
+
+        records = Load.__records__(df)
+
+        def execute():
+            with self.transaction() as connection:
+                connection.execute(text(sql), records)
+
+        self.with_retry(execute)
+
+    @staticmethod
+    def __records__(df: pd.DataFrame) -> List[Dict]:
+        """Converts a DataFrame into a list of statement parameters. Null values are converted into `None`
+
+        :param df: A pandas DataFrame
+        :return: A list of dictionaries, one per row
+        """
+        return df.astype(object).where(df.notnull(), None).to_dict('records')
@@ -1,24 +1,39 @@
+from typing import Dict, Iterable, Iterator, List
+
 import numpy as np
 import pandas as pd
-import pickle
 
-from scipy.sparse import csr_matrix
-from sklearn.pipeline import Pipeline
+from scipy.sparse import coo_matrix
+from sqlalchemy import bindparam, text
 
 from .db_service import DbService
+from .ann import ContentIndex
+from .artifacts import save_user_courses_bundle
+from .cache import HashCache
+from .content import DEFAULT_TOP_K, rows_top_k, top_k_similarities
+from .cooccurrence import DEFAULT_RECOMMENDATIONS, JACCARD, cooccurrence_top_k, score_counts
+from .reviewers import DEFAULT_NEIGHBOURS, MIN_REVIEWS, nearest_reviewers, ratings_matrix
+from .text_functions import cached_map, content_hash, normalize_texts
 
-from txtools.normalizer import TextNormalizer
 from txtools.similarity import Similarity
 
 
 class Model(DbService):
+    # Rows sent in a single multi-row insert
+    INSERT_ROWS = 5000
+
     def __init__(self, db_user: str, db_password: str, db_name: str = None, db_host: str = None):
         self.courses_df = None
         self.leads_df = None
         self.courses_content_sims_df = None
         self.leads_user_item_matrix = None
-        self.user_requested_courses_map = {}
+        self.leads_sparse_matrix = None
+        self.leads_user_ids = None
+        self.leads_course_ids = None
         self.course_course_recs_df = None
+        self.content_index = None
+        self.reviews_df = None
+        self.similar_reviewers_df = None
 
         super().__init__(db_user, db_password, db_name, db_host)
 
@@ -27,7 +42,7 @@ class Model(DbService):
         :return: Courses DataFrame
         """
         if self.courses_df is None:
-            self.courses_df = pd.read_sql_query('SELECT * FROM courses', con=self.connection())
+            self.courses_df = self.create_df_from_query('SELECT * FROM courses')
 
         return self.courses_df
 
@@ -36,15 +51,56 @@ class Model(DbService):
         :return: Leads DataFrame
         """
         if self.leads_df is None:
-            self.leads_df = pd.read_sql_query('SELECT * FROM clean_leads ORDER BY created_on DESC',
-                                              con=self.connection())
+            self.leads_df = self.create_df_from_query('SELECT * FROM clean_leads ORDER BY created_on DESC')
         return self.leads_df
 
-    def create_course_content_similarity_matrix(self, sample_len: int = None) -> np.ndarray:
-        """ Creates a course similarity matrix
+    def retrieve_reviews(self) -> pd.DataFrame:
+        """Retrieve reviews from database
+        :return: Reviews DataFrame
+        """
+        if self.reviews_df is None:
+            self.reviews_df = self.create_df_from_query('SELECT user_id, course_id, rating FROM clean_reviews')
+        return self.reviews_df
+
+    def course_contents(self, sample_len: int = None) -> pd.Series:
+        """Returns the content (title and description) of the courses
+
+        :param sample_len: Maximum number of courses. If `None`, all courses in DataFrame will be used.
+        :return: The contents, aligned with the courses DataFrame
+        """
+        self.retrieve_courses()
+
+        course_content = self.courses_df['title'].str.cat(self.courses_df['description'], sep='. ')
+
+        if sample_len:
+            course_content = course_content.head(sample_len)
+
+        return course_content
+
+    def normalized_course_contents(self, sample_len: int = None, n_jobs: int = 1,
+                                   cache: HashCache = None) -> pd.Series:
+        """Normalizes the content (title and description) of the courses
+
+        :param sample_len: Maximum number of courses. If `None`, all courses in DataFrame will be used.
+        :param n_jobs: Number of processes used to normalize the courses content
+        :param cache: Normalized texts cache keyed by the content hash, with a `normalized` column. The ETL pipeline
+            fills it, so only the contents that are not in it are normalized
+        :return: The normalized contents, aligned with the courses DataFrame
+        """
+        if cache is None:
+            cache = HashCache(['normalized'])
+
+        return cached_map(self.course_contents(sample_len), normalize_texts, cache, 'normalized', n_jobs=n_jobs)
+
+    def create_course_content_similarity_matrix(self, sample_len: int = None, n_jobs: int = 1,
+                                                cache: HashCache = None) -> np.ndarray:
+        """ Creates a dense course similarity matrix. It needs m x m floats, so it is only suitable for samples,
+        `create_course_content_similarity_df` does not build it
 
         :param sample_len: Maximum number of courses used to create the matrix. If `None`, all courses in DataFrame
             will be used.
+        :param n_jobs: Number of processes used to normalize the courses content
+        :param cache: Normalized texts cache. See `normalized_course_contents`
         :return: An m x m matrix representing the course similarities, where m is the number of courses.
             Example of a similarity matrix:
 
@@ -55,100 +111,280 @@ class Model(DbService):
 
             rows and columns represents a course, the elements in the matrix, represent the similarity between them.
         """
+        normalized_content = self.normalized_course_contents(sample_len=sample_len, n_jobs=n_jobs, cache=cache)
 
-        self.retrieve_courses()
-
-        course_content = self.courses_df['title'].str.cat(self.courses_df['description'], sep='. ')
-
-        if not sample_len:
-            course_content = course_content.values
-        else:
-            course_content = course_content.head(sample_len).values
-
-        model = Pipeline([
-            ('norm', TextNormalizer()),
-            ('sim', Similarity())
-        ])
+        return Similarity().fit_transform(normalized_content.values)
 
-        return model.fit_transform(course_content)
+    def create_course_content_similarity_df(self, min_similarity: float = 0.5, sample_len: int = None,
+                                            n_jobs: int = 1, cache: HashCache = None, top_k: int = DEFAULT_TOP_K,
+                                            block_size: int = None, approximate: bool = False) -> pd.DataFrame:
+        """Creates a course similarity DataFrame with the `top_k` most similar courses of every course
 
-    def create_course_content_similarity_df(self, min_similarity: float = 0.5, sample_len: int = None) -> pd.DataFrame:
-        """Creates a course similarity DataFrame from a similarity matrix
+        The similarities are the cosine similarities of the TF-IDF vectors of the normalized contents. They are
+        computed by blocks of courses across `n_jobs` processes and pruned as each block is computed, so the m x m
+        similarity matrix is never built.
 
         :param min_similarity: Minimum similarity to be included in DataFrame
         :param sample_len: Maximum number of courses used to create the DataFrame. If `None`, all courses in
             courses DataFrame will be used.
+        :param n_jobs: Number of processes used to normalize the courses content and to compute the similarities
+        :param cache: Normalized texts cache. See `normalized_course_contents`
+        :param top_k: Maximum number of similar courses per course
+        :param block_size: Number of courses whose similarities are computed at once. See `top_k_similarities`
+        :param approximate: Whether or not to compare every course only with the candidates of the content index. See
+            `ContentIndex`
         :return: a dataframe with following columns:
             a_course str: course id
             another_course str: course id
             similarity float: similarity between courses
         """
-        self.retrieve_courses()
-        sim_list = []
-        sim_matrix = self.create_course_content_similarity_matrix(sample_len=sample_len)
+        chunks = list(self.course_content_similarity_chunks(min_similarity=min_similarity, sample_len=sample_len,
+                                                            n_jobs=n_jobs, cache=cache, top_k=top_k,
+                                                            block_size=block_size, approximate=approximate))
 
-        for idx, similarities in enumerate(sim_matrix):
-            a_course_id = self.courses_df.iloc[idx]['id']
+        if len(chunks) == 0:
+            chunks.append(pd.DataFrame(columns=['a_course_id', 'another_course_id', 'similarity']))
 
-            for idx_sims, similarity in enumerate(similarities):
-                if idx == idx_sims:
-                    continue
+        self.courses_content_sims_df = pd.concat(chunks, ignore_index=True)
 
-                if similarity < min_similarity:
-                    continue
+        return self.courses_content_sims_df
 
-                another_course_id = self.courses_df.iloc[idx_sims]['id']
+    def course_content_similarity_chunks(self, min_similarity: float = 0.5, sample_len: int = None, n_jobs: int = 1,
+                                         cache: HashCache = None, top_k: int = DEFAULT_TOP_K, block_size: int = None,
+                                         approximate: bool = False) -> Iterator[pd.DataFrame]:
+        """Computes the course similarities block of courses by block of courses. See
+        `create_course_content_similarity_df` for the parameters
 
-                sim_list.append({'a_course_id': a_course_id,
-                                 'another_course_id': another_course_id,
-                                 'similarity': similarity})
+        The course ids are looked up in an id array by the row and column indexes of the similarities, so every
+        block becomes a DataFrame without iterating over its pairs. The content index is built first and kept in
+        the `content_index` attribute, so it can be saved for the online queries.
 
-        self.courses_content_sims_df = pd.DataFrame(sim_list)
+        :param approximate: Whether or not to compare every course only with the candidates of the content index,
+            instead of with every other course
 
-        return self.courses_content_sims_df
+        :return: An iterator of similarity DataFrames, one per block, with the columns of
+            `create_course_content_similarity_df`
+        """
+        index = self.create_content_index(sample_len=sample_len, n_jobs=n_jobs, cache=cache)
+
+        if approximate:
+            blocks = index.top_k_similarities(top_k=top_k, min_similarity=min_similarity, block_size=block_size)
+        else:
+            blocks = top_k_similarities(index.vectors, top_k=top_k, min_similarity=min_similarity,
+                                        block_size=block_size, n_jobs=n_jobs)
+
+        for rows, neighbours, similarities in blocks:
+            yield pd.DataFrame({'a_course_id': index.course_ids[rows],
+                                'another_course_id': index.course_ids[neighbours],
+                                'similarity': similarities.astype(np.float64)},
+                               columns=['a_course_id', 'another_course_id', 'similarity'])
+
+    def create_content_index(self, sample_len: int = None, n_jobs: int = 1, cache: HashCache = None,
+                             n_tables: int = ContentIndex.DEFAULT_TABLES, n_bits: int = None) -> ContentIndex:
+        """Creates the approximate nearest neighbour index of the courses contents
+
+        :param sample_len: Maximum number of courses. If `None`, all courses in DataFrame will be used.
+        :param n_jobs: Number of processes used to normalize the courses content
+        :param cache: Normalized texts cache. See `normalized_course_contents`
+        :param n_tables: Number of hash tables of the index
+        :param n_bits: Number of bits of the index codes. See `ContentIndex.build`
+        :return: The index, also kept in the `content_index` attribute
+        """
+        normalized_content = self.normalized_course_contents(sample_len=sample_len, n_jobs=n_jobs, cache=cache)
+        course_ids = self.courses_df['id'].values[:len(normalized_content)]
+        content_hashes = self.course_contents(sample_len).map(content_hash).values
+
+        self.content_index = ContentIndex.build(normalized_content.values, course_ids, content_hashes,
+                                                n_tables=n_tables, n_bits=n_bits)
+
+        return self.content_index
+
+    def update_course_content_similarities(self, index: ContentIndex, index_directory: str,
+                                           min_similarity: float = 0.5, top_k: int = DEFAULT_TOP_K, n_jobs: int = 1,
+                                           cache: HashCache = None) -> Dict[str, int]:
+        """Updates the content similarities of the courses added, changed or removed since the content index was
+        saved, instead of computing all of them again
+
+        New, changed and removed courses are detected by the content hashes of the index, which is used as the
+        vector store: only the new and changed contents are normalized and vectorized. The similarities are then
+        recomputed for the courses whose neighbours may have changed, which are the new and changed courses and the
+        courses similar to them or to the removed courses, and replaced in the database. The updated index is saved.
+
+        The vectors keep the vocabulary and weights of the last full run, so terms that were not in the catalogue
+        then are ignored until the next full run.
+
+        :param index: Content index saved by the last run, see `ContentIndex.load`
+        :param index_directory: Directory where the updated index is saved
+        :param min_similarity: Minimum similarity to be included
+        :param top_k: Maximum number of similar courses per course
+        :param n_jobs: Number of processes used to normalize the courses content
+        :param cache: Normalized texts cache. See `normalized_course_contents`
+        :return: The number of new, changed, removed and recomputed courses, and of similarities saved
+        """
+
+        course_contents = self.course_contents()
+        course_ids = self.courses_df['id'].values.astype(str)
+        content_hashes = course_contents.map(content_hash).values.astype(str)
+
+        indexed_hashes = pd.Series(index.content_hashes, index=index.course_ids)
+        indexed = np.isin(course_ids, index.course_ids)
+
+        new = ~indexed
+        changed = indexed & (indexed_hashes.reindex(course_ids).values != content_hashes)
+        updated_ids = course_ids[new | changed]
+        removed_ids = index.course_ids[~np.isin(index.course_ids, course_ids)]
+        stale_ids = np.concatenate([removed_ids, course_ids[changed]])
+
+        stats = {'new': int(new.sum()), 'changed': int(changed.sum()), 'removed': len(removed_ids),
+                 'recomputed': 0, 'similarities': 0}
+
+        if len(updated_ids) == 0 and len(removed_ids) == 0:
+            self.content_index = index
+            return stats
+
+        # Courses whose neighbours may include a removed or changed course, by the vectors they had
+        _, neighbours, _ = rows_top_k(index.vectors, index.positions(stale_ids), index.vectors.shape[0],
+                                      min_similarity)
+        affected_ids = set(index.course_ids[neighbours])
+
+        if cache is None:
+            cache = HashCache(['normalized'])
+
+        normalized_content = cached_map(course_contents[new | changed], normalize_texts, cache, 'normalized',
+                                        n_jobs=n_jobs)
+
+        index = index.replace(stale_ids, updated_ids, content_hashes[new | changed],
+                              index.vectorize(normalized_content.values))
+
+        # Courses whose neighbours may include a new or changed course
+        _, neighbours, _ = rows_top_k(index.vectors, index.positions(updated_ids), index.vectors.shape[0],
+                                      min_similarity)
+        affected_ids |= set(index.course_ids[neighbours]) | set(updated_ids)
+        affected_ids -= set(removed_ids)
+
+        rows, neighbours, similarities = rows_top_k(index.vectors, index.positions(list(affected_ids)), top_k,
+                                                    min_similarity)
+
+        courses_content_sims_df = pd.DataFrame({'a_course_id': index.course_ids[rows],
+                                                'another_course_id': index.course_ids[neighbours],
+                                                'similarity': similarities.astype(np.float64)},
+                                               columns=['a_course_id', 'another_course_id', 'similarity'])
+
+        self.replace_course_content_similarities(list(affected_ids | set(removed_ids)), courses_content_sims_df)
 
-    def save_course_content_similarities(self):
-        """Saves courses content similarities DataFrame to database"""
+        index.save(index_directory)
+        self.content_index = index
+
+        stats['recomputed'] = len(affected_ids)
+        stats['similarities'] = courses_content_sims_df.shape[0]
+
+        return stats
+
+    def replace_course_content_similarities(self, course_ids: List[str], courses_content_sims_df: pd.DataFrame):
+        """Replaces the content similarities of some courses in a single transaction
+
+        :param course_ids: Course ids whose similarities are replaced
+        :param courses_content_sims_df: New similarities of the courses, with the columns of
+            `create_course_content_similarity_df`
+        """
+        sql_delete = text('DELETE FROM `courses_similarities` WHERE `a_course_id` IN :course_ids').bindparams(
+            bindparam('course_ids', expanding=True))
+
+        sql_insert = text("""INSERT INTO `courses_similarities` (`a_course_id`, `another_course_id`, `similarity`)
+            VALUES (:a_course_id, :another_course_id, :similarity)""")
+
+        records = courses_content_sims_df[['a_course_id', 'another_course_id', 'similarity']].astype(object) \
+            .to_dict('records')
+
+        def replace():
+            with self.transaction() as connection:
+                connection.execute(sql_delete, course_ids=[str(course_id) for course_id in course_ids])
+
+                if len(records) > 0:
+                    connection.execute(sql_insert, records)
+
+        self.with_retry(replace)
+
+    def save_course_content_similarities(self, chunks: Iterable[pd.DataFrame] = None) -> int:
+        """Saves courses content similarities to database
+
+        The similarities are written to a staging table, chunk by chunk as they are produced, which then replaces the
+        `courses_similarities` table. The web application keeps reading the previous similarities meanwhile.
+
+        :param chunks: Similarity DataFrames, such as the ones produced by `course_content_similarity_chunks`. If
+            `None`, the similarities DataFrame is saved
+        :return: Number of similarities saved
+        """
+        if chunks is None:
+            chunks = [self.courses_content_sims_df]
+
+        table = 'courses_similarities'
+        staging_table = '{}_staging'.format(table)
+        old_table = '{}_old'.format(table)
         connection = self.connection()
 
-        sql_drop = 'DROP TABLE IF EXISTS `courses_similarities`'
-        connection.execute(sql_drop)
+        connection.execute('DROP TABLE IF EXISTS `{}`, `{}`'.format(staging_table, old_table))
 
-        sql_create = """CREATE TABLE `courses_similarities` (
+        sql_create = """CREATE TABLE `{}` (
           `a_course_id` VARCHAR(9) NOT NULL,
           `another_course_id` VARCHAR(9) NOT NULL,
           `similarity` DOUBLE NOT NULL,
-          PRIMARY KEY (`a_course_id`, `another_course_id`)
+          PRIMARY KEY (`a_course_id`, `another_course_id`),
+          KEY `courses_similarities_similarity_index` (`a_course_id`, `similarity`)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8
         """
-        connection.execute(sql_create)
+        connection.execute(sql_create.format(staging_table))
 
         # Save course similarities to database
-        self.courses_content_sims_df.to_sql('courses_similarities', con=connection,
-                                            if_exists='append', index=False)
+        rows = 0
+        for chunk in chunks:
+            chunk.to_sql(staging_table, con=connection, if_exists='append', index=False, method='multi',
+                         chunksize=self.INSERT_ROWS)
+            rows += chunk.shape[0]
+
+        if connection.has_table(table):
+            connection.execute('RENAME TABLE `{0}` TO `{1}`, `{2}` TO `{0}`'.format(table, old_table, staging_table))
+            connection.execute('DROP TABLE `{}`'.format(old_table))
+        else:
+            connection.execute('RENAME TABLE `{}` TO `{}`'.format(staging_table, table))
+
+        return rows
 
     def create_leads_user_item_matrix(self):
-        """Creates a leads user-item matrix DataFrame reviews"""
+        """Creates the leads user-item matrix as a sparse COO matrix, with a row per user and a column per course
 
+        The user and course ids are factorized in sorted order, so the matrix is built straight from the leads without
+        a dense users x courses intermediate. Repeated leads of a user in a course are counted once.
+        """
         self.retrieve_leads()
-        user_items = self.leads_df[['user_id', 'course_id']]
+        user_items = self.leads_df[['user_id', 'course_id']].dropna()
+
+        user_codes, self.leads_user_ids = pd.factorize(user_items['user_id'], sort=True)
+        course_codes, self.leads_course_ids = pd.factorize(user_items['course_id'], sort=True)
+        shape = (len(self.leads_user_ids), len(self.leads_course_ids))
 
-        user_item_matrix = user_items.groupby(['user_id', 'course_id'])['course_id'].max().unstack()
-        user_item_matrix = user_item_matrix.where(user_item_matrix.isnull(), other=1)
-        user_item_matrix = user_item_matrix.fillna(0)
+        cells = np.unique(user_codes.astype(np.int64) * shape[1] + course_codes)
+        rows, cols = np.divmod(cells, shape[1])
 
-        self.leads_user_item_matrix = user_item_matrix
+        self.leads_user_item_matrix = coo_matrix((np.ones(len(cells), dtype='int8'), (rows, cols)), shape=shape)
 
     def compress_leads_user_item_matrix(self):
-        """Compress the leads user-item matrix to a csr_matrix format and creates a user requested courses map"""
-        sparse_matrix = csr_matrix(self.leads_user_item_matrix, dtype='int8')
+        """Compress the leads user-item matrix to a csr_matrix format"""
+        self.leads_sparse_matrix = self.leads_user_item_matrix.tocsr()
 
-        for i in range(0, sparse_matrix.shape[0]):
-            self.user_requested_courses_map[self.leads_user_item_matrix.index[i]] = sparse_matrix[i]
+    def save_user_courses_matrix(self, root: str) -> str:
+        """Saves the compressed leads user-item matrix as a new version of the user courses artifact bundle
 
-    def save_user_courses_map(self, file_name: str):
-        with open(file_name, 'wb') as file:
-            pickle.dump(self.user_requested_courses_map, file)
+        Rows follow the (sorted) user ids and columns the (sorted) course ids, so readers can memory-map the arrays
+        and locate users and courses with a binary search.
+
+        :param root: Directory that contains the bundle versions
+        :return: The new version name
+        """
+        return save_user_courses_bundle(root,
+                                        self.leads_sparse_matrix,
+                                        np.array(self.leads_user_ids, dtype=str),
+                                        np.array(self.leads_course_ids, dtype=str))
 
     def requested_courses(self, user_id: str) -> np.ndarray:
         """Returns an array of courses ids to which the user has generated lead
@@ -160,52 +396,130 @@ class Model(DbService):
 
         return self.leads_df[self.leads_df['user_id'] == user_id]['course_id'].values
 
-    def course_course_recommendations(self, course_id: str, max_recs: int = 10) -> np.ndarray:
+    def course_course_recommendations(self, course_id: str, max_recs: int = DEFAULT_RECOMMENDATIONS,
+                                      measure: str = JACCARD) -> np.ndarray:
         """Returns an array of recommended courses based on leads generated in one course
 
         :param course_id: Course id for which we want to make the recommendations
         :param max_recs: Maximum number of recommendations
-        :return numpy.array: Array of courses recommended based on generated leads in one course
+        :param measure: Co-occurrence measure used to rank the recommendations. See `cooccurrence_top_k`
+        :return numpy.array: Array of courses recommended based on generated leads in one course, the ones that share
+            the most users with it first
         """
-        users = np.array(self.leads_user_item_matrix[self.leads_user_item_matrix.loc[:, course_id] == 1].index)
-        recs = np.array([])
+        column = self.leads_course_ids.get_loc(course_id)
+        user_items = self.leads_sparse_matrix
 
-        for user_id in users:
-            user_courses = self.requested_courses(user_id)
+        course_users = user_items[:, column].nonzero()[0]
+        counts = np.asarray(user_items[course_users].sum(axis=0)).ravel()
+        cols = np.flatnonzero(counts)
+        cols = cols[cols != column]
 
-            new_recs = user_courses[user_courses != course_id]
-            recs = np.unique(np.concatenate([new_recs, recs], axis=0))
+        item_counts = np.asarray(user_items.sum(axis=0)).ravel()
+        scores = score_counts(counts[cols], np.full(len(cols), column), cols, item_counts, measure)
+        order = np.lexsort((cols, -scores))[:max_recs]
 
-            if len(recs) > max_recs:
-                break
+        return np.array(self.leads_course_ids[cols[order]])
 
-        return recs[:max_recs]
+    def create_course_course_recommendations_df(self, top_k: int = DEFAULT_RECOMMENDATIONS, measure: str = JACCARD):
+        """Creates a course-course recommendations DataFrame with the courses that co-occur the most in the leads of
+        the users, scored with `measure`
 
-    def create_course_course_recommendations_df(self):
-        """Creates a course-course recommendations DataFrame"""
-        recommendations = []
-        for course in self.leads_user_item_matrix.columns:
-            recs = self.course_course_recommendations(course)
-            for rec in recs:
-                recommendations.append({'course': course, 'recommended': rec})
+        :param top_k: Maximum number of recommendations per course
+        :param measure: `count`, `jaccard` or `cosine`. See `cooccurrence_top_k`
+        """
+        blocks = list(cooccurrence_top_k(self.leads_sparse_matrix, top_k=top_k, measure=measure))
+        rows, cols, scores = (np.concatenate(arrays) for arrays in zip(*blocks)) if blocks else ([], [], [])
 
-        self.course_course_recs_df = pd.DataFrame(recommendations)
+        self.course_course_recs_df = pd.DataFrame({'course': np.asarray(self.leads_course_ids)[rows],
+                                                   'recommended': np.asarray(self.leads_course_ids)[cols],
+                                                   'score': np.asarray(scores, dtype=np.float64)},
+                                                  columns=['course', 'recommended', 'score'])
 
     def save_course_course_recommendations(self):
-        """Saves courses recommendations DataFrame to database"""
-        conn = self.connection()
+        """Saves courses recommendations DataFrame to database
 
-        sql_drop = 'DROP TABLE IF EXISTS `recommended_courses_by_leads`'
-        conn.execute(sql_drop)
+        The recommendations are written to a staging table, which then replaces the `recommended_courses_by_leads`
+        table. The web application keeps reading the previous recommendations meanwhile.
+        """
+        table = 'recommended_courses_by_leads'
+        staging_table = '{}_staging'.format(table)
+        old_table = '{}_old'.format(table)
+        connection = self.connection()
+
+        connection.execute('DROP TABLE IF EXISTS `{}`, `{}`'.format(staging_table, old_table))
 
-        sql_create = """CREATE TABLE `recommended_courses_by_leads` (
+        sql_create = """CREATE TABLE `{}` (
           `course` VARCHAR(9) NOT NULL,
           `recommended` VARCHAR(9) NOT NULL,
-          PRIMARY KEY (`course`, `recommended`)
+          `score` FLOAT NOT NULL,
+          PRIMARY KEY (`course`, `recommended`),
+          KEY `recommended_courses_by_leads_score_index` (`course`, `score`)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8
         """
-        conn.execute(sql_create)
+        connection.execute(sql_create.format(staging_table))
 
         # Save recommendations to database
-        self.course_course_recs_df.to_sql('recommended_courses_by_leads', con=conn,
-                                          if_exists='append', index=False)
+        self.course_course_recs_df.to_sql(staging_table, con=connection, if_exists='append', index=False,
+                                          method='multi', chunksize=self.INSERT_ROWS)
+
+        if connection.has_table(table):
+            connection.execute('RENAME TABLE `{0}` TO `{1}`, `{2}` TO `{0}`'.format(table, old_table, staging_table))
+            connection.execute('DROP TABLE `{}`'.format(old_table))
+        else:
+            connection.execute('RENAME TABLE `{}` TO `{}`'.format(staging_table, table))
+
+    def create_similar_reviewers_df(self, top_k: int = DEFAULT_NEIGHBOURS, min_reviews: int = MIN_REVIEWS,
+                                    min_common: int = 1):
+        """Creates a DataFrame with the nearest reviewers of every reviewer, by the euclidean distance between their
+        ratings of the courses both of them rated
+
+        :param top_k: Maximum number of neighbours per reviewer
+        :param min_reviews: Minimum number of courses a user must have rated to be compared with other users
+        :param min_common: Minimum number of courses rated by both users
+        """
+        self.retrieve_reviews()
+
+        ratings, user_ids, _ = ratings_matrix(self.reviews_df, min_reviews=min_reviews)
+        blocks = list(nearest_reviewers(ratings, top_k=top_k, min_common=min_common))
+        rows, cols, distances, common = (np.concatenate(arrays) for arrays in zip(*blocks)) if blocks else \
+            (np.array([], dtype=np.int64),) * 4
+
+        self.similar_reviewers_df = pd.DataFrame({'a_user_id': user_ids[rows],
+                                                  'another_user_id': user_ids[cols],
+                                                  'distance': np.asarray(distances, dtype=np.float64),
+                                                  'common_courses': common},
+                                                 columns=['a_user_id', 'another_user_id', 'distance',
+                                                          'common_courses'])
+
+    def save_similar_reviewers(self):
+        """Saves the nearest reviewers DataFrame to database
+
+        The nearest reviewers are written to a staging table, which then replaces the `similar_reviewers` table. The
+        web application keeps reading the previous nearest reviewers meanwhile.
+        """
+        table = 'similar_reviewers'
+        staging_table = '{}_staging'.format(table)
+        old_table = '{}_old'.format(table)
+        connection = self.connection()
+
+        connection.execute('DROP TABLE IF EXISTS `{}`, `{}`'.format(staging_table, old_table))
+
+        sql_create = """CREATE TABLE `{}` (
+          `a_user_id` CHAR(36) NOT NULL,
+          `another_user_id` CHAR(36) NOT NULL,
+          `distance` DOUBLE NOT NULL,
+          `common_courses` INT NOT NULL,
+          PRIMARY KEY (`a_user_id`, `another_user_id`),
+          KEY `similar_reviewers_distance_index` (`a_user_id`, `distance`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8
+        """
+        connection.execute(sql_create.format(staging_table))
+
+        self.similar_reviewers_df.to_sql(staging_table, con=connection, if_exists='append', index=False,
+                                         method='multi', chunksize=self.INSERT_ROWS)
+
+        if connection.has_table(table):
+            connection.execute('RENAME TABLE `{0}` TO `{1}`, `{2}` TO `{0}`'.format(table, old_table, staging_table))
+            connection.execute('DROP TABLE `{}`'.format(old_table))
+        else:
+            connection.execute('RENAME TABLE `{}` TO `{}`'.format(staging_table, table))
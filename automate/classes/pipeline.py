@@ -0,0 +1,148 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List
+
+# Stage events passed to the progress callback
+STAGE_STARTED = 'started'
+STAGE_SUCCEEDED = 'succeeded'
+STAGE_FAILED = 'failed'
+STAGE_SKIPPED = 'skipped'
+
+
+class PipelineError(Exception):
+    """Raised when one or more stages of a pipeline fail"""
+
+    def __init__(self, errors: Dict[str, Exception]):
+        """PipelineError constructor
+
+        :param errors: The exception raised by each failed stage, keyed by stage name
+        """
+        self.errors = errors
+
+        super().__init__('; '.join('{}: {}'.format(name, err) for name, err in errors.items()))
+
+
+class Stage:
+    def __init__(self, name: str, func: Callable[[], Any], requires: List[str] = None, description: str = None,
+                 summary: Callable[[Any], str] = None):
+        """Stage constructor
+
+        :param name: Stage name, unique within the pipeline
+        :param func: Function that runs the stage. It takes no arguments, its return value is the stage result
+        :param requires: Names of the stages that must succeed before this one starts
+        :param description: Text shown while the stage runs. If `None`, the stage name is shown
+        :param summary: Function that describes the stage result once the stage succeeds
+        """
+        self.name = name
+        self.func = func
+        self.requires = list(requires) if requires else []
+        self.description = description if description else name
+        self.summary = summary
+
+
+class Pipeline:
+    """Runs a set of stages with dependencies between them.
+
+    Every stage starts as soon as the stages it requires have succeeded, so independent stages run concurrently on a
+    thread pool. The stages mostly wait on the database or run NumPy and pandas code that releases the GIL, so threads
+    are enough to overlap them. The progress callback is always called from the thread that runs the pipeline, never
+    from the stage threads.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        """Pipeline constructor
+
+        :param max_workers: Maximum number of stages running at the same time
+        """
+        self.max_workers = max_workers
+        self.stages = {}
+
+    def add(self, name: str, func: Callable[[], Any], requires: List[str] = None, description: str = None,
+            summary: Callable[[Any], str] = None) -> 'Pipeline':
+        """Adds a stage to the pipeline. See `Stage` for the parameters
+
+        :return: The pipeline, so that calls can be chained
+        :raises: ValueError if there is already a stage with the same name
+        """
+        if name in self.stages:
+            raise ValueError('Duplicated stage {}'.format(name))
+
+        self.stages[name] = Stage(name, func, requires, description, summary)
+
+        return self
+
+    def validate(self):
+        """Checks that every required stage exists and that there are no dependency cycles
+
+        :raises: ValueError if the stages are not a directed acyclic graph
+        """
+        for stage in self.stages.values():
+            for required in stage.requires:
+                if required not in self.stages:
+                    raise ValueError('Stage {} requires the unknown stage {}'.format(stage.name, required))
+
+        visited = set()
+        pending = set(self.stages)
+
+        while pending:
+            ready = {name for name in pending if set(self.stages[name].requires) <= visited}
+
+            if not ready:
+                raise ValueError('Dependency cycle between the stages {}'.format(', '.join(sorted(pending))))
+
+            visited |= ready
+            pending -= ready
+
+    def run(self, progress: Callable[[str, Stage, Any], None] = None, keep_going: bool = False) -> Dict[str, Any]:
+        """Runs the stages, each one once all the stages it requires have succeeded
+
+        :param progress: Function called with the event (`STAGE_STARTED`, `STAGE_SUCCEEDED`, `STAGE_FAILED` or
+            `STAGE_SKIPPED`), the stage and its result, its exception or `None`
+        :param keep_going: Whether or not to keep starting stages after a stage fails. The stages that require a
+            failed stage are skipped anyway
+        :return: The result of each stage, keyed by stage name
+        :raises: PipelineError if any stage fails, once the running stages have finished
+        """
+        self.validate()
+
+        if progress is None:
+            def progress(event, stage, detail):
+                pass
+
+        results = {}
+        errors = {}
+        waiting = list(self.stages.values())
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                if not errors or keep_going:
+                    for stage in list(waiting):
+                        if len(running) < self.max_workers and \
+                                all(required in results for required in stage.requires):
+                            waiting.remove(stage)
+                            progress(STAGE_STARTED, stage, None)
+                            running[executor.submit(stage.func)] = stage
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    stage = running.pop(future)
+
+                    try:
+                        results[stage.name] = future.result()
+                    except Exception as err:
+                        errors[stage.name] = err
+                        progress(STAGE_FAILED, stage, err)
+                    else:
+                        progress(STAGE_SUCCEEDED, stage, results[stage.name])
+
+        for stage in waiting:
+            progress(STAGE_SKIPPED, stage, None)
+
+        if errors:
+            raise PipelineError(errors)
+
+        return results
@@ -0,0 +1,255 @@
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Union
+
+import pandas as pd
+
+
+def peak_memory() -> float:
+    """Returns the peak resident memory of the process so far
+
+    :return: Peak resident memory in megabytes
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS reports bytes
+    return max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def cpu_time() -> float:
+    """Returns the CPU time used by the process and its finished child processes, such as the text processing jobs
+
+    :return: User plus system time in seconds
+    """
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return usage_self.ru_utime + usage_self.ru_stime + usage_children.ru_utime + usage_children.ru_stime
+
+
+def count_rows(value) -> Union[int, None]:
+    """Counts the rows of a stage result
+
+    :param value: A DataFrame, a list or tuple of DataFrames, or anything else
+    :return: The number of rows, or `None` if the value has no rows
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.shape[0])
+
+    if isinstance(value, (list, tuple)) and len(value) > 0 and all(isinstance(df, pd.DataFrame) for df in value):
+        return int(sum(df.shape[0] for df in value))
+
+    return None
+
+
+class StageProfile:
+    def __init__(self, name: str, rows_in: int = None):
+        """StageProfile constructor
+
+        :param name: Stage name
+        :param rows_in: Number of rows the stage reads
+        """
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_mb = 0.0
+        self.rss_growth_mb = 0.0
+        self.failed = False
+        self.profile_file = None
+
+    @property
+    def rows_per_second(self) -> Union[float, None]:
+        """Returns the stage throughput: rows read per second, or rows written if the number of rows read is unknown
+
+        :return: Rows per second, or `None` if the stage has no rows
+        """
+        rows = self.rows_in if self.rows_in is not None else self.rows_out
+
+        if rows is None or self.wall_seconds == 0:
+            return None
+
+        return rows / self.wall_seconds
+
+    def to_dict(self) -> Dict:
+        """Returns the profile as a JSON serializable dictionary
+
+        :return: A dictionary
+        """
+        return {'stage': self.name,
+                'wall_seconds': round(self.wall_seconds, 4),
+                'cpu_seconds': round(self.cpu_seconds, 4),
+                'peak_rss_mb': round(self.peak_rss_mb, 1),
+                'rss_growth_mb': round(self.rss_growth_mb, 1),
+                'rows_in': self.rows_in,
+                'rows_out': self.rows_out,
+                'rows_per_second': round(self.rows_per_second, 1) if self.rows_per_second is not None else None,
+                'failed': self.failed,
+                'profile_file': self.profile_file}
+
+
+class Profiler:
+    """Records the wall time, CPU time, peak memory and rows of every stage of a run.
+
+    The CPU time and the peak memory are measured for the whole process, so the numbers of stages that run at the
+    same time include each other. Run with a single worker to measure them separately. The stages listed in
+    `profile_stages` also run under `cProfile`, whose statistics are saved next to the report.
+
+    A disabled profiler measures nothing, so the scripts can wrap their stages unconditionally.
+    """
+
+    def __init__(self, enabled: bool = True, profile_stages: List[str] = None, directory: str = None):
+        """Profiler constructor
+
+        :param enabled: Whether or not to record the stages
+        :param profile_stages: Names of the stages to run under `cProfile`
+        :param directory: Directory where the `cProfile` statistics are saved
+        """
+        self.enabled = enabled
+        self.profile_stages = set(profile_stages) if profile_stages else set()
+        self.directory = directory
+        self.started_on = datetime.datetime.utcnow()
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, rows_in: int = None):
+        """Measures the block as a stage. The block can set the `rows_out` attribute of the yielded profile
+
+        :param name: Stage name
+        :param rows_in: Number of rows the stage reads
+        :return: The stage profile
+        """
+        profile = StageProfile(name, rows_in)
+
+        if not self.enabled:
+            yield profile
+            return
+
+        profiler = cProfile.Profile() if name in self.profile_stages else None
+        rss_before = peak_memory()
+        cpu_before = cpu_time()
+        wall_before = time.perf_counter()
+
+        if profiler:
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12+ allows a single active profiler, another stage running at the same time has it
+                profiler = None
+
+        try:
+            yield profile
+        except BaseException:
+            profile.failed = True
+            raise
+        finally:
+            if profiler:
+                profiler.disable()
+
+            profile.wall_seconds = time.perf_counter() - wall_before
+            profile.cpu_seconds = cpu_time() - cpu_before
+            profile.peak_rss_mb = peak_memory()
+            profile.rss_growth_mb = profile.peak_rss_mb - rss_before
+
+            if profiler:
+                profile.profile_file = self.__save_stats__(name, profiler)
+
+            with self.lock:
+                self.profiles.append(profile)
+
+    def wrap(self, name: str, func: Callable[[], Any], rows_in: Union[int, Callable[[], int]] = None,
+             rows_out: Callable[[Any], int] = count_rows) -> Callable[[], Any]:
+        """Returns a function that runs `func` as a stage, so that it can be passed to a `Pipeline`
+
+        :param name: Stage name
+        :param func: Function that runs the stage
+        :param rows_in: Number of rows the stage reads, or a function that counts them right before the stage runs
+        :param rows_out: Function that counts the rows of the stage result
+        :return: The wrapped function
+        """
+        def run():
+            with self.stage(name, rows_in() if callable(rows_in) else rows_in) as profile:
+                result = func()
+                profile.rows_out = rows_out(result) if rows_out else None
+
+            return result
+
+        return run
+
+    def report(self) -> Dict:
+        """Returns the report of the run
+
+        :return: A JSON serializable dictionary
+        """
+        with self.lock:
+            profiles = list(self.profiles)
+
+        return {'started_on': self.started_on.isoformat() + 'Z',
+                'wall_seconds': round((datetime.datetime.utcnow() - self.started_on).total_seconds(), 4),
+                'peak_rss_mb': round(peak_memory(), 1),
+                'stages': [profile.to_dict() for profile in profiles]}
+
+    def save(self, file_name: str, metadata: Dict = None):
+        """Saves the report as a JSON file
+
+        :param file_name: Report file path
+        :param metadata: Additional JSON serializable data, such as the options of the run
+        """
+        report = self.report()
+        report['metadata'] = metadata if metadata else {}
+
+        directory = os.path.dirname(file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(file_name, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    def table(self) -> List[List[str]]:
+        """Returns the report as table rows, one per stage, preceded by a header row
+
+        :return: A list of rows
+        """
+        rows = [['Stage', 'Wall (s)', 'CPU (s)', 'Peak RSS (MB)', 'Rows in', 'Rows out', 'Rows/s']]
+
+        def number(value, decimals=0):
+            return '-' if value is None else '{:,.{}f}'.format(value, decimals)
+
+        for stage in self.report()['stages']:
+            rows.append(['{}{}'.format(stage['stage'], ' (failed)' if stage['failed'] else ''),
+                         number(stage['wall_seconds'], 2),
+                         number(stage['cpu_seconds'], 2),
+                         number(stage['peak_rss_mb'], 1),
+                         number(stage['rows_in']),
+                         number(stage['rows_out']),
+                         number(stage['rows_per_second'])])
+
+        return rows
+
+    def __save_stats__(self, name: str, profiler: cProfile.Profile) -> str:
+        """Saves the `cProfile` statistics of a stage, plus a text summary sorted by cumulative time
+
+        :param name: Stage name
+        :param profiler: Profiler that ran the stage
+        :return: The statistics file path
+        """
+        directory = self.directory if self.directory else '.'
+        os.makedirs(directory, exist_ok=True)
+
+        file_name = os.path.join(directory, '{}-{}.prof'.format(self.started_on.strftime('%Y%m%dT%H%M%S'), name))
+        profiler.dump_stats(file_name)
+
+        with open('{}.txt'.format(os.path.splitext(file_name)[0]), 'w') as file:
+            pstats.Stats(file_name, stream=file).sort_stats('cumulative').print_stats(40)
+
+        return file_name
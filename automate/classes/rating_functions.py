@@ -59,3 +59,50 @@ def weighted_rating(row, C: float, m: int) -> float:
     wr = (v * R / (v + m)) + (m * C / (v + m))
 
     return wr
+
+
+def average_ratings(course_ids: pd.Series, df: pd.DataFrame) -> pd.Series:
+    """Computes the average rating of each course in a single pass. Vectorized version of `average_rating`
+
+    :param course_ids: Course ids
+    :param df: Reviews DataFrame
+    :return: The average rating of each course, aligned with `course_ids`, or np.nan if the course has no rating
+    """
+    return course_ids.map(df.groupby('course_id')['rating'].mean())
+
+
+def reviews_counts(course_ids: pd.Series, df: pd.DataFrame) -> pd.Series:
+    """Counts the number of reviews of each course in a single pass. Vectorized version of `num_reviews`
+
+    :param course_ids: Course ids
+    :param df: Reviews DataFrame
+    :return: The number of reviews of each course, aligned with `course_ids`
+    """
+    return course_ids.map(df.groupby('course_id').size()).fillna(0).astype(int)
+
+
+def leads_counts(course_ids: pd.Series, df: pd.DataFrame) -> pd.Series:
+    """Counts the number of leads generated by each course in a single pass
+
+    :param course_ids: Course ids
+    :param df: Leads DataFrame
+    :return: The number of leads of each course, aligned with `course_ids`
+    """
+    return course_ids.map(df.groupby('course_id')['user_id'].count()).fillna(0).astype(int)
+
+
+def weighted_ratings(df: pd.DataFrame, C: float, m: int) -> pd.Series:
+    """Computes the weighted rating of every course. Vectorized version of `weighted_rating`
+
+    :param df: Courses DataFrame, with `num_reviews` and `avg_rating` columns
+    :param C: The average rating of all the courses in the dataset
+    :param m: The minimum number of reviews required for the course to be listed
+
+    :return: The weighted rating of each course
+    """
+    v = df['num_reviews']
+    R = df['avg_rating']
+
+    wr = (v * R / (v + m)) + (m * C / (v + m))
+
+    return wr.where(~((v == 0) & R.isnull()), np.nan)
@@ -0,0 +1,96 @@
+from typing import Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix, csr_matrix
+
+from .content import BLOCK_CELLS, select_top_k
+
+# Minimum number of courses a user must have rated to be compared with other users
+MIN_REVIEWS = 2
+# Maximum number of neighbours kept per reviewer
+DEFAULT_NEIGHBOURS = 20
+
+
+def ratings_matrix(reviews_df: pd.DataFrame,
+                   min_reviews: int = MIN_REVIEWS) -> Tuple[csr_matrix, np.ndarray, np.ndarray]:
+    """Builds the sparse ratings user-item matrix of the users who rated at least `min_reviews` courses
+
+    The user and course ids are factorized in sorted order. If a user rated a course more than once, the highest
+    rating is kept.
+
+    :param reviews_df: Reviews DataFrame, with the `user_id`, `course_id` and `rating` columns
+    :param min_reviews: Minimum number of rated courses of a user
+    :return: A tuple with the users x courses ratings matrix, the user ids and the course ids
+    """
+    ratings = reviews_df[['user_id', 'course_id', 'rating']].dropna()
+    ratings = ratings.groupby(['user_id', 'course_id'], as_index=False)['rating'].max()
+
+    reviews_per_user = ratings.groupby('user_id')['course_id'].transform('size')
+    ratings = ratings[reviews_per_user >= min_reviews]
+
+    user_codes, user_ids = pd.factorize(ratings['user_id'], sort=True)
+    course_codes, course_ids = pd.factorize(ratings['course_id'], sort=True)
+
+    matrix = coo_matrix((ratings['rating'].values.astype(np.float32), (user_codes, course_codes)),
+                        shape=(len(user_ids), len(course_ids))).tocsr()
+
+    return matrix, np.asarray(user_ids, dtype=str), np.asarray(course_ids, dtype=str)
+
+
+def nearest_reviewers(ratings: csr_matrix, top_k: int = DEFAULT_NEIGHBOURS, min_common: int = 1,
+                      block_size: int = None) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """Computes the nearest users to every user by the euclidean distance between their ratings of the courses both
+    of them rated, block of users by block of users
+
+    With R the ratings matrix and B its binary pattern, the squared distances over the co-rated courses are
+    (R∘R)·Bᵀ + B·(R∘R)ᵀ - 2·R·Rᵀ, restricted to the pairs of users that rated a course in common (B·Bᵀ > 0).
+    Every block of users is pruned to its `top_k` nearest users right away, so the users x users matrix is never built.
+
+    :param ratings: Users x courses ratings matrix, as built by `ratings_matrix`
+    :param top_k: Maximum number of neighbours per user
+    :param min_common: Minimum number of courses rated by both users
+    :param block_size: Number of users compared at once. If `None`, it is chosen so that a block has at most
+        `BLOCK_CELLS` cells
+    :return: An iterator of (users, neighbours, distances, co-rated courses) tuples, one per block, in user order.
+        The neighbours of a user are sorted by increasing distance
+    """
+    ratings = csr_matrix(ratings, dtype=np.float64)
+    squares = ratings.multiply(ratings).tocsr()
+    pattern = ratings.copy()
+    pattern.data = np.ones_like(pattern.data)
+
+    ratings_t = ratings.T.tocsr()
+    squares_t = squares.T.tocsr()
+    pattern_t = pattern.T.tocsr()
+    m = ratings.shape[0]
+
+    if block_size is None:
+        block_size = max(1, BLOCK_CELLS // max(m, 1))
+
+    for start in range(0, m, block_size):
+        end = min(start + block_size, m)
+
+        common = pattern[start:end].dot(pattern_t).tocoo()
+        keep = (common.row + start != common.col) & (common.data >= min_common)
+        rows, cols, counts = common.row[keep], common.col[keep], common.data[keep]
+
+        squared = (squares[start:end].dot(pattern_t) + pattern[start:end].dot(squares_t) -
+                   2 * ratings[start:end].dot(ratings_t)).tocsr()
+        # Pairs with the same ratings have a zero squared distance, which the sum may drop, so the distances are read
+        # at the co-rated pairs
+        distances = np.sqrt(np.maximum(np.asarray(squared[rows, cols]).ravel(), 0))
+
+        rows = rows.astype(np.int64) + start
+        cols = cols.astype(np.int64)
+
+        # The nearest users have the highest negated distance. Among users at the same distance, the ones with more
+        # co-rated courses come first, then by user order
+        tie_order = np.lexsort((cols, -counts, rows))
+        ties = np.empty(len(rows), dtype=np.int64)
+        ties[tie_order] = np.arange(len(rows))
+
+        rows, ties, scores = select_top_k(rows, ties, -distances, top_k, -np.inf)
+        order = tie_order[ties]
+
+        yield rows, cols[order], -scores, counts[order].astype(np.int64)
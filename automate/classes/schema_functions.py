@@ -0,0 +1,80 @@
+import os
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype, union_categoricals
+
+SCHEMAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'schemas')
+
+
+def read_schema(file_name: str) -> Dict[str, str]:
+    """Reads the pandas dtypes of a source table from its schema file
+
+    :param file_name: Schema file name, in the `schemas` directory
+    :return: The dtype of each column, in the order of the schema
+    """
+    schema_df = pd.read_csv(os.path.join(SCHEMAS_DIR, file_name), dtype=str)
+
+    return dict(zip(schema_df['column_name'], schema_df['dtype']))
+
+
+def apply_dtypes(df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """Casts the columns of `df` to the compact dtypes of a schema
+
+    Integer columns with null values are cast to `float32` instead, since integer dtypes cannot hold nulls.
+
+    :param df: A pandas DataFrame
+    :param dtypes: The dtype of each column. Columns not in `df` are ignored
+    :return: The DataFrame with the new dtypes
+    """
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+
+        if dtype.startswith('datetime'):
+            df[column] = pd.to_datetime(df[column])
+        elif dtype != 'category' and is_integer_dtype(np.dtype(dtype)):
+            df[column] = df[column].astype('float32' if df[column].isnull().any() else dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+
+    return df
+
+
+def concat_chunks(chunks: List[pd.DataFrame], dtypes: Dict[str, str]) -> pd.DataFrame:
+    """Concatenates DataFrame chunks with the same columns, keeping the categorical columns as categorical
+
+    `pandas.concat` turns categorical columns with different categories into object columns, so the categorical
+    columns are joined with `union_categoricals`.
+
+    :param chunks: DataFrame chunks, already cast with `apply_dtypes`
+    :param dtypes: The dtype of each column. Used to build an empty DataFrame if there are no chunks
+    :return: A single DataFrame
+    """
+    if len(chunks) == 0:
+        return apply_dtypes(pd.DataFrame(columns=list(dtypes)), dtypes)
+
+    columns = {}
+    for column in chunks[0].columns:
+        if chunks[0][column].dtype.name == 'category':
+            columns[column] = pd.Series(union_categoricals([chunk[column] for chunk in chunks]))
+        else:
+            columns[column] = pd.Series(np.concatenate([chunk[column].values for chunk in chunks]),
+                                        dtype=chunks[0][column].dtype)
+
+    return pd.DataFrame(columns, columns=chunks[0].columns)
+
+
+def decategorize(df: pd.DataFrame) -> pd.DataFrame:
+    """Turns the categorical columns of `df` into columns of their categories dtype
+
+    :param df: A pandas DataFrame
+    :return: A DataFrame without categorical columns
+    """
+    categorical_columns = [column for column in df.columns if df[column].dtype.name == 'category']
+
+    if len(categorical_columns) == 0:
+        return df
+
+    return df.assign(**{column: np.asarray(df[column]) for column in categorical_columns})
@@ -0,0 +1,108 @@
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Sequence
+
+import pandas as pd
+from txtools.normalizer import TextNormalizer, clean_text
+from txtools.utils import LangDetector
+
+from .cache import HashCache
+
+
+def content_hash(text: str) -> str:
+    """Computes a hash of a text, used to know if the text has changed
+
+    :param text: A text. Null values are hashed as an empty text
+    :return: Hexadecimal digest
+    """
+    if pd.isnull(text):
+        text = ''
+
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+def detect_languages(texts: Sequence[str]) -> List[str]:
+    """Detects the language of a batch of texts
+
+    :param texts: Texts of which we want to know the language
+    :return: Languages ISO 639-1 codes
+    """
+    lang_detector = LangDetector()
+    languages = []
+
+    for text in texts:
+        if pd.isnull(text):
+            languages.append(LangDetector.DEFAULT_LANGUAGE)
+            continue
+
+        try:
+            languages.append(lang_detector.iso_639_1_code(text))
+        except ValueError:
+            languages.append(LangDetector.DEFAULT_LANGUAGE)
+
+    return languages
+
+
+def clean_texts(texts: Sequence[str]) -> List[str]:
+    """Cleans a batch of texts, keeping new lines
+
+    :param texts: Texts to be cleaned
+    :return: Clean texts
+    """
+    return [clean_text(text, exclude=['new_line']) for text in texts]
+
+
+def normalize_texts(texts: Sequence[str]) -> List[str]:
+    """Normalizes a batch of texts, as the content similarity model expects them
+
+    :param texts: Texts to be normalized
+    :return: Normalized texts
+    """
+    return TextNormalizer().transform(texts)
+
+
+def map_in_chunks(func: Callable[[Sequence], List], items: Sequence, n_jobs: int = 1,
+                  chunk_size: int = 500) -> List:
+    """Applies a batch function to chunks of items, in parallel if `n_jobs` is greater than 1
+
+    :param func: Function that receives a chunk of items and returns a list with a result per item. It must be
+        defined at module level so it can be sent to the worker processes
+    :param items: Items to process
+    :param n_jobs: Number of worker processes
+    :param chunk_size: Number of items sent to a worker at once
+    :return: The results, in the same order as `items`
+    """
+    chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+
+    if n_jobs <= 1 or len(chunks) <= 1:
+        return [result for chunk in chunks for result in func(chunk)]
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return [result for chunk_results in executor.map(func, chunks) for result in chunk_results]
+
+
+def cached_map(texts: pd.Series, func: Callable[[Sequence], List], cache: HashCache, column: str,
+               n_jobs: int = 1) -> pd.Series:
+    """Applies a batch function to texts, computing only the distinct texts that are not in the cache
+
+    :param texts: Texts to process. Null values are kept as they are
+    :param func: Function that receives a chunk of texts and returns a list with a result per text
+    :param cache: Cache keyed by the texts content hash. It is updated with the computed results
+    :param column: Cached value name
+    :param n_jobs: Number of worker processes
+    :return: The results, aligned with `texts`
+    """
+    not_null = texts.notnull()
+    hashes = texts[not_null].map(content_hash)
+    missing = cache.missing(hashes)
+
+    if missing.shape[0] > 0:
+        distinct_texts = texts[not_null].groupby(hashes).first().loc[missing.values].values
+        results = map_in_chunks(func, distinct_texts, n_jobs=n_jobs)
+
+        cache.update(pd.DataFrame({column: results}, index=missing.values))
+
+    results = pd.Series(texts.values, index=texts.index, dtype=object)
+    results[not_null] = cache.get(hashes, column)
+
+    return results
@@ -3,17 +3,29 @@ from typing import List, Union
 import numpy as np
 import pandas as pd
 
-from .rating_functions import all_avg_rating, average_rating, weighted_rating, num_reviews
-from txtools.normalizer import clean_text
+from .rating_functions import all_avg_rating, average_ratings, weighted_ratings, reviews_counts, leads_counts
+from .cache import HashCache
+from .schema_functions import decategorize
+from .text_functions import cached_map, clean_texts, detect_languages, normalize_texts
 from txtools.utils import LangDetector
 
 
 class Transform:
-    def __init__(self, leads_df: pd.DataFrame, reviews_df: pd.DataFrame):
+    def __init__(self, leads_df: pd.DataFrame, reviews_df: pd.DataFrame, source_courses_df: pd.DataFrame = None):
+        """Transform constructor
+
+        :param leads_df: Leads DataFrame
+        :param reviews_df: Reviews DataFrame
+        :param source_courses_df: Course data extracted once per course. If supplied, the leads and reviews only need
+            the event columns and the courses DataFrame is built from it
+        """
         self.leads_df = leads_df
         self.reviews_df = reviews_df
+        self.source_courses_df = source_courses_df
         self.courses_df = None
         self.categories_df = None
+        self.ranked_courses_df = None
+        self.categories_dictionary_df = None
 
     def remove_duplicated_leads(self, subset: Union[List[str], str] = None) -> int:
         """Removes duplicated rows from leads DataFrame
@@ -82,6 +94,19 @@ class Transform:
 
         return num_nulls
 
+    def replace_source_courses_null_values(self, column: str, replacement: Union[str, int, float]) -> int:
+        """Fills null values in `column` with `replacement` in the source courses DataFrame
+
+        :param column: Column name/s to search for null values
+        :param replacement: Value to use to replace nulls
+        :return: The number of values that has been replaced
+        """
+        num_nulls = self.source_courses_df[column].isnull().sum()
+
+        self.source_courses_df = Transform.__replace_nulls__(self.source_courses_df, column, replacement)
+
+        return num_nulls
+
     @staticmethod
     def __replace_nulls__(df: pd.DataFrame, column: str, replacement: Union[str, int, float]) -> pd.DataFrame:
         """Fills null values in `column` with `replacement`
@@ -107,24 +132,56 @@ class Transform:
         Transform.__guard_against_non_existent_columns__(self.leads_df, subset)
         Transform.__guard_against_non_existent_columns__(self.reviews_df, subset)
 
-        self.leads_df[subset] = self.leads_df[subset].astype(new_type)
-        self.reviews_df[subset] = self.reviews_df[subset].astype(new_type)
+        if isinstance(subset, str):
+            subset = [subset]
 
-    def create_courses_df(self, with_text_cleaning: bool = True) -> pd.DataFrame:
-        """Creates a new DataFrame with courses information from leads and reviews DataFrames
+        for column in subset:
+            self.leads_df[column] = Transform.__change_type__(self.leads_df[column], new_type)
+            self.reviews_df[column] = Transform.__change_type__(self.reviews_df[column], new_type)
+
+            if self.source_courses_df is not None and column in self.source_courses_df.columns:
+                self.source_courses_df[column] = Transform.__change_type__(self.source_courses_df[column], new_type)
+
+    @staticmethod
+    def __change_type__(series: pd.Series, new_type: type) -> pd.Series:
+        """Changes the data type of `series`. Categorical series keep their codes and only change their categories
+
+        :param series: A pandas Series
+        :param new_type: The new data type to be applied
+        :return: The Series with the new data type
+        """
+        if series.dtype.name == 'category':
+            return series.cat.rename_categories(series.cat.categories.astype(new_type))
+
+        return series.astype(new_type)
+
+    def create_courses_df(self, with_text_cleaning: bool = True, n_jobs: int = 1,
+                          cache: HashCache = None) -> pd.DataFrame:
+        """Creates a new DataFrame with courses information from leads and reviews DataFrames, or from the source
+        courses DataFrame if it has been supplied. Only the courses with leads or reviews are kept
 
         :param with_text_cleaning: Whether or not to clean the text columns
+        :param n_jobs: Number of processes used to clean the texts
+        :param cache: Clean texts cache keyed by the raw text content hash, with a `clean` column. Only the texts
+            that are not in it are cleaned
         :return: The courses DataFrame `courses_df`
         """
         keep_columns = ['course_id', 'course_title', 'course_description', 'course_category', 'center']
 
-        courses_from_leads = self.leads_df[keep_columns].drop_duplicates('course_id')
-        courses_from_reviews = self.reviews_df[keep_columns].drop_duplicates('course_id')
+        if self.source_courses_df is not None:
+            course_ids = np.union1d(self.leads_df['course_id'].astype(str), self.reviews_df['course_id'].astype(str))
+            source_courses = self.source_courses_df[self.source_courses_df['course_id'].astype(str).isin(course_ids)]
 
-        self.courses_df = pd.merge(courses_from_leads, courses_from_reviews,
-                                   left_on=keep_columns,
-                                   right_on=keep_columns,
-                                   how='outer')
+            self.courses_df = decategorize(source_courses[keep_columns]).reset_index(drop=True)
+        else:
+            # There is a row per course, so the courses DataFrame does not need categorical columns
+            courses_from_leads = decategorize(self.leads_df[keep_columns].drop_duplicates('course_id'))
+            courses_from_reviews = decategorize(self.reviews_df[keep_columns].drop_duplicates('course_id'))
+
+            self.courses_df = pd.merge(courses_from_leads, courses_from_reviews,
+                                       left_on=keep_columns,
+                                       right_on=keep_columns,
+                                       how='outer')
         # Rename columns
         self.courses_df.rename(columns={'course_id': 'id', 'course_title': 'title',
                                         'course_description': 'description', 'course_category': 'category'},
@@ -137,45 +194,53 @@ class Transform:
         if not with_text_cleaning:
             return self.courses_df
 
-        def clean_text_column(text):
-            if pd.isnull(text):
-                return text
+        if cache is None:
+            cache = HashCache(['clean'])
 
-            return clean_text(text, exclude=['new_line'])
-
-        self.courses_df['title'] = self.courses_df['title'].apply(clean_text_column)
-        self.courses_df['description'] = self.courses_df['description'].apply(clean_text_column)
-        self.courses_df['center'] = self.courses_df['center'].apply(clean_text_column)
+        for column in ['title', 'description', 'center']:
+            self.courses_df[column] = cached_map(self.courses_df[column], clean_texts, cache, 'clean', n_jobs=n_jobs)
 
         return self.courses_df
 
-    def detect_courses_language(self) -> pd.DataFrame:
+    def detect_courses_language(self, n_jobs: int = 1, cache: HashCache = None) -> pd.DataFrame:
         """Add a language column in courses DataFrame based on description
 
+        Each distinct description is detected once. If a cache is supplied, only the descriptions that are not in it
+        are detected and the cache is updated with them.
+
+        :param n_jobs: Number of processes used to detect the languages
+        :param cache: Languages cache keyed by the description content hash, with a `lang` column
         :return: The courses DataFrame `courses_df` with a new lang column
         """
         if 'lang' in self.courses_df.columns:
             return self.courses_df
 
-        lang_detector = LangDetector()
+        if cache is None:
+            cache = HashCache(['lang'])
+
+        languages = cached_map(self.courses_df['description'], detect_languages, cache, 'lang', n_jobs=n_jobs)
 
-        def get_lang(text):
-            """Detects the language of a text
+        self.courses_df['lang'] = languages.fillna(LangDetector.DEFAULT_LANGUAGE)
 
-            :param text: Text of which we want to know the language
-            :return str: Language ISO 639-1 code
-            """
-            if pd.isnull(text):
-                return LangDetector.DEFAULT_LANGUAGE
+        return self.courses_df
 
-            try:
-                return lang_detector.iso_639_1_code(text)
-            except ValueError:
-                return LangDetector.DEFAULT_LANGUAGE
+    def normalize_courses_content(self, n_jobs: int = 1, cache: HashCache = None) -> pd.Series:
+        """Normalizes the content (title and description) of the courses, as the content similarity model does
 
-        self.courses_df['lang'] = self.courses_df['description'].apply(get_lang)
+        The modeling pipeline builds the same content from the saved courses, so it finds the normalized content in
+        the cache instead of normalizing it again.
 
-        return self.courses_df
+        :param n_jobs: Number of processes used to normalize the texts
+        :param cache: Normalized texts cache keyed by the content hash, with a `normalized` column. It is updated
+            with the normalized contents
+        :return: The normalized content of each course
+        """
+        if cache is None:
+            cache = HashCache(['normalized'])
+
+        course_content = self.courses_df['title'].str.cat(self.courses_df['description'], sep='. ')
+
+        return cached_map(course_content, normalize_texts, cache, 'normalized', n_jobs=n_jobs)
 
     def remove_not_in_english_courses(self):
         """Removes courses that are not in English
@@ -199,72 +264,118 @@ class Transform:
 
         return self.courses_df
 
-    def add_data_to_courses(self, m: int) -> pd.DataFrame:
+    def add_data_to_courses(self, m: int, other_courses_df: pd.DataFrame = None) -> pd.DataFrame:
         """Add additional data from leads and reviews to the courses DataFrame
 
         :param m: The minimum number of reviews required for the course to be listed
+        :param other_courses_df: Courses that are not in the courses DataFrame, with an `avg_rating` column. They are
+            taken into account to compute the average rating of all courses, when only some courses are updated
         :return: The courses DataFrame `courses_df`
         """
         # Add the rating average of each course
-        self.courses_df['avg_rating'] = self.courses_df['id'].apply(average_rating, args=(self.reviews_df,))
+        self.courses_df['avg_rating'] = average_ratings(self.courses_df['id'], self.reviews_df)
 
         # Add the number of reviews received for each course
-        self.courses_df['num_reviews'] = self.courses_df['id'].apply(num_reviews, args=(self.reviews_df,)).astype(int)
+        self.courses_df['num_reviews'] = reviews_counts(self.courses_df['id'], self.reviews_df)
 
         # Add the weighted rating
-        overall_avg_rating = all_avg_rating(self.courses_df)
+        if other_courses_df is None:
+            overall_avg_rating = all_avg_rating(self.courses_df)
+        else:
+            overall_avg_rating = all_avg_rating(pd.concat([self.courses_df[['avg_rating']],
+                                                           other_courses_df[['avg_rating']]]))
 
-        self.courses_df['weighted_rating'] = self.courses_df.apply(weighted_rating, axis=1,
-                                                                   args=(overall_avg_rating, m,))
+        self.courses_df['weighted_rating'] = weighted_ratings(self.courses_df, overall_avg_rating, m)
 
         # Add number of leads
-        lead_counts = self.leads_df.groupby('course_id').count()['user_id']
-
-        def number_of_leads(course_id: str) -> int:
-            """Counts the number of leads generated by a course
-
-            :param course_id: Course id
-            :return int: The number of leads generated by a course
-            """
-            try:
-                return lead_counts.loc[course_id]
-            except KeyError:
-                return 0
-
-        self.courses_df['number_of_leads'] = self.courses_df['id'].apply(number_of_leads).astype(int)
+        self.courses_df['number_of_leads'] = leads_counts(self.courses_df['id'], self.leads_df)
 
         return self.courses_df
 
-    def create_categories_df(self) -> pd.DataFrame:
+    def create_categories_df(self, categories_dictionary_df: pd.DataFrame = None) -> pd.DataFrame:
         """Creates a new DataFrame of courses' categories
 
+        Category ids are taken from `categories_dictionary_df`, a DataFrame with `id` and `name` columns persisted
+        from previous runs, so that a category keeps its id across runs. New categories get consecutive ids after the
+        highest known id, in order of appearance. The updated dictionary is kept in `categories_dictionary_df`.
+
+        :param categories_dictionary_df: Known categories. If `None`, ids will start at 1
         :return: The categories DataFrame `categories_df`
+        :raises: ValueError if any course has no category
         """
-        # DataFrame creation
-        categories = self.courses_df['category'].unique()
-        self.categories_df = pd.DataFrame(categories, columns=['name']).reset_index()
+        codes, names = pd.factorize(self.courses_df['category'])
 
-        self.categories_df.rename(columns={'index': 'id'}, inplace=True)
+        if (codes == -1).any():
+            raise ValueError('There are {} courses without category'.format((codes == -1).sum()))
+
+        if categories_dictionary_df is None:
+            categories_dictionary_df = pd.DataFrame({'id': [], 'name': []})
+
+        known_ids = pd.Series(categories_dictionary_df['id'].values, index=categories_dictionary_df['name'].values)
 
         # To avoid category ids with 0 value
-        self.categories_df['id'] = self.categories_df['id'].apply(lambda x: x + 1)
+        next_id = int(known_ids.max()) + 1 if known_ids.shape[0] > 0 else 1
 
-        # Add category id to courses DataFrame
-        def category_id(category_name: str) -> int:
-            """Searches for a category by name in the category data frame and returns its identifier
+        new_names = names[~names.isin(known_ids.index)]
+        new_ids = pd.Series(np.arange(next_id, next_id + len(new_names)), index=new_names)
 
-            :param category_name: Category name
-            :return: The category id
-            """
-            return self.categories_df[self.categories_df['name'] == category_name]['id'].values[0]
+        category_ids = pd.concat([known_ids, new_ids]).astype(int)
 
-        self.courses_df['category_id'] = self.courses_df['category'].apply(category_id)
+        self.categories_dictionary_df = pd.DataFrame({'id': category_ids.values, 'name': category_ids.index})
+        self.categories_df = pd.DataFrame({'id': category_ids.reindex(names).values, 'name': names})
+
+        # Add category id to courses DataFrame
+        self.courses_df['category_id'] = self.categories_df['id'].values[codes]
 
         # Removes category name and keeps only the category id
         self.courses_df.drop('category', inplace=True, axis=1)
 
         return self.categories_df
 
+    def create_ranked_courses_df(self, max_rank: int = 10, spares: int = 5, min_number_of_leads: int = 1,
+                                 min_weighted_rating: float = 7.0) -> pd.DataFrame:
+        """Creates a new DataFrame with the top courses by number of leads and by rating, globally and per category
+
+        The lists keep `spares` courses more than `max_rank`, so that a list still has `max_rank` courses when the
+        web application excludes some of them. The courses are filtered and sorted as the web rank based
+        recommendations do.
+
+        :param max_rank: Number of courses of each list
+        :param spares: Number of extra courses of each list
+        :param min_number_of_leads: Minimum number of leads to be listed
+        :param min_weighted_rating: Minimum weighted rating to be listed
+        :return: The ranked courses DataFrame `ranked_courses_df`, with following columns:
+            ranking str: leads or rating
+            category_id int: category identifier, 0 for the lists of all categories
+            position int: position of the course in the list, starting at 1
+            course_id str: course identifier
+        """
+        courses = self.courses_df[(self.courses_df['number_of_leads'] >= min_number_of_leads) &
+                                  (self.courses_df['weighted_rating'] >= min_weighted_rating)]
+
+        courses = courses[['id', 'category_id', 'number_of_leads', 'num_reviews', 'weighted_rating']]
+
+        sort_columns = {'leads': ['number_of_leads', 'weighted_rating', 'num_reviews'],
+                        'rating': ['weighted_rating', 'num_reviews', 'number_of_leads']}
+
+        depth = max_rank + spares
+        rankings = []
+
+        for ranking, columns in sort_columns.items():
+            sorted_courses = courses.sort_values(columns, ascending=False, kind='mergesort')
+
+            for category_id, category_courses in [(0, sorted_courses)] + list(sorted_courses.groupby('category_id')):
+                top_courses = category_courses.head(depth)
+
+                rankings.append(pd.DataFrame({'ranking': ranking,
+                                              'category_id': int(category_id),
+                                              'position': np.arange(1, top_courses.shape[0] + 1),
+                                              'course_id': top_courses['id'].values}))
+
+        self.ranked_courses_df = pd.concat(rankings, ignore_index=True)
+
+        return self.ranked_courses_df
+
     @staticmethod
     def __guard_against_non_existent_columns__(df: pd.DataFrame, subset: Union[List[str], str] = None):
         """Raises a ValueError if any of the columns in `subset` is not in `df.columns`
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import argparse
+
+from utils import Output, is_valid_user, add_arguments
+from classes.artifacts import convert_user_courses_pickle, read_course_ids
+
+parser = argparse.ArgumentParser(description='Converts a pickled user requested courses map into an artifact bundle',
+                                 usage='python convert_user_courses.py user password pickle_file course_ids_file '
+                                       '[OPTIONS]')
+
+add_arguments(parser)
+
+parser.add_argument('pickle_file', help='Pickled user requested courses map')
+
+parser.add_argument('course_ids_file',
+                    help='Course ids of the columns of the map, as when the map was built: the leads user-item matrix '
+                         'CSV saved along with it, or a text file with a course id per line, in column order')
+
+parser.add_argument('-o', '--output',
+                    dest='root',
+                    default='../web/data/user_courses',
+                    help='Directory that contains the bundle versions',
+                    metavar='')
+
+args = parser.parse_args()
+
+output = Output()
+
+
+def main():
+    output.title('CONVERT USER COURSES MAP', color='magenta')
+    output.start_spinner('Validating user credentials')
+    if is_valid_user(args.username, args.password):
+        output.spinner_success()
+    else:
+        output.spinner_fail('Invalid username or password')
+        exit(1)
+
+    output.start_spinner('Reading course ids from {}'.format(args.course_ids_file))
+
+    try:
+        course_ids = read_course_ids(args.course_ids_file)
+
+        output.spinner_success('Read {} course ids'.format(len(course_ids)))
+    except Exception as err:
+        output.spinner_fail(str(err))
+        exit(1)
+
+    output.start_spinner('Converting {}'.format(args.pickle_file))
+
+    try:
+        version = convert_user_courses_pickle(args.pickle_file, args.root, course_ids)
+
+        output.spinner_success('Bundle version {} saved'.format(version))
+    except Exception as err:
+        output.spinner_fail(str(err))
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
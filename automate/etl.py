@@ -1,67 +1,208 @@
 #!/usr/bin/env python
 
 import argparse
+import datetime
 from os import path
-from typing import Tuple
+from typing import Callable, Dict, Optional, Tuple
 
 import pandas as pd
 
-from utils import Output, is_valid_user, arguments
-from classes import Extract, Transform, Load
+from utils import Output, PipelineProgress, is_valid_user, add_arguments
+from classes import DbService, Extract, Transform, Load
+from classes.cache import HashCache
+from classes.checkpoint import CheckpointStore
+from classes.pipeline import Pipeline, PipelineError
+from classes.profiling import Profiler, peak_memory
 
 parser = argparse.ArgumentParser(description='Performs an ETL pipeline',
                                  usage='python etl.py user password [OPTIONS]')
 
-input_username, input_password, db_name, db_host = arguments(parser)
+add_arguments(parser)
+
+parser.add_argument('-j', '--jobs',
+                    dest='jobs',
+                    type=int,
+                    default=1,
+                    help='Number of processes used by the text processing steps',
+                    metavar='')
+
+parser.add_argument('-w', '--workers',
+                    dest='workers',
+                    type=int,
+                    default=4,
+                    help='Number of independent stages run at the same time, such as the extraction of each table',
+                    metavar='')
+
+parser.add_argument('-c', '--chunk-size',
+                    dest='chunk_size',
+                    type=int,
+                    default=50000,
+                    help='Number of rows fetched at once in the data extraction',
+                    metavar='')
+
+parser.add_argument('--local-infile',
+                    dest='local_infile',
+                    action='store_true',
+                    help='Loads the tables with LOAD DATA LOCAL INFILE instead of multi-row inserts. '
+                         'The database server must allow it')
+
+parser.add_argument('-r', '--resume-from',
+                    dest='resume_from',
+                    help='Resumes a previous run from a stage, using the checkpoints of the stages before it: '
+                         'extract, dedup, missing_values, courses, language, normalize, aggregates, categories, '
+                         'ranking or load',
+                    metavar='')
+
+parser.add_argument('-i', '--incremental',
+                    dest='incremental',
+                    action='store_true',
+                    help='Loads only the leads and reviews created since the previous run. '
+                         'Runs a full rebuild if there is no previous run')
+
+parser.add_argument('--profile',
+                    dest='profile',
+                    action='store_true',
+                    help='Records the wall time, CPU time, peak memory and rows of every stage. The report is printed '
+                         'and saved as JSON in data/profiles')
+
+parser.add_argument('--profile-stage',
+                    dest='profile_stages',
+                    action='append',
+                    help='Runs a stage under cProfile and saves its statistics in data/profiles, e.g. normalize or '
+                         'load_leads. Can be repeated. Implies --profile',
+                    metavar='')
+
+args = parser.parse_args()
+
+input_username, input_password, db_name, db_host = args.username, args.password, args.db_name, args.db_host
 
 output = Output()
 
+# The minimum number of reviews required for a course to be listed
+MIN_NUM_REVIEWS = 25
 
-def tmp_files() -> bool:
-    """Checks if temporary data file exist
+# Category ids known from previous runs. Keeps the ids stable across runs
+CATEGORIES_DICTIONARY_FILE = 'data/categories_dictionary.csv'
+# Languages detected in previous runs, keyed by the description content hash
+LANGUAGES_CACHE_FILE = 'data/languages_cache.csv'
+# Clean texts and normalized courses contents, keyed by the text content hash. The modeling pipeline reuses the
+# normalized contents
+CLEAN_TEXT_CACHE_FILE = 'data/clean_text_cache.csv'
+NORMALIZED_TEXT_CACHE_FILE = 'data/normalized_text_cache.csv'
+# Parquet checkpoints of the pipeline stages
+CHECKPOINTS_DIR = 'data/checkpoints'
+# Profiling reports and cProfile statistics
+PROFILES_DIR = 'data/profiles'
 
-    :return: Returns `True` if temporary data exists, returns `False` otherwise
-    """
-    return path.exists('.tmp/reviews.csv') and \
-        path.exists('.tmp/courses.csv') and \
-        path.exists('.tmp/leads.csv') and \
-        path.exists('.tmp/categories.csv')
+profiler = Profiler(enabled=args.profile or bool(args.profile_stages), profile_stages=args.profile_stages,
+                    directory=PROFILES_DIR)
 
 
-def extract_data() -> Tuple[pd.DataFrame, pd.DataFrame]:
-    """Extracts leads and reviews data from database
+def extract_data(watermarks: Dict[str, datetime.datetime] = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Extracts leads and reviews data from database. The course data is extracted once per course
 
-    :return: A tuple with the leads DataFrame and reviews DataFrame
+    :param watermarks: If supplied, only the leads and reviews created since these dates are extracted
+    :return: A tuple with the leads DataFrame, reviews DataFrame and courses DataFrame
     """
     extract = Extract(input_username, input_password, db_name, db_host)
 
+    if watermarks is None:
+        watermarks = {}
+
+    def summary(name: str) -> Callable[[pd.DataFrame], str]:
+        return lambda df: '{} extraction complete: {} {} ({:.1f} MB)'.format(
+            name.capitalize(), df.shape[0], name, df.memory_usage(deep=True).sum() / 1024 ** 2)
+
+    # Every table is extracted through its own connection, so the three queries run at the same time
+    pipeline = Pipeline(max_workers=args.workers)
+    pipeline.add('leads',
+                 profiler.wrap('extract_leads',
+                               lambda: extract.extract_leads(since=watermarks.get('leads'), chunk_size=args.chunk_size,
+                                                             with_courses=False)),
+                 description='Extracting leads from database',
+                 summary=summary('leads'))
+    pipeline.add('reviews',
+                 profiler.wrap('extract_reviews',
+                               lambda: extract.extract_reviews(since=watermarks.get('reviews'),
+                                                               chunk_size=args.chunk_size, with_courses=False)),
+                 description='Extracting reviews from database',
+                 summary=summary('reviews'))
+    pipeline.add('courses',
+                 profiler.wrap('extract_courses',
+                               lambda: extract.extract_courses(since=min(watermarks.values()) if watermarks else None)),
+                 description='Extracting courses from database',
+                 summary=summary('courses'))
+
     try:
-        output.start_spinner('Extracting leads from database')
-        leads_df = extract.extract_leads()
+        results = pipeline.run(progress=PipelineProgress(output))
+    except PipelineError:
+        exit(1)
 
-        output.spinner_success('Leads extraction complete: {} leads'.format(leads_df.shape[0]))
+    leads_df, reviews_df, courses_df = results['leads'], results['reviews'], results['courses']
 
-        output.start_spinner('Extracting reviews from database')
-        reviews_df = extract.extract_reviews()
+    output.info('Peak memory usage: {:.1f} MB'.format(peak_memory()))
 
-        output.spinner_success('Reviews extraction complete: {} reviews'.format(reviews_df.shape[0]))
-    except SystemError as err:
-        output.spinner_fail(str(err))
-        exit(1)
+    return leads_df, reviews_df, courses_df
+
+
+def newest_rows(leads_df: pd.DataFrame, reviews_df: pd.DataFrame) -> Dict[str, Optional[datetime.datetime]]:
+    """Returns the creation date of the newest lead and review, the watermarks of the next incremental run
+
+    :param leads_df: Leads DataFrame
+    :param reviews_df: Reviews DataFrame
+    :return: Watermarks keyed by source table name
+    """
+    watermarks = {}
+
+    for source, df in [('leads', leads_df), ('reviews', reviews_df)]:
+        created_on = pd.to_datetime(df['created_on']).max()
+        watermarks[source] = None if pd.isnull(created_on) else created_on.to_pydatetime()
 
-    return leads_df, reviews_df
+    return watermarks
 
 
-def transform_data(leads_df: pd.DataFrame, reviews_df: pd.DataFrame) -> Transform:
-    """Performs data transformation
+def clean_data(leads_df: pd.DataFrame, reviews_df: pd.DataFrame, courses_df: pd.DataFrame) -> Transform:
+    """Cleans leads and reviews and creates the courses DataFrame, without the leads and reviews data
 
     :param leads_df: Leads DataFrame
     :param reviews_df: Reviews DataFrame
+    :param courses_df: Source courses DataFrame
     :return: Transform object
     """
-    transform = Transform(leads_df, reviews_df)
+    transform = Transform(leads_df, reviews_df, courses_df)
+
+    for name, stage, frames in CLEAN_STAGES:
+        run_stage(name, stage, transform)
+
+    return transform
+
+
+def run_stage(name: str, stage: Callable[[Transform], None], transform: Transform):
+    """Runs a transformation stage, measured by the profiler
+
+    :param name: Stage name
+    :param stage: Stage function
+    :param transform: Transform object
+    """
+    with profiler.stage(name, rows_in=transform_rows(transform)) as profile:
+        stage(transform)
+        profile.rows_out = transform_rows(transform)
+
 
-    # Remove duplicated rows
+def transform_rows(transform: Transform) -> int:
+    """Counts the rows of all the DataFrames of a Transform object
+
+    :param transform: Transform object
+    :return: Number of rows
+    """
+    return sum(df.shape[0] for df in vars(transform).values() if isinstance(df, pd.DataFrame))
+
+
+def remove_duplicates(transform: Transform):
+    """Removes duplicated leads and reviews
+
+    :param transform: Transform object
+    """
     output.write('Removing duplicated data')
 
     try:
@@ -80,19 +221,19 @@ def transform_data(leads_df: pd.DataFrame, reviews_df: pd.DataFrame) -> Transfor
         output.spinner_fail(str(err))
         exit(1)
 
-    # Replace missing values
-    output.write('Replacing missing values')
 
-    try:
-        output.start_spinner('Replacing missing values in leads DataFrame')
-        leads_values_replaced = transform.replace_leads_null_values('course_description', '')
+def replace_missing_values(transform: Transform):
+    """Replaces missing values and changes the ids data type
 
-        output.spinner_success('Replaced {} missing descriptions in leads DataFrame'.format(leads_values_replaced))
+    :param transform: Transform object
+    """
+    output.write('Replacing missing values')
 
-        output.start_spinner('Replacing missing values in reviews DataFrame')
-        reviews_values_replaced = transform.replace_reviews_null_values('course_description', '')
+    try:
+        output.start_spinner('Replacing missing values in courses DataFrame')
+        courses_values_replaced = transform.replace_source_courses_null_values('course_description', '')
 
-        output.spinner_success('Replaced {} missing descriptions in reviews DataFrame'.format(reviews_values_replaced))
+        output.spinner_success('Replaced {} missing descriptions in courses DataFrame'.format(courses_values_replaced))
     except ValueError as err:
         output.spinner_fail(str(err))
         exit(1)
@@ -107,24 +248,39 @@ def transform_data(leads_df: pd.DataFrame, reviews_df: pd.DataFrame) -> Transfor
         output.spinner_fail(str(err))
         exit(1)
 
-    # Create a courses DataFrame
+
+def create_courses(transform: Transform):
+    """Creates the courses DataFrame
+
+    :param transform: Transform object
+    """
     output.write('Create a courses DataFrame')
     output.start_spinner('Creating the courses DataFrame')
 
     try:
-        courses_df = transform.create_courses_df()
+        clean_text_cache = HashCache(['clean'], CLEAN_TEXT_CACHE_FILE)
+        courses_df = transform.create_courses_df(n_jobs=args.jobs, cache=clean_text_cache)
+        clean_text_cache.save()
 
         output.spinner_success('Courses DataFrame created with {} rows'.format(courses_df.shape[0]))
     except Exception as err:
         output.spinner_fail(str(err))
         exit(1)
 
-    # Detect courses language
+
+def remove_not_in_english_courses(transform: Transform):
+    """Detects the courses language and removes the courses that are not in English
+
+    :param transform: Transform object
+    """
     output.write('Detect courses language')
     output.warning('This process can take a long time')
     output.start_spinner('Detecting courses language')
     try:
-        courses_df = transform.detect_courses_language()
+        languages_cache = HashCache(['lang'], LANGUAGES_CACHE_FILE)
+        courses_df = transform.detect_courses_language(n_jobs=args.jobs, cache=languages_cache)
+        languages_cache.save()
+
         output.spinner_success('Language detection complete. {} courses are not written in English'. format(
             courses_df[courses_df['lang'] != 'en'].shape[0]))
     except Exception as err:
@@ -141,87 +297,333 @@ def transform_data(leads_df: pd.DataFrame, reviews_df: pd.DataFrame) -> Transfor
         output.spinner_fail(str(err))
         exit(1)
 
-    # Add data to courses DataFrame
+
+def normalize_contents(transform: Transform):
+    """Normalizes the courses content and caches it for the modeling pipeline
+
+    :param transform: Transform object
+    """
+    output.write('Normalize courses content')
+    output.start_spinner('Normalizing courses content')
+    try:
+        normalized_text_cache = HashCache(['normalized'], NORMALIZED_TEXT_CACHE_FILE)
+        transform.normalize_courses_content(n_jobs=args.jobs, cache=normalized_text_cache)
+        normalized_text_cache.save()
+
+        output.spinner_success('Normalized contents cached: {}'.format(len(normalized_text_cache)))
+    except Exception as err:
+        output.spinner_fail(str(err))
+        exit(1)
+
+
+def add_data_to_courses(transform: Transform):
+    """Adds the ratings and the number of leads to the courses DataFrame
+
+    :param transform: Transform object
+    """
     output.write('Add data to courses DataFrame')
     output.start_spinner('Adding data to courses DataFrame')
     try:
-        transform.add_data_to_courses(25)
+        transform.add_data_to_courses(MIN_NUM_REVIEWS)
 
         output.spinner_success()
     except Exception as err:
         output.spinner_fail(str(err))
         exit(1)
 
-    # Create a categories DataFrame
+
+def create_ranked_courses(transform: Transform):
+    """Creates the ranked courses lists
+
+    :param transform: Transform object
+    """
+    output.write('Create ranked courses lists')
+    output.start_spinner('Creating ranked courses lists')
+
+    try:
+        ranked_courses_df = transform.create_ranked_courses_df()
+
+        output.spinner_success('Ranked courses lists created with {} rows'.format(ranked_courses_df.shape[0]))
+    except Exception as err:
+        output.spinner_fail(str(err))
+        exit(1)
+
+
+def create_categories(transform: Transform):
+    """Creates the categories DataFrame, keeping the category ids of previous runs
+
+    :param transform: Transform object
+    """
     output.write('Create a categories DataFrame')
     output.start_spinner('Creating a categories DataFrame')
 
-    categories_df = transform.create_categories_df()
+    categories_dictionary_df = None
+    if path.exists(CATEGORIES_DICTIONARY_FILE):
+        categories_dictionary_df = pd.read_csv(CATEGORIES_DICTIONARY_FILE, dtype={'name': str})
 
-    output.spinner_success('Categories DataFrame creation complete. There are {} categories'.format(
-        categories_df.shape[0]))
+    try:
+        categories_df = transform.create_categories_df(categories_dictionary_df)
 
-    return transform
+        transform.categories_dictionary_df.to_csv(CATEGORIES_DICTIONARY_FILE, index=False)
 
+        output.spinner_success('Categories DataFrame creation complete. There are {} categories'.format(
+            categories_df.shape[0]))
+    except Exception as err:
+        output.spinner_fail(str(err))
+        exit(1)
 
-def load_data(transform: Transform) -> bool:
+
+# Transformation stages: name, function and the Transform DataFrames it changes, which are saved in its checkpoint
+CLEAN_STAGES = [
+    ('dedup', remove_duplicates, ['leads_df', 'reviews_df']),
+    ('missing_values', replace_missing_values, ['leads_df', 'reviews_df', 'source_courses_df']),
+    ('courses', create_courses, ['courses_df']),
+    ('language', remove_not_in_english_courses, ['leads_df', 'reviews_df', 'courses_df']),
+    ('normalize', normalize_contents, []),
+]
+
+TRANSFORM_STAGES = CLEAN_STAGES + [
+    ('aggregates', add_data_to_courses, ['courses_df']),
+    ('categories', create_categories, ['courses_df', 'categories_df', 'categories_dictionary_df']),
+    ('ranking', create_ranked_courses, ['ranked_courses_df']),
+]
+
+STAGES = ['extract'] + [name for name, stage, frames in TRANSFORM_STAGES] + ['load']
+
+# Parameters of the stages, part of their fingerprints
+STAGE_PARAMETERS = {'aggregates': {'min_num_reviews': MIN_NUM_REVIEWS}}
+
+
+def load_data(transform: Transform, watermarks: Dict[str, datetime.datetime]) -> bool:
     """Load clean data to database
 
     :param transform: Transform class, containing all DataFrames to be loaded
+    :param watermarks: Creation date of the newest extracted lead and review, saved if all data is loaded
     :return: Returns `True` if loading process has been completed successfully, returns `False` otherwise
     """
-    load = Load(input_username, input_password, db_name, db_host)
-    load_errors = 0
+    load = Load(input_username, input_password, db_name, db_host, local_infile=args.local_infile)
+
+    # Every table is loaded into its own staging table, so the tables are saved at the same time
+    pipeline = Pipeline(max_workers=args.workers)
+
+    def save(name: str, func: Callable[[pd.DataFrame], None], df: pd.DataFrame) -> Callable[[], None]:
+        return profiler.wrap('load_{}'.format(name), lambda: func(df), rows_in=df.shape[0], rows_out=None)
 
-    # Save courses to database
-    output.write('Save courses to database')
-    output.start_spinner('Saving courses to database')
+    pipeline.add('courses', save('courses', load.save_courses, transform.courses_df),
+                 description='Saving courses to database')
+    pipeline.add('leads', save('leads', load.save_leads, transform.leads_df),
+                 description='Saving leads to database')
+    pipeline.add('reviews', save('reviews', load.save_reviews, transform.reviews_df),
+                 description='Saving reviews to database')
+    pipeline.add('categories', save('categories', load.save_categories, transform.categories_df),
+                 description='Saving categories to database')
+    pipeline.add('ranked_courses', save('ranked_courses', load.save_ranked_courses, transform.ranked_courses_df),
+                 description='Saving ranked courses to database')
 
     try:
-        load.save_courses(transform.courses_df)
+        pipeline.run(progress=PipelineProgress(output), keep_going=True)
+    except PipelineError:
+        return False
+
+    save_watermarks(load, watermarks)
+
+    return True
+
+
+def save_watermarks(load: Load, watermarks: Dict[str, datetime.datetime]):
+    """Saves the watermarks of the next incremental run
+
+    :param load: Load object
+    :param watermarks: Creation date of the newest loaded lead and review
+    """
+    output.write('Save watermarks to database')
+    output.start_spinner('Saving watermarks to database')
+
+    try:
+        load.save_watermarks(watermarks)
 
         output.spinner_success()
     except Exception as err:
         output.spinner_fail(str(err))
-        load_errors += 1
+        exit(1)
+
 
-    # Save leads to database
-    output.write('Save leads to database')
-    output.start_spinner('Saving leads to database')
+def incremental_update(watermarks: Dict[str, datetime.datetime]):
+    """Extracts the leads and reviews created since the previous run, adds them to the clean data and updates the
+        data of the courses and categories they belong to
+
+    :param watermarks: Creation date of the newest lead and review loaded by the previous run
+    """
+    output.title('DATA EXTRACTION')
+    output.info('Extracting data created since {}'.format(min(watermarks.values())))
+
+    leads_df, reviews_df, courses_df = extract_data(watermarks)
+    new_watermarks = newest_rows(leads_df, reviews_df)
+
+    if leads_df.shape[0] == 0 and reviews_df.shape[0] == 0:
+        output.success('There is no new data. ETL pipeline completed')
+        return
+
+    output.title('DATA TRANSFORMATION')
+
+    transform = clean_data(leads_df, reviews_df, courses_df)
+
+    output.title('DATA LOAD')
+
+    extract = Extract(input_username, input_password, db_name, db_host)
+    load = Load(input_username, input_password, db_name, db_host)
+
+    # Leads and reviews already loaded are ignored
+    output.write('Add new leads and reviews to database')
+    output.start_spinner('Adding new leads and reviews to database')
 
     try:
-        load.save_leads(transform.leads_df)
+        load.append_leads(transform.leads_df)
+        load.append_reviews(transform.reviews_df)
 
         output.spinner_success()
     except Exception as err:
         output.spinner_fail(str(err))
-        load_errors += 1
+        exit(1)
 
-    # Save reviews to database
-    output.write('Save reviews to database')
-    output.start_spinner('Saving reviews to database')
+    # Recompute the data of the affected courses from all their leads and reviews
+    output.write('Update the data of the affected courses')
+    output.start_spinner('Updating the data of {} courses'.format(transform.courses_df.shape[0]))
 
     try:
-        load.save_reviews(transform.reviews_df)
+        course_ids = transform.courses_df['id'].values
+
+        loaded_courses_df = extract.extract_clean_courses()
+        other_courses_df = loaded_courses_df[~loaded_courses_df['id'].isin(course_ids)]
+        affected_category_ids = set(loaded_courses_df[loaded_courses_df['id'].isin(course_ids)]['category_id'])
+
+        courses_leads_df, courses_reviews_df = extract.extract_clean_events(course_ids)
+
+        aggregates = Transform(courses_leads_df, courses_reviews_df)
+        aggregates.courses_df = transform.courses_df
+        aggregates.add_data_to_courses(MIN_NUM_REVIEWS, other_courses_df)
 
         output.spinner_success()
     except Exception as err:
         output.spinner_fail(str(err))
-        load_errors += 1
+        exit(1)
 
-    # Save categories to database
-    output.write('Save categories to database')
-    output.start_spinner('Saving categories to database')
+    create_categories(aggregates)
+
+    output.start_spinner('Updating the ranked courses lists of the affected categories')
 
     try:
-        load.save_categories(transform.categories_df)
+        affected_category_ids |= set(aggregates.courses_df['category_id']) | {0}
 
-        output.spinner_success()
+        ranking = Transform(None, None)
+        ranking.courses_df = pd.concat([other_courses_df, aggregates.courses_df], sort=False)
+        ranked_courses_df = ranking.create_ranked_courses_df()
+        ranked_courses_df = ranked_courses_df[ranked_courses_df['category_id'].isin(affected_category_ids)]
+
+        load.upsert_categories(aggregates.categories_df)
+        load.upsert_courses(aggregates.courses_df)
+        load.replace_ranked_courses(ranked_courses_df, list(affected_category_ids))
+
+        output.spinner_success('Updated {} ranked courses lists'.format(len(affected_category_ids) * 2))
     except Exception as err:
         output.spinner_fail(str(err))
-        load_errors += 1
+        exit(1)
+
+    save_watermarks(load, new_watermarks)
+
+    output.success('ETL pipeline completed')
+
+
+def run_pipeline(resume_from: str = None):
+    """Runs the full pipeline. Every stage saves a checkpoint, so that a later run can resume from any stage
+
+    :param resume_from: Stage to resume from. The stages before it are restored from their checkpoints
+    """
+    checkpoints = CheckpointStore(CHECKPOINTS_DIR)
+    resume_index = STAGES.index(resume_from) if resume_from else 0
 
-    return load_errors == 0
+    if resume_index == 0:
+        output.title('DATA EXTRACTION')
+
+        leads_df, reviews_df, courses_df = extract_data()
+        watermarks = newest_rows(leads_df, reviews_df)
+
+        fingerprint = CheckpointStore.fingerprint(db_host, db_name, leads_df, reviews_df, courses_df)
+        checkpoints.save('extract', {'leads_df': leads_df, 'reviews_df': reviews_df, 'source_courses_df': courses_df},
+                         fingerprint,
+                         metadata={'watermarks': {source: created_on.isoformat() if created_on else None
+                                                  for source, created_on in watermarks.items()}})
+
+        transform = Transform(leads_df, reviews_df, courses_df)
+    else:
+        output.info('Resuming from the {} stage'.format(resume_from))
+
+        transform, fingerprint, watermarks = restore_checkpoints(checkpoints, resume_index)
+
+    output.title('DATA TRANSFORMATION')
+
+    for index, (name, stage, frames) in enumerate(TRANSFORM_STAGES, start=1):
+        fingerprint = CheckpointStore.fingerprint(fingerprint, name, STAGE_PARAMETERS.get(name))
+
+        if index < resume_index:
+            continue
+
+        run_stage(name, stage, transform)
+
+        checkpoints.save(name, {frame: getattr(transform, frame) for frame in frames}, fingerprint)
+
+    output.title('DATA LOAD')
+
+    if load_data(transform, watermarks):
+        output.success('ETL pipeline completed')
+    else:
+        output.warning('ETL pipeline completed with errors. Run it again with --resume-from load to retry the load')
+
+
+def restore_checkpoints(checkpoints: CheckpointStore,
+                        resume_index: int) -> Tuple[Transform, str, Dict[str, datetime.datetime]]:
+    """Restores the pipeline state from the checkpoints of the stages before the resumed one
+
+    Every checkpoint must have been built from the checkpoint of the previous stage with the current stage
+    parameters, otherwise the pipeline has to resume from an earlier stage.
+
+    :param checkpoints: Checkpoint store
+    :param resume_index: Index in `STAGES` of the resumed stage
+    :return: A tuple with the Transform object, the fingerprint of the extracted data and the watermarks
+    """
+    output.start_spinner('Restoring checkpoints')
+
+    extract_manifest = checkpoints.manifest('extract')
+    if extract_manifest is None:
+        output.spinner_fail('There is no checkpoint of the extract stage')
+        exit(1)
+
+    # Check that the checkpoints are a chain
+    fingerprint = extract_manifest['fingerprint']
+    frames_stages = {frame: 'extract' for frame in extract_manifest['frames']}
+
+    for name, stage, frames in TRANSFORM_STAGES[:resume_index - 1]:
+        fingerprint = CheckpointStore.fingerprint(fingerprint, name, STAGE_PARAMETERS.get(name))
+        manifest = checkpoints.manifest(name)
+
+        if manifest is None or manifest['fingerprint'] != fingerprint:
+            output.spinner_fail('The checkpoint of the {} stage is missing or out of date. '
+                                'Resume from the {} stage'.format(name, name))
+            exit(1)
+
+        frames_stages.update({frame: name for frame in frames})
+
+    # Each DataFrame is restored from the last stage that changed it
+    transform = Transform(None, None)
+    for frame, name in frames_stages.items():
+        setattr(transform, frame, checkpoints.load(name, [frame])[frame])
+
+    watermarks = {source: pd.Timestamp(created_on).to_pydatetime() if created_on else None
+                  for source, created_on in extract_manifest['metadata']['watermarks'].items()}
+
+    output.spinner_success()
+
+    return transform, extract_manifest['fingerprint'], watermarks
 
 
 def main():
@@ -233,43 +635,42 @@ def main():
         output.spinner_fail('Invalid username or password')
         exit(1)
 
-    output.title('DATA EXTRACTION')
+    if args.incremental:
+        output.start_spinner('Retrieving watermarks')
+        extract = Extract(input_username, input_password, db_name, db_host)
+        watermarks = {source: extract.extract_watermark(source) for source in ['leads', 'reviews']}
 
-    if tmp_files():
-        # Extract from tmp files
-        output.info('Extracting data from temporary files')
+        if None not in watermarks.values():
+            output.spinner_success()
+            incremental_update(watermarks)
+            return
 
-        leads_df = pd.read_csv('.tmp/leads.csv')
-        reviews_df = pd.read_csv('.tmp/reviews.csv')
+        output.spinner_fail('There are no watermarks, running a full rebuild')
 
-        transform = Transform(leads_df, reviews_df)
-        transform.courses_df = pd.read_csv('.tmp/courses.csv')
-        transform.categories_df = pd.read_csv('.tmp/categories.csv')
+    if args.resume_from is not None and args.resume_from not in STAGES:
+        output.error('Unknown stage {}. The stages are: {}'.format(args.resume_from, ', '.join(STAGES)))
+        exit(1)
 
-    else:
-        # Data extraction
-        leads_df, reviews_df = extract_data()
+    run_pipeline(args.resume_from)
 
-        # Data transformation
-        output.title('DATA TRANSFORMATION')
 
-        transform = transform_data(leads_df, reviews_df)
+def save_profile():
+    """Prints the profiling report and saves it as JSON"""
+    if not profiler.enabled:
+        return
 
-    # Data load
-    output.title('DATA LOAD')
+    file_name = path.join(PROFILES_DIR, 'etl-{}.json'.format(profiler.started_on.strftime('%Y%m%dT%H%M%S')))
+    profiler.save(file_name, metadata={option: value for option, value in vars(args).items()
+                                       if option not in ('username', 'password')})
 
-    # If there is an error in data loading, dataframes will be saved into a local csv files
-    # in this way, when executing the process again, the extracted data will already be clean
-    if load_data(transform):
-        output.success('ETL pipeline completed')
-    else:
-        transform.reviews_df.to_csv('.tmp/reviews.csv', index=False)
-        transform.leads_df.to_csv('.tmp/leads.csv', index=False)
-        transform.courses_df.to_csv('.tmp/courses.csv', index=False)
-        transform.categories_df.to_csv('.tmp/categories.csv', index=False)
-
-        output.warning('ETL pipeline completed with errors')
+    output.table(profiler.table())
+    output.info('Profiling report saved to {}'.format(file_name))
 
 
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    finally:
+        save_profile()
+        output.info('Database usage: {}'.format(DbService.stats_summary()))
+        DbService.dispose_engines()
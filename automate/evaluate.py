@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import json
+import os
+import time
+
+import pandas as pd
+
+from utils import Output, is_valid_user, add_arguments
+from classes import DbService, Model
+from classes.cache import HashCache
+from classes.content import tfidf_vectors
+from classes.cooccurrence import JACCARD, MEASURES
+from classes.evaluation import (CHUNK_SIZE, DEFAULT_FACTORS, DEFAULT_NEIGHBOURS, TEST_FRACTION, ContentRecommender,
+                                CooccurrenceRecommender, Evaluation, RankRecommender, SvdRecommender,
+                                UserNeighbourRecommender, time_split)
+
+RECOMMENDERS = ['co-occurrence', 'content', 'user-neighbour', 'svd', 'rank']
+
+parser = argparse.ArgumentParser(description='Evaluates the recommenders offline on a time-based split of the leads',
+                                 usage='python evaluate.py user password [OPTIONS]')
+
+add_arguments(parser)
+
+parser.add_argument('-k', '--top-k',
+                    dest='top_k',
+                    type=int,
+                    default=10,
+                    help='Number of recommendations evaluated per user',
+                    metavar='')
+
+parser.add_argument('-t', '--test-fraction',
+                    dest='test_fraction',
+                    type=float,
+                    default=TEST_FRACTION,
+                    help='Share of the most recent leads held out as the test set. Default: 0.2',
+                    metavar='')
+
+parser.add_argument('-r', '--recommender',
+                    dest='recommenders',
+                    action='append',
+                    choices=RECOMMENDERS,
+                    help='Recommender to evaluate: {}. Can be repeated. All of them by default'.format(
+                        ', '.join(RECOMMENDERS)),
+                    metavar='')
+
+parser.add_argument('-j', '--jobs',
+                    dest='jobs',
+                    type=int,
+                    default=1,
+                    help='Number of processes that score the users, and normalize the courses content',
+                    metavar='')
+
+parser.add_argument('-c', '--chunk-size',
+                    dest='chunk_size',
+                    type=int,
+                    default=CHUNK_SIZE,
+                    help='Number of users scored at once',
+                    metavar='')
+
+parser.add_argument('--neighbours',
+                    dest='neighbours',
+                    type=int,
+                    default=DEFAULT_NEIGHBOURS,
+                    help='Similar courses or users kept by the co-occurrence, content and user-neighbour recommenders',
+                    metavar='')
+
+parser.add_argument('--factors',
+                    dest='factors',
+                    type=int,
+                    default=DEFAULT_FACTORS,
+                    help='Latent factors of the svd recommender',
+                    metavar='')
+
+parser.add_argument('--score',
+                    dest='score',
+                    choices=MEASURES,
+                    default=JACCARD,
+                    help='Score of the co-occurrence recommender: count, jaccard or cosine. Default: jaccard',
+                    metavar='')
+
+args = parser.parse_args()
+
+output = Output()
+
+# Normalized courses contents, keyed by the content hash. Filled by the ETL pipeline
+NORMALIZED_TEXT_CACHE_FILE = 'data/normalized_text_cache.csv'
+# Evaluation reports
+EVALUATIONS_DIR = 'data/evaluations'
+
+
+def content_vectors(model: Model, course_ids: pd.Index):
+    """Builds the content vectors of the courses, in the order of the training matrix columns
+
+    :param model: Model
+    :param course_ids: Course ids of the training matrix columns
+    :return: A sparse matrix with a row per course. Courses not found have an empty content
+    """
+    normalized_content = model.normalized_course_contents(n_jobs=args.jobs,
+                                                          cache=HashCache(['normalized'], NORMALIZED_TEXT_CACHE_FILE))
+    normalized_content = pd.Series(normalized_content.values, index=model.courses_df['id'].values)
+    normalized_content = normalized_content[~normalized_content.index.duplicated()]
+
+    return tfidf_vectors(normalized_content.reindex(course_ids).values)
+
+
+def create_recommender(name: str, model: Model, evaluation: Evaluation):
+    """Creates a recommender by its name
+
+    :param name: Recommender name, one of `RECOMMENDERS`
+    :param model: Model, used to retrieve the courses content
+    :param evaluation: Evaluation whose courses the recommender scores
+    :return: The recommender, not fitted yet
+    """
+    if name == 'co-occurrence':
+        return CooccurrenceRecommender(measure=args.score, neighbours=args.neighbours)
+
+    if name == 'content':
+        return ContentRecommender(content_vectors(model, evaluation.course_ids), neighbours=args.neighbours)
+
+    if name == 'user-neighbour':
+        return UserNeighbourRecommender(neighbours=args.neighbours)
+
+    if name == 'svd':
+        return SvdRecommender(factors=args.factors)
+
+    return RankRecommender()
+
+
+def main():
+    output.title('EVALUATE RECOMMENDERS', color='magenta')
+    output.start_spinner('Validating user credentials')
+    if is_valid_user(args.username, args.password):
+        output.spinner_success()
+    else:
+        output.spinner_fail('Invalid username or password')
+        exit(1)
+
+    model = Model(args.username, args.password, args.db_name, args.db_host)
+
+    try:
+        output.start_spinner('Splitting the leads by time')
+        train_df, test_df = time_split(model.retrieve_leads(), test_fraction=args.test_fraction)
+        evaluation = Evaluation(train_df, test_df)
+        output.spinner_success('{} training and {} test leads, {} test users'.format(train_df.shape[0],
+                                                                                     test_df.shape[0],
+                                                                                     len(evaluation.users)))
+    except Exception as err:
+        output.spinner_fail(str(err))
+        exit(1)
+
+    results = []
+    for name in args.recommenders if args.recommenders else RECOMMENDERS:
+        output.start_spinner('Evaluating the {} recommender'.format(name))
+
+        try:
+            start = time.perf_counter()
+            recommender = create_recommender(name, model, evaluation).fit(evaluation.train)
+            fit_seconds = time.perf_counter() - start
+
+            result = evaluation.evaluate(recommender, k=args.top_k, chunk_size=args.chunk_size, n_jobs=args.jobs)
+            result['fit_seconds'] = fit_seconds
+            results.append(result)
+
+            output.spinner_success()
+        except Exception as err:
+            output.spinner_fail(str(err))
+
+    if not results:
+        output.error('No recommender could be evaluated')
+        exit(1)
+
+    output.table([['Recommender', 'Precision@{}'.format(args.top_k), 'Recall@{}'.format(args.top_k),
+                   'MAP@{}'.format(args.top_k), 'Coverage', 'Fit (s)', 'ms/user', 'p95 ms/user']] +
+                 [[result['recommender'],
+                   '{:.4f}'.format(result['precision']),
+                   '{:.4f}'.format(result['recall']),
+                   '{:.4f}'.format(result['map']),
+                   '{:.1%}'.format(result['coverage']),
+                   '{:.2f}'.format(result['fit_seconds']),
+                   '{:.3f}'.format(result['ms_per_user']),
+                   '{:.3f}'.format(result['p95_ms_per_user'])] for result in results])
+
+    os.makedirs(EVALUATIONS_DIR, exist_ok=True)
+    file_name = os.path.join(EVALUATIONS_DIR,
+                             'evaluation-{}.json'.format(datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')))
+
+    with open(file_name, 'w') as file:
+        json.dump({'options': {key: value for key, value in vars(args).items() if key not in ('username', 'password')},
+                   'results': results}, file, indent=2)
+
+    output.info('Evaluation report saved in {}'.format(file_name))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        output.info('Database usage: {}'.format(DbService.stats_summary()))
+        DbService.dispose_engines()
@@ -1,100 +1,214 @@
 #!/usr/bin/env python
 
 import argparse
+from os import path
 
-from utils import Output, is_valid_user, arguments
-from classes import Model
+from utils import Output, PipelineProgress, is_valid_user, add_arguments
+from classes import DbService, Model
+from classes.ann import ContentIndex, IndexUnavailableError
+from classes.cache import HashCache
+from classes.cooccurrence import JACCARD, MEASURES
+from classes.pipeline import Pipeline, PipelineError
+from classes.profiling import Profiler
 
 parser = argparse.ArgumentParser(description='Performs a data modeling pipeline',
                                  usage='python model.py user password [OPTIONS]')
 
-input_username, input_password, db_name, db_host = arguments(parser)
+add_arguments(parser)
+
+parser.add_argument('-j', '--jobs',
+                    dest='jobs',
+                    type=int,
+                    default=1,
+                    help='Number of processes used by the text processing steps',
+                    metavar='')
+
+parser.add_argument('-k', '--top-k',
+                    dest='top_k',
+                    type=int,
+                    default=20,
+                    help='Maximum number of similar courses by content saved per course',
+                    metavar='')
+
+parser.add_argument('-r', '--recommendations',
+                    dest='recommendations',
+                    type=int,
+                    default=10,
+                    help='Maximum number of course-course recommendations by leads saved per course',
+                    metavar='')
+
+parser.add_argument('--score',
+                    dest='score',
+                    choices=MEASURES,
+                    default=JACCARD,
+                    help='Score of the course-course recommendations by leads: the number of users who generated '
+                         'leads in both courses, or that number divided by the users of either course (jaccard) or by '
+                         'the geometric mean of the users of each course (cosine). Default: jaccard',
+                    metavar='')
+
+parser.add_argument('--neighbours',
+                    dest='neighbours',
+                    type=int,
+                    default=20,
+                    help='Maximum number of nearest reviewers by ratings saved per reviewer',
+                    metavar='')
+
+parser.add_argument('--ann',
+                    dest='ann',
+                    action='store_true',
+                    help='Compares every course only with the candidates of the approximate nearest neighbour index '
+                         'of the courses contents, instead of with every other course')
+
+parser.add_argument('-i', '--incremental',
+                    dest='incremental',
+                    action='store_true',
+                    help='Only recomputes the content similarities of the courses added, changed or removed since the '
+                         'last run, and of their neighbours. Falls back to a full run if there is no content index')
+
+parser.add_argument('-w', '--workers',
+                    dest='workers',
+                    type=int,
+                    default=2,
+                    help='Number of independent stages run at the same time, such as the content and leads models',
+                    metavar='')
+
+parser.add_argument('--profile',
+                    dest='profile',
+                    action='store_true',
+                    help='Records the wall time, CPU time, peak memory and rows of every stage. The report is printed '
+                         'and saved as JSON in data/profiles')
+
+parser.add_argument('--profile-stage',
+                    dest='profile_stages',
+                    action='append',
+                    help='Runs a stage under cProfile and saves its statistics in data/profiles, e.g. '
+                         'content_similarities or course_recommendations. Can be repeated. Implies --profile',
+                    metavar='')
+
+args = parser.parse_args()
+
+input_username, input_password, db_name, db_host = args.username, args.password, args.db_name, args.db_host
 
 output = Output()
 
+# Normalized courses contents, keyed by the content hash. Filled by the ETL pipeline
+NORMALIZED_TEXT_CACHE_FILE = 'data/normalized_text_cache.csv'
+# Approximate nearest neighbour index of the courses contents, used by similar_courses.py
+CONTENT_INDEX_DIR = 'data/content_index'
+# Profiling reports and cProfile statistics
+PROFILES_DIR = 'data/profiles'
 
-def model_data():
-    model = Model(input_username, input_password, db_name, db_host)
-
-    # Create course content similarity DataFrame
-    output.write('Create a course content similarity DataFrame')
-    output.warning('This process can take a long time')
-    output.start_spinner('Creating a course content similarity DataFrame')
-
-    try:
-        model.create_course_content_similarity_df()
-        output.spinner_success()
-    except Exception as err:
-        output.spinner_fail(str(err))
-        exit(1)
-
-    # Save courses content similarities to database
-    output.write('Save courses content similarities to database')
-    output.start_spinner('Saving courses content similarities to database')
-
-    try:
-        model.save_course_content_similarities()
-
-        output.spinner_success()
-    except Exception as err:
-        output.spinner_fail(str(err))
-
-    # Create leads user-item matrix
-    output.write('Create leads user-item matrix')
-    output.warning('This process can take a long time')
-    output.start_spinner('Creating the leads user-item matrix')
-
-    try:
-        model.create_leads_user_item_matrix()
-        output.spinner_success()
-
-        # Compress leads user-item matrix
-        output.write('Compress leads user-item matrix')
-        output.start_spinner('Compressing the leads user-item matrix')
-
-        model.compress_leads_user_item_matrix()
-
-        output.spinner_success()
+profiler = Profiler(enabled=args.profile or bool(args.profile_stages), profile_stages=args.profile_stages,
+                    directory=PROFILES_DIR)
 
-    except Exception as err:
-        output.spinner_fail(str(err))
-        exit(1)
-
-    # Save user requested courses map to a file
-    output.write('Save user requested courses map to a file')
-    output.start_spinner('Saving user requested courses map to a file')
-
-    try:
-        model.save_user_courses_map('../web/data/user_requested_courses_map.pickle')
-
-        output.spinner_success()
-    except Exception as err:
-        output.spinner_fail(str(err))
 
-    # Create course-course recommendations DataFrame
-    output.write('Create course-course recommendations DataFrame')
-    output.warning('This process can take a long time')
-    output.start_spinner('Creating the course-course recommendations DataFrame')
+def model_data():
+    model = Model(input_username, input_password, db_name, db_host)
+    content_index = None
+
+    if args.incremental:
+        try:
+            content_index = ContentIndex.load(CONTENT_INDEX_DIR)
+        except IndexUnavailableError as err:
+            output.warning('{}. Computing all the content similarities instead'.format(err))
+
+    def update_course_content_similarities():
+        with profiler.stage('content_similarities') as profile:
+            normalized_text_cache = HashCache(['normalized'], NORMALIZED_TEXT_CACHE_FILE)
+            stats = model.update_course_content_similarities(content_index, CONTENT_INDEX_DIR, top_k=args.top_k,
+                                                             n_jobs=args.jobs, cache=normalized_text_cache)
+
+            profile.rows_in = stats['recomputed']
+            profile.rows_out = stats['similarities']
+
+            normalized_text_cache.save()
+
+            return '{new} new, {changed} changed and {removed} removed courses, {similarities} content similarities ' \
+                   'of {recomputed} courses saved'.format(**stats)
+
+    def create_course_content_similarities():
+        if content_index is not None:
+            return update_course_content_similarities()
+
+        with profiler.stage('content_similarities') as profile:
+            normalized_text_cache = HashCache(['normalized'], NORMALIZED_TEXT_CACHE_FILE)
+            chunks = model.course_content_similarity_chunks(n_jobs=args.jobs, cache=normalized_text_cache,
+                                                            top_k=args.top_k, approximate=args.ann)
+
+            # Every block of similarities is written as soon as it is computed
+            profile.rows_out = model.save_course_content_similarities(chunks)
+            profile.rows_in = model.courses_df.shape[0]
+
+            normalized_text_cache.save()
+            model.content_index.save(CONTENT_INDEX_DIR)
+
+            return '{} courses content similarities saved'.format(profile.rows_out)
+
+    def create_leads_user_item_matrix():
+        with profiler.stage('user_item_matrix') as profile:
+            model.create_leads_user_item_matrix()
+            model.compress_leads_user_item_matrix()
+
+            profile.rows_in = model.leads_df.shape[0]
+            profile.rows_out = model.leads_sparse_matrix.shape[0]
+
+    def save_user_courses_matrix():
+        with profiler.stage('save_user_item_matrix', rows_in=model.leads_sparse_matrix.shape[0]):
+            return model.save_user_courses_matrix('../web/data/user_courses')
+
+    def create_course_course_recommendations():
+        with profiler.stage('course_recommendations', rows_in=model.leads_sparse_matrix.shape[1]) as profile:
+            model.create_course_course_recommendations_df(top_k=args.recommendations, measure=args.score)
+
+            profile.rows_out = model.course_course_recs_df.shape[0]
+
+    def save_course_course_recommendations():
+        with profiler.stage('save_course_recommendations', rows_in=model.course_course_recs_df.shape[0]):
+            model.save_course_course_recommendations()
+
+    def create_similar_reviewers():
+        with profiler.stage('similar_reviewers') as profile:
+            model.create_similar_reviewers_df(top_k=args.neighbours)
+
+            profile.rows_in = model.reviews_df.shape[0]
+            profile.rows_out = model.similar_reviewers_df.shape[0]
+
+    def save_similar_reviewers():
+        with profiler.stage('save_similar_reviewers', rows_in=model.similar_reviewers_df.shape[0]):
+            model.save_similar_reviewers()
+
+    # The content similarities, the leads models and the ratings model do not share any data, so the branches run at
+    # the same time
+    pipeline = Pipeline(max_workers=args.workers)
+    pipeline.add('content_similarities', create_course_content_similarities,
+                 description='Creating and saving the courses content similarities',
+                 summary=lambda message: message)
+    pipeline.add('user_item_matrix', create_leads_user_item_matrix,
+                 description='Creating and compressing the leads user-item matrix')
+    pipeline.add('save_user_item_matrix', save_user_courses_matrix,
+                 requires=['user_item_matrix'],
+                 description='Saving leads user-item matrix arrays',
+                 summary=lambda version: 'User courses bundle version {}'.format(version))
+    pipeline.add('course_recommendations', create_course_course_recommendations,
+                 requires=['user_item_matrix'],
+                 description='Creating the course-course recommendations DataFrame')
+    pipeline.add('save_course_recommendations', save_course_course_recommendations,
+                 requires=['course_recommendations'],
+                 description='Saving course-course recommendations to database')
+    pipeline.add('similar_reviewers', create_similar_reviewers,
+                 description='Creating the nearest reviewers by ratings DataFrame')
+    pipeline.add('save_similar_reviewers', save_similar_reviewers,
+                 requires=['similar_reviewers'],
+                 description='Saving nearest reviewers to database')
+
+    output.warning('Creating the content similarities and the course-course recommendations can take a long time')
 
     try:
-        model.create_course_course_recommendations_df()
-
-        output.spinner_success()
-    except Exception as err:
-        output.spinner_fail(str(err))
+        pipeline.run(progress=PipelineProgress(output), keep_going=True)
+    except PipelineError as err:
+        output.error('Data modeling failed on: {}'.format(', '.join(err.errors)))
         exit(1)
 
-    # Save course-course recommendations to database
-    output.write('Save course-course recommendations to database')
-    output.start_spinner('Saving course-course recommendations to database')
-
-    try:
-        model.save_course_course_recommendations()
-
-        output.spinner_success()
-    except Exception as err:
-        output.spinner_fail(str(err))
-
 
 def main():
     output.title('START MODELING', color='magenta')
@@ -110,5 +224,23 @@ def main():
     output.success('Data modeling completed')
 
 
+def save_profile():
+    """Prints the profiling report and saves it as JSON"""
+    if not profiler.enabled:
+        return
+
+    file_name = path.join(PROFILES_DIR, 'model-{}.json'.format(profiler.started_on.strftime('%Y%m%dT%H%M%S')))
+    profiler.save(file_name, metadata={option: value for option, value in vars(args).items()
+                                       if option not in ('username', 'password')})
+
+    output.table(profiler.table())
+    output.info('Profiling report saved to {}'.format(file_name))
+
+
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    finally:
+        save_profile()
+        output.info('Database usage: {}'.format(DbService.stats_summary()))
+        DbService.dispose_engines()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+import argparse
+
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from utils import Output, is_valid_user, add_arguments
+from classes import DbService, Model
+from classes.ann import ContentIndex
+from classes.text_functions import normalize_texts
+
+parser = argparse.ArgumentParser(description='Finds the courses most similar to a text with the content index built '
+                                             'by the modeling pipeline',
+                                 usage='python similar_courses.py user password [OPTIONS]')
+
+add_arguments(parser)
+
+parser.add_argument('-t', '--title',
+                    dest='title',
+                    default='',
+                    help='Title of the course',
+                    metavar='')
+
+parser.add_argument('-d', '--description',
+                    dest='description',
+                    default='',
+                    help='Description of the course',
+                    metavar='')
+
+parser.add_argument('-c', '--course-id',
+                    dest='course_id',
+                    help='Takes the title and description of a course of the database, such as a course added after '
+                         'the last modeling run',
+                    metavar='')
+
+parser.add_argument('-k', '--top-k',
+                    dest='top_k',
+                    type=int,
+                    default=20,
+                    help='Maximum number of similar courses',
+                    metavar='')
+
+parser.add_argument('-m', '--min-similarity',
+                    dest='min_similarity',
+                    type=float,
+                    default=0.5,
+                    help='Minimum similarity of a course',
+                    metavar='')
+
+parser.add_argument('--save',
+                    dest='save',
+                    action='store_true',
+                    help='Replaces the content similarities of the course in the database with the ones found. '
+                         'Requires --course-id')
+
+args = parser.parse_args()
+
+output = Output()
+
+# Approximate nearest neighbour index of the courses contents, saved by model.py
+CONTENT_INDEX_DIR = 'data/content_index'
+
+
+def main():
+    output.title('SIMILAR COURSES', color='magenta')
+    output.start_spinner('Validating user credentials')
+    if is_valid_user(args.username, args.password):
+        output.spinner_success()
+    else:
+        output.spinner_fail('Invalid username or password')
+        exit(1)
+
+    if not (args.course_id or args.title or args.description):
+        output.error('Supply a --title, a --description or a --course-id')
+        exit(1)
+
+    if args.save and not args.course_id:
+        output.error('--save requires --course-id')
+        exit(1)
+
+    model = Model(args.username, args.password, args.db_name, args.db_host)
+    title, description = args.title, args.description
+
+    if args.course_id:
+        output.start_spinner('Retrieving course {}'.format(args.course_id))
+
+        try:
+            course_df = model.create_df_from_query(text('SELECT title, description FROM courses WHERE id = :course_id'),
+                                                   params={'course_id': args.course_id})
+        except Exception as err:
+            output.spinner_fail(str(err))
+            exit(1)
+
+        if course_df.shape[0] == 0:
+            output.spinner_fail('Course {} not found'.format(args.course_id))
+            exit(1)
+
+        title, description = course_df.loc[0, 'title'], course_df.loc[0, 'description']
+        output.spinner_success()
+
+    output.start_spinner('Searching similar courses')
+
+    try:
+        index = ContentIndex.load(CONTENT_INDEX_DIR)
+        content = normalize_texts(['{}. {}'.format(title, description)])
+
+        _, course_ids, similarities = index.similar_to_texts(content, top_k=args.top_k + 1,
+                                                             min_similarity=args.min_similarity)
+
+        # The course itself is in the index if it was modeled before
+        results_df = pd.DataFrame({'a_course_id': args.course_id, 'another_course_id': course_ids,
+                                   'similarity': similarities.astype(float)})
+        results_df = results_df[results_df['another_course_id'] != args.course_id].head(args.top_k)
+
+        output.spinner_success('Found {} similar courses'.format(results_df.shape[0]))
+    except Exception as err:
+        output.spinner_fail(str(err))
+        exit(1)
+
+    if results_df.shape[0] > 0:
+        titles_df = model.create_df_from_query(
+            text('SELECT id, title FROM courses WHERE id IN :course_ids').bindparams(
+                bindparam('course_ids', expanding=True)),
+            params={'course_ids': list(results_df['another_course_id'])})
+        titles = dict(zip(titles_df['id'], titles_df['title']))
+
+        output.table([['Title', 'Course', 'Similarity']] +
+                     [[titles.get(course_id, ''), course_id, '{:.3f}'.format(similarity)]
+                      for course_id, similarity in zip(results_df['another_course_id'], results_df['similarity'])])
+
+    if args.save:
+        output.start_spinner('Saving the content similarities of course {}'.format(args.course_id))
+
+        try:
+            model.replace_course_content_similarities([args.course_id], results_df)
+
+            output.spinner_success()
+        except Exception as err:
+            output.spinner_fail(str(err))
+            exit(1)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        output.info('Database usage: {}'.format(DbService.stats_summary()))
+        DbService.dispose_engines()
@@ -1,6 +1,9 @@
 from termcolor import cprint
 from halo import Halo
 import argparse
+from typing import List
+
+from classes.pipeline import STAGE_STARTED, STAGE_SUCCEEDED, STAGE_FAILED, STAGE_SKIPPED, Stage
 
 
 class Output:
@@ -25,6 +28,9 @@ class Output:
         self.sp.text_color = color if color else self.DEFAULT_COLOR
         self.sp.start(text=message)
 
+    def spinner_text(self, message: str):
+        self.sp.text = message
+
     def spinner_success(self, message: str = None, color: str = None, message_color: str = None):
         self.sp.text_color = color if color else self.SUCCESS_COLOR
         self.sp.succeed()
@@ -59,6 +65,24 @@ class Output:
     def error(self, message: str):
         self.write(message, 'error', '✗')
 
+    def table(self, rows: List[List[str]], color: str = None):
+        """Prints rows as a table. The first row is the header, the other columns are aligned to the right"""
+        if not color:
+            color = self.DEFAULT_COLOR
+
+        widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+
+        def line(row):
+            return '  '.join(value.ljust(width) if column == 0 else value.rjust(width)
+                             for column, (value, width) in enumerate(zip(row, widths)))
+
+        print('')
+        cprint(line(rows[0]), color=color, attrs=['bold'])
+        cprint('-' * len(line(rows[0])), color=color)
+        for row in rows[1:]:
+            cprint(line(row), color=color)
+        print('')
+
     def write(self, message: str, message_type: str = 'default', symbol: str = ''):
         color = self.types_colors[message_type]
 
@@ -70,6 +94,49 @@ class Output:
         print('')
 
 
+class PipelineProgress:
+    """Shows the progress of a pipeline with the output spinner.
+
+    The spinner lists the running stages. When a stage finishes, its result is printed above the spinner, which keeps
+    spinning while other stages run.
+    """
+
+    def __init__(self, output: Output):
+        """PipelineProgress constructor
+
+        :param output: Output used by the script
+        """
+        self.output = output
+        self.running = []
+
+    def __call__(self, event: str, stage: Stage, detail):
+        """Pipeline progress callback. See `Pipeline.run`"""
+        if event == STAGE_STARTED:
+            self.running.append(stage.description)
+
+            if len(self.running) == 1:
+                self.output.start_spinner(stage.description)
+            else:
+                self.output.spinner_text(', '.join(self.running))
+
+            return
+
+        if event == STAGE_SKIPPED:
+            self.output.warning('{}: skipped'.format(stage.description))
+            return
+
+        self.running.remove(stage.description)
+        self.output.spinner_text(stage.description)
+
+        if event == STAGE_SUCCEEDED:
+            self.output.spinner_success(stage.summary(detail) if stage.summary else None)
+        elif event == STAGE_FAILED:
+            self.output.spinner_fail(str(detail))
+
+        if self.running:
+            self.output.start_spinner(', '.join(self.running))
+
+
 def is_valid_user(username: str, password: str) -> bool:
     """Checks if user credentials are correct
 
@@ -86,7 +153,7 @@ def is_valid_user(username: str, password: str) -> bool:
     return False
 
 
-def arguments(parser):
+def add_arguments(parser):
     parser.add_argument('username', help='Username')
     parser.add_argument('password', help='Password')
 
@@ -100,6 +167,10 @@ def arguments(parser):
                         help='Database host',
                         metavar='')
 
+
+def arguments(parser):
+    add_arguments(parser)
+
     args = parser.parse_args()
 
     return args.username, args.password, args.db_name, args.db_host
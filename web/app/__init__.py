@@ -1,9 +1,11 @@
 from flask import Flask
 from flask_bootstrap import Bootstrap
 from flask_sqlalchemy import SQLAlchemy
+from .artifacts import ArtifactManager
 
 bootstrap = Bootstrap()
 db = SQLAlchemy()
+artifact_manager = ArtifactManager()
 
 
 def create_app(config):
@@ -12,6 +14,7 @@ def create_app(config):
     app.config.from_object(config)
     bootstrap.init_app(app)
     db.init_app(app)
+    artifact_manager.init_app(app)
 
     from . import main
     app.register_blueprint(main.main)
@@ -0,0 +1,270 @@
+import hashlib
+import json
+import os
+import signal
+import threading
+from typing import Optional
+
+import numpy as np
+from flask import g, has_app_context
+from scipy.sparse import csr_matrix
+
+FORMAT_VERSION = 1
+METADATA_FILE = 'metadata.json'
+CURRENT_FILE = 'CURRENT'
+
+
+class UserCoursesMatrix:
+    """Leads user-item matrix backed by memory-mapped NumPy arrays.
+
+    The arrays are opened with `mmap_mode='r'`, so all the worker processes reading the same files share one copy of
+    them in the page cache and opening the matrix does not read it into memory.
+    """
+
+    ARRAYS = ('indptr', 'indices', 'data', 'user_ids', 'course_ids')
+
+    def __init__(self, directory: str):
+        """UserCoursesMatrix constructor
+
+        :param directory: Bundle version directory saved by the modeling pipeline
+        :raises: ValueError if the bundle format is not supported or its header does not match the arrays
+        """
+        self.directory = directory
+
+        with open(os.path.join(directory, METADATA_FILE), 'r') as file:
+            self.metadata = json.load(file)
+
+        if self.metadata.get('format_version') != FORMAT_VERSION:
+            raise ValueError('Unsupported bundle format version {}'.format(self.metadata.get('format_version')))
+
+        arrays = {name: np.load(os.path.join(directory, '{}.npy'.format(name)), mmap_mode='r')
+                  for name in self.ARRAYS}
+
+        self.user_ids = arrays['user_ids']
+        self.course_ids = arrays['course_ids']
+
+        if (len(self.user_ids), len(self.course_ids)) != (self.metadata['rows'], self.metadata['columns']):
+            raise ValueError('Bundle {} id tables do not match its header'.format(self.version))
+
+        self.matrix = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                 shape=(len(self.user_ids), len(self.course_ids)),
+                                 copy=False)
+
+    @property
+    def version(self) -> str:
+        """Returns the bundle version
+
+        :return: The bundle version
+        """
+        return self.metadata['version']
+
+    def verify(self):
+        """Checks the arrays against the checksums stored in the bundle header. Reads every file once
+
+        :raises: ValueError if any checksum does not match
+        """
+        for name in self.ARRAYS:
+            digest = hashlib.sha256()
+
+            with open(os.path.join(self.directory, '{}.npy'.format(name)), 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+
+            if digest.hexdigest() != self.metadata['checksums'][name]:
+                raise ValueError('Bundle {} is corrupt: {} checksum mismatch'.format(self.version, name))
+
+    def user_index(self, user_id: str) -> Optional[int]:
+        """Returns the matrix row of a user
+
+        :param user_id: User identifier
+        :return: The row index or `None` if the user is not in the matrix
+        """
+        idx = int(np.searchsorted(self.user_ids, user_id))
+
+        if idx == len(self.user_ids) or self.user_ids[idx] != user_id:
+            return None
+
+        return idx
+
+    def similar_users(self, user_id: str, min_similarity: int = 1) -> np.ndarray:
+        """Creates an array of similar users based on leads generated on the same courses
+
+        :param user_id: User id for which we want to find similar users
+        :param min_similarity: Minimum similarity between users to be listed
+        :return numpy.array: Array of similar users sorted by similarity
+        """
+        idx = self.user_index(user_id)
+
+        if idx is None:
+            return np.array([])
+
+        user_courses = self.matrix[idx].T.astype(np.int32)
+        similarities = np.asarray(self.matrix.dot(user_courses).todense()).ravel()
+
+        candidates = np.flatnonzero(similarities >= min_similarity)
+        candidates = candidates[candidates != idx]
+        candidates = candidates[np.argsort(-similarities[candidates], kind='stable')]
+
+        return np.array(self.user_ids[candidates])
+
+
+def current_version(root: str) -> Optional[str]:
+    """Returns the published bundle version
+
+    :param root: Directory that contains the bundle versions
+    :return: The version name or `None` if no version has been published
+    """
+    try:
+        with open(os.path.join(root, CURRENT_FILE), 'r') as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_user_courses_bundle(root: str, version: str = None, verify: bool = False) -> UserCoursesMatrix:
+    """Opens a user courses bundle version
+
+    :param root: Directory that contains the bundle versions
+    :param version: Version to open. If `None`, the published version will be opened
+    :param verify: Whether or not to check the arrays checksums
+    :return: The leads user-item matrix
+    :raises: FileNotFoundError if there is no published version
+    """
+    if version is None:
+        version = current_version(root)
+
+    if version is None:
+        raise FileNotFoundError('There is no user courses bundle in {}'.format(root))
+
+    user_courses_matrix = UserCoursesMatrix(os.path.join(root, version))
+
+    if verify:
+        user_courses_matrix.verify()
+
+    return user_courses_matrix
+
+
+class ArtifactManager:
+    """Flask extension that serves the published user courses bundle and hot-reloads new versions.
+
+    A background thread watches the `CURRENT` file of the bundles directory. When a new version is published, it is
+    opened and verified off the request path and then swapped in with a single reference assignment. Every request
+    pins the version it uses first, so requests already running keep using the old version until they finish.
+
+    Every worker process has its own manager, watcher and loaded version. The watcher checks for a new version every
+    `ARTIFACTS_POLL_INTERVAL` seconds, and right away when the process receives `ARTIFACTS_RELOAD_SIGNAL`. `reload`,
+    and so the reload endpoint, only reloads the worker process that calls it.
+    """
+
+    def __init__(self, app=None):
+        """ArtifactManager constructor
+
+        :param app: Flask application. If None, `init_app` must be called later
+        """
+        self.root = None
+        self.poll_interval = None
+        self.reload_signal = None
+        self.logger = None
+        self._current = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._watcher_pid = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Reads the configuration and registers the request hooks
+
+        :param app: Flask application
+        """
+        self.root = app.config['ARTIFACTS_DIR']
+        self.poll_interval = app.config.get('ARTIFACTS_POLL_INTERVAL') or None
+        self.reload_signal = app.config.get('ARTIFACTS_RELOAD_SIGNAL')
+        self.logger = app.logger
+
+        app.before_request(self._start_watcher)
+
+    def _start_watcher(self):
+        """Makes sure the watcher thread runs in this process, and that the reload signal wakes it up
+
+        The watcher and the signal handler are set up lazily, on the first request of every worker process, so that
+        they are never set up in the master process of a pre-forking server, whose signals the server handles. The
+        watcher runs if there is a poll interval or a reload signal: without a poll interval it only checks for a new
+        version when the signal is received.
+        """
+        if self._watcher_pid == os.getpid() or not (self.poll_interval or self.reload_signal):
+            return
+
+        self._watcher_pid = os.getpid()
+        # The event may have been set in the parent process before forking
+        self._wakeup.clear()
+
+        if self.reload_signal:
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(getattr(signal, self.reload_signal), lambda signum, frame: self._wakeup.set())
+            elif self.logger:
+                self.logger.warning('Requests are not handled by the main thread, %s cannot be handled',
+                                    self.reload_signal)
+
+        threading.Thread(target=self._watch, name='artifact-watcher', daemon=True).start()
+
+    @property
+    def current(self) -> UserCoursesMatrix:
+        """Returns the latest loaded bundle version. The first access opens the published version
+
+        :return: The leads user-item matrix
+        """
+        if self._current is None:
+            self.reload(verify=False)
+
+        return self._current
+
+    def user_courses_matrix(self) -> UserCoursesMatrix:
+        """Returns the bundle version pinned to the running request, or the current one outside of a request
+
+        The first call within a request pins the current version, so the whole request sees the same version even if
+        a new one is swapped in meanwhile.
+
+        :return: The leads user-item matrix
+        """
+        if not has_app_context():
+            return self.current
+
+        if 'user_courses_matrix' not in g:
+            g.user_courses_matrix = self.current
+
+        return g.user_courses_matrix
+
+    def reload(self, force: bool = False, verify: bool = True) -> bool:
+        """Loads the published bundle version if it is not the current one and swaps it in
+
+        :param force: Whether or not to reload the published version even if it is already loaded
+        :param verify: Whether or not to check the arrays checksums before swapping the version in
+        :return: Returns `True` if a new version has been swapped in, returns `False` otherwise
+        """
+        with self._lock:
+            version = current_version(self.root)
+            if not force and self._current is not None and self._current.version == version:
+                return False
+
+            user_courses_matrix = load_user_courses_bundle(self.root, version, verify=verify)
+            self._current = user_courses_matrix
+
+        if self.logger:
+            self.logger.info('User courses bundle version %s loaded', version)
+
+        return True
+
+    def _watch(self):
+        """Polls the bundles directory for new versions. A reload signal wakes it up immediately. Without a poll
+        interval, it only wakes up on the reload signal
+        """
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+            try:
+                self.reload()
+            except Exception:
+                self.logger.exception('Cannot load the user courses bundle')
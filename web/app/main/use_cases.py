@@ -1,6 +1,8 @@
+import os
 from ..models import CourseRepository, CategoryRepository, Paginator
 from ..models import Lead, LeadRepository
 from ..recommender import Recommender
+from .. import artifact_manager
 from typing import Dict, Optional
 import hashlib
 
@@ -217,3 +219,21 @@ class RetrieveCategories:
         category_repository = CategoryRepository()
 
         return {'categories': category_repository.find_popular(min_weighted_rating=0.0)}
+
+
+class ReloadArtifacts:
+    """Use case class to swap in the published user courses bundle"""
+
+    @staticmethod
+    def execute() -> Dict:
+        """Loads the published user courses bundle version if it is not the current one
+
+        Only the worker process that handles the request is reloaded. The other workers pick up the new version with
+        their watcher: on their next poll, or right away if they are sent the reload signal.
+
+        :return: A dictionary with the current version, whether or not it has been reloaded and the process id of the
+            reloaded worker
+        """
+        reloaded = artifact_manager.reload()
+
+        return {'reloaded': reloaded, 'version': artifact_manager.current.version, 'pid': os.getpid()}
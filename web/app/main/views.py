@@ -1,10 +1,12 @@
-from flask import render_template, request, abort, session, redirect, url_for
+import hmac
+from flask import render_template, request, abort, session, redirect, url_for, current_app, jsonify
 from . import main
 from .use_cases import RetrieveCourseCatalog, RetrieveCourseCatalogCommand
 from .use_cases import RetrieveCourseData, RetrieveCourseDataCommand
 from .use_cases import PlaceAnInfoRequest, PlaceAnInfoRequestCommand
 from .use_cases import RetrieveHomeRecommendations, RetrieveHomeRecommendationsCommand
 from .use_cases import RetrieveCategories
+from .use_cases import ReloadArtifacts
 
 users = [
     '1460318498c1f53bb880ce2e6d9ef64b',
@@ -97,3 +99,15 @@ def request_information():
         return abort(500)
 
     return render_template('request-information.html', response=response)
+
+
+@main.route('/admin/reload-artifacts', methods=['POST'])
+def reload_artifacts():
+    token = current_app.config.get('ARTIFACTS_RELOAD_TOKEN')
+
+    if not token or not hmac.compare_digest(request.headers.get('X-Reload-Token', ''), token):
+        return abort(404)
+
+    response = ReloadArtifacts.execute()
+
+    return jsonify(response)
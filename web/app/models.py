@@ -253,6 +253,9 @@ class Course:
 class CourseRepository(Repository):
     """Category repository. Manages the queries that concern the courses"""
 
+    RANKING_BY_LEADS = 'leads'
+    RANKING_BY_RATING = 'rating'
+
     def find_all_by(self, category: int = None,
                     max_rows: int = None,
                     exclude: str = None,
@@ -268,7 +271,9 @@ class CourseRepository(Repository):
         :param min_weighted_rating: Minimum weighted rating to be listed
         :param order_by: Columns by which the result will be sorted. It can be a list of columns and the result sorting
             will be in ascending order; or a dictionary whose keys must be the column names and the values must be the
-            sorting direction of that column. Ex: {'num_reviews': 'ASC', 'weighted_rating': 'DESC'}
+            sorting direction of that column. Ex: {'c.num_reviews': 'ASC', 'c.weighted_rating': 'DESC'}. Qualify the
+            columns with the `c` alias: an unqualified `weighted_rating` sorts by the rounded rating of the select list,
+            which no index can serve
         :return: A collection of courses
         """
         query = '''SELECT c.id, c.title, c.description, c.category_id, cat.name AS category_name, c.center,
@@ -285,8 +290,6 @@ class CourseRepository(Repository):
         if exclude:
             query = '{} AND c.id <> :course_id'.format(query)
 
-        query = '{} GROUP BY c.id'.format(query)
-
         if order_by:
             if isinstance(order_by, list):
                 order_by = ', '.join(order_by)
@@ -314,7 +317,8 @@ class CourseRepository(Repository):
         return self.find_all_by(category=category,
                                 max_rows=max_rows,
                                 exclude=exclude,
-                                order_by={'number_of_leads': 'DESC', 'weighted_rating': 'DESC', 'num_reviews': 'DESC'})
+                                order_by={'c.number_of_leads': 'DESC', 'c.weighted_rating': 'DESC',
+                                          'c.num_reviews': 'DESC'})
 
     def find_sorted_by_rating(self, category: int = None,
                               max_rows: int = None,
@@ -329,11 +333,45 @@ class CourseRepository(Repository):
         return self.find_all_by(category=category,
                                 max_rows=max_rows,
                                 exclude=exclude,
-                                order_by={'weighted_rating': 'DESC', 'num_reviews': 'DESC', 'number_of_leads': 'DESC'})
+                                order_by={'c.weighted_rating': 'DESC', 'c.num_reviews': 'DESC',
+                                          'c.number_of_leads': 'DESC'})
+
+    def find_ranked(self, ranking: str, category: int = None,
+                    max_rows: int = None,
+                    exclude: str = None) -> Dict[str, Course]:
+        """Returns a collection of courses from the ranked lists precomputed by the ETL pipeline
+
+        The lists are sorted as `find_sorted_by_leads` and `find_sorted_by_rating` sort the courses, but they only
+        keep a few courses more than the number of rank based recommendations.
+
+        :param ranking: leads|rating
+        :param category: Category to which the courses belong. If None, the list of all categories is used
+        :param max_rows: Maximum number of courses to retrieve. The limit in the select query
+        :param exclude: Course ids excluded from search
+        :return: A collection of courses
+        """
+        query = '''SELECT c.id, c.title, c.description, c.category_id, cat.name AS category_name, c.center,
+                        c.number_of_leads, c.num_reviews, ROUND(c.weighted_rating, 2) AS weighted_rating
+                   FROM ranked_courses r
+                   JOIN courses c ON r.course_id = c.id
+                   JOIN categories cat ON c.category_id = cat.id
+                   WHERE r.ranking = :ranking
+                   AND r.category_id = :category_id
+                   '''
+
+        if exclude:
+            query = '{} AND r.course_id <> :course_id'.format(query)
+
+        query = '{} ORDER BY r.position'.format(query)
+
+        return self.build_response(query, limit=max_rows,
+                                   ranking=ranking,
+                                   category_id=category if category else 0,
+                                   course_id=exclude)
 
     def find_similar_by_leads(self, course_id: str, max_rows: int = None) -> Dict[str, Course]:
         """Returns a collection of recommended courses. The courses have in common that the same user generated a
-            lead in them.
+            lead in them. The courses that share the most users with the course come first.
 
         :param course_id: Course identifier from which we want to look for the similar
         :param max_rows: Maximum number of courses to retrieve. The limit in the select query
@@ -346,7 +384,7 @@ class CourseRepository(Repository):
                 JOIN courses c ON r.recommended = c.id
                 JOIN categories cat ON cat.id = c.category_id
                 WHERE r.course = :course_id
-                ORDER BY number_of_leads DESC, weighted_rating DESC, num_reviews DESC'''
+                ORDER BY r.score DESC'''
 
         return self.build_response(query, course_id=course_id, limit=max_rows)
 
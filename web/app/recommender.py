@@ -1,7 +1,6 @@
 import numpy as np
-import os
+from . import artifact_manager
 from .models import CourseRepository
-import pickle
 
 
 def find_similar_users(user_id: str, min_similarity: int = 1) -> np.ndarray:
@@ -11,35 +10,15 @@ def find_similar_users(user_id: str, min_similarity: int = 1) -> np.ndarray:
     :param min_similarity: Minimum similarity between users to be listed
     :return numpy.array: Array of similar users sorted by similarity
     """
-    # Loading sparse leads user-item matrix from file
-    dirname = os.path.dirname(os.path.abspath(__file__))
-    user_map_courses_file = '{}/../data/user_requested_courses_map.pickle'.format(dirname)
-
-    with open(user_map_courses_file, 'rb') as filename:
-        user_courses_map = pickle.load(filename)
-
-    user_courses = np.array(user_courses_map[user_id].todense())[0]
-
-    similarities = dict()
-
-    for another_user_id, another_user_courses in user_courses_map.items():
-        if user_id == another_user_id:
-            continue
-
-        similarity = np.dot(user_courses, np.array(another_user_courses.todense())[0])
-        if similarity < min_similarity:
-            continue
-
-        similarities[another_user_id] = similarity
-
-    sorted_similarities = sorted(similarities.items(), key=lambda item: item[1], reverse=True)
-
-    return np.array([user_id for (user_id, similarity) in sorted_similarities])
+    return artifact_manager.user_courses_matrix().similar_users(user_id, min_similarity)
 
 
 class Recommender:
     """Makes courses recommendations"""
 
+    # Length of the ranked lists precomputed by the ETL pipeline, without the spare courses
+    MAX_RANKED_RECOMMENDATIONS = 10
+
     def __init__(self):
         """Recommender constructor. Initializes the object."""
 
@@ -72,12 +51,23 @@ class Recommender:
         :param max_recommendations: Maximum number of recommendations
         :return: `Recommender` class
         """
-        self.by_rating = self.course_repository.find_sorted_by_rating(category=category_id,
-                                                                      max_rows=max_recommendations,
-                                                                      exclude=exclude_course_id)
-        self.by_number_of_leads = self.course_repository.find_sorted_by_leads(category=category_id,
-                                                                              max_rows=max_recommendations,
-                                                                              exclude=exclude_course_id)
+        if max_recommendations > self.MAX_RANKED_RECOMMENDATIONS:
+            self.by_rating = self.course_repository.find_sorted_by_rating(category=category_id,
+                                                                          max_rows=max_recommendations,
+                                                                          exclude=exclude_course_id)
+            self.by_number_of_leads = self.course_repository.find_sorted_by_leads(category=category_id,
+                                                                                  max_rows=max_recommendations,
+                                                                                  exclude=exclude_course_id)
+            return self
+
+        self.by_rating = self.course_repository.find_ranked(CourseRepository.RANKING_BY_RATING,
+                                                            category=category_id,
+                                                            max_rows=max_recommendations,
+                                                            exclude=exclude_course_id)
+        self.by_number_of_leads = self.course_repository.find_ranked(CourseRepository.RANKING_BY_LEADS,
+                                                                     category=category_id,
+                                                                     max_rows=max_recommendations,
+                                                                     exclude=exclude_course_id)
 
         return self
 
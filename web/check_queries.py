@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""Runs `EXPLAIN` on the queries of every repository method against the loaded schema
+
+The script fails if any query reads a whole table or needs a filesort, unless the table or the query is exempted
+below. Run it after the ETL and modeling pipelines have loaded the database:
+
+    $ python check_queries.py
+"""
+
+import os
+import sys
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import CategoryRepository, CourseRepository
+
+# Tables (by their alias in the queries) that may be read in full
+ALLOWED_FULL_SCANS = {
+    'cat': 'categories has one row per category, reading it in full is cheaper than any index',
+}
+
+# Queries that may need a filesort
+ALLOWED_FILESORTS = {
+    'CategoryRepository.find_all': 'sorted by an aggregate of the courses of each category',
+    'CategoryRepository.find_popular': 'sorted by aggregates of the courses of each category',
+}
+
+# Queries that may read the courses table in full, besides the tables in ALLOWED_FULL_SCANS
+ALLOWED_COURSES_FULL_SCANS = {
+    'CategoryRepository.find_all': 'counts the courses of every category',
+    'CategoryRepository.find_popular': 'aggregates the courses of every category',
+}
+
+
+def sample_parameters() -> Dict:
+    """Takes existing identifiers from the database, so that the queries return rows
+
+    :return: A course, a category, a user and a course with content similarities
+    """
+    row = db.engine.execute('SELECT user_id, course_id FROM clean_leads LIMIT 1').first()
+    category_id = db.engine.execute('SELECT category_id FROM courses LIMIT 1').scalar()
+    similar_course_id = db.engine.execute('SELECT a_course_id FROM courses_similarities LIMIT 1').scalar()
+
+    return {'user_id': row['user_id'], 'course_id': row['course_id'], 'category_id': category_id,
+            'similar_course_id': similar_course_id}
+
+
+def repository_calls(params: Dict) -> List[Tuple[str, Callable]]:
+    """Returns the repository methods to check, called as the web application calls them
+
+    :param params: Identifiers returned by `sample_parameters`
+    :return: A list of (name, call) tuples
+    """
+    course_repository = CourseRepository()
+    category_repository = CategoryRepository()
+
+    return [
+        ('CategoryRepository.find_all', lambda: category_repository.find_all(max_rows=10)),
+        ('CategoryRepository.find_popular', lambda: category_repository.find_popular(max_rows=10)),
+        ('CategoryRepository.find', lambda: category_repository.find(params['category_id'])),
+        ('CourseRepository.find_sorted_by_leads',
+         lambda: course_repository.find_sorted_by_leads(params['category_id'], 10, params['course_id'])),
+        ('CourseRepository.find_sorted_by_rating',
+         lambda: course_repository.find_sorted_by_rating(params['category_id'], 10, params['course_id'])),
+        ('CourseRepository.find_ranked',
+         lambda: course_repository.find_ranked(CourseRepository.RANKING_BY_LEADS, params['category_id'], 10,
+                                               params['course_id'])),
+        ('CourseRepository.find_similar_by_leads',
+         lambda: course_repository.find_similar_by_leads(params['course_id'], 10)),
+        ('CourseRepository.find_similar_by_content',
+         lambda: course_repository.find_similar_by_content(params['similar_course_id'], 10)),
+        ('CourseRepository.find_requested_by_user',
+         lambda: course_repository.find_requested_by_user(params['user_id'])),
+        ('CourseRepository.find', lambda: course_repository.find(params['course_id'])),
+    ]
+
+
+def capture_statements(call: Callable) -> List[Tuple[str, Dict]]:
+    """Runs a repository method and records the statements it sends to the database
+
+    :param call: Repository method call
+    :return: A list of (statement, parameters) tuples
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        call()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    return statements
+
+
+def check_plan(name: str, plan: List[Dict]) -> List[str]:
+    """Checks the `EXPLAIN` rows of a query
+
+    :param name: Repository method name
+    :param plan: `EXPLAIN` rows
+    :return: The problems found
+    """
+    problems = []
+
+    for row in plan:
+        table = row['table']
+        extra = row['Extra'] or ''
+
+        if row['type'] == 'ALL' and table not in ALLOWED_FULL_SCANS and \
+                not (table == 'c' and name in ALLOWED_COURSES_FULL_SCANS):
+            problems.append('full scan of {}'.format(table))
+
+        if 'Using filesort' in extra and name not in ALLOWED_FILESORTS:
+            problems.append('filesort on {}'.format(table))
+
+    return problems
+
+
+def main() -> int:
+    environment = os.environ.get('FLASK_ENV', 'development')
+    app = create_app('config.{}Config'.format(environment.capitalize()))
+
+    failures = 0
+
+    with app.app_context():
+        params = sample_parameters()
+
+        for name, call in repository_calls(params):
+            for statement, parameters in capture_statements(call):
+                if not statement.lstrip().upper().startswith('SELECT'):
+                    continue
+
+                plan = [dict(row) for row in db.engine.execute('EXPLAIN {}'.format(statement), parameters)]
+                problems = check_plan(name, plan)
+
+                print('{} {}'.format('FAIL' if problems else 'OK  ', name))
+                for row in plan:
+                    print('     {:<6} {:<8} {:<40} {}'.format(row['table'] or '', row['type'] or '',
+                                                              row['key'] or '', row['Extra'] or ''))
+                for problem in problems:
+                    print('     -> {}'.format(problem))
+
+                failures += len(problems) > 0
+
+    print('\n{} queries with problems'.format(failures))
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
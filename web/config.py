@@ -1,3 +1,5 @@
+import os
+
 
 class Config:
     DEBUG = False
@@ -12,6 +14,15 @@ class Config:
                                                            DB_HOST,
                                                            DB_NAME)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Directory with the user courses bundle versions written by the modeling pipeline
+    ARTIFACTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'user_courses')
+    # Seconds between checks for a new bundle version. Zero or None disables polling
+    ARTIFACTS_POLL_INTERVAL = 60
+    # Token required by the reload endpoint. If None, the endpoint is disabled
+    ARTIFACTS_RELOAD_TOKEN = os.environ.get('ARTIFACTS_RELOAD_TOKEN')
+    # Signal that makes a worker check for a new bundle version immediately, e.g. 'SIGUSR2'. The handler is installed
+    # in every worker on its first request, so requests must be handled by the main thread of the worker
+    ARTIFACTS_RELOAD_SIGNAL = None
 
 
 class DevelopmentConfig(Config):
@@ -20,6 +31,7 @@ class DevelopmentConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    ARTIFACTS_POLL_INTERVAL = None
 
 
 class ProductionConfig(Config):